@@ -14,6 +14,7 @@ logging.basicConfig()
 import flatisfy.config
 from flatisfy import cmds
 from flatisfy import data
+from flatisfy import database
 from flatisfy import fetch
 from flatisfy import tools
 from flatisfy import tests
@@ -53,7 +54,14 @@ def parse_args(argv=None):
     subparsers = parser.add_subparsers(dest="cmd", help="Available subcommands")
 
     # Build data subcommand
-    subparsers.add_parser("build-data", parents=[parent_parser], help="Build necessary data")
+    parser_build_data = subparsers.add_parser(
+        "build-data", parents=[parent_parser], help="Build necessary data"
+    )
+    parser_build_data.add_argument(
+        "--force",
+        action="store_true",
+        help="Rebuild all the data, even if their data files did not change.",
+    )
 
     # Init config subcommand
     parser_init_config = subparsers.add_parser(
@@ -153,7 +161,7 @@ def main():
 
     # Build data files command
     if args.cmd == "build-data":
-        data.preprocess_data(config, force=True)
+        data.preprocess_data(config, force=args.force)
         return
     # Fetch command
     if args.cmd == "fetch":
@@ -200,3 +208,6 @@ if __name__ == "__main__":
         main()
     except KeyboardInterrupt:
         pass
+    finally:
+        # Release the database connections and the search indexes
+        database.close_db()
@@ -9,14 +9,19 @@ import logging
 import os
 
 import flatisfy.filters
+from flatisfy import data
 from flatisfy import database
 from flatisfy import email
+from flatisfy.models import address as address_model
 from flatisfy.models import flat as flat_model
+from flatisfy.models import opendata_build as opendata_build_model
 from flatisfy.models import postal_code as postal_code_model
 from flatisfy.models import public_transport as public_transport_model
 from flatisfy import fetch
 from flatisfy import tools
+from flatisfy.filters import images
 from flatisfy.filters import metadata
+from flatisfy.filters.cache import GeocodingCache
 from flatisfy.web import app as web_app
 import time
 from ratelimit.exception import RateLimitException
@@ -24,7 +29,15 @@ from ratelimit.exception import RateLimitException
 LOGGER = logging.getLogger(__name__)
 
 
-def filter_flats_list(config, constraint_name, flats_list, fetch_details=True, past_flats=None):
+def filter_flats_list(
+    config,
+    constraint_name,
+    flats_list,
+    fetch_details=True,
+    past_flats=None,
+    image_service=None,
+    geocoding_cache=None,
+):
     """
     Filter the available flats list. Then, filter it according to criteria.
 
@@ -35,8 +48,21 @@ def filter_flats_list(config, constraint_name, flats_list, fetch_details=True, p
     :param fetch_details: Whether additional details should be fetched between
         the two passes.
     :param past_flats: The list of already fetched flats
+    :param image_service: The ``ImageService`` to share images between the
+        filtering passes. A new one is created, and its statistics logged
+        afterwards, if not provided.
+    :param geocoding_cache: The ``GeocodingCache`` to share between the
+        filtering passes. A new one is created and saved afterwards if not
+        provided.
     :return: A dict mapping flat status and list of flat objects.
     """
+    log_image_stats = image_service is None
+    if log_image_stats:
+        image_service = images.ImageService(config)
+    save_cache = geocoding_cache is None
+    if save_cache:
+        geocoding_cache = GeocodingCache(config)
+
     # Add the flatisfy metadata entry and prepare the flat objects
     flats_list = metadata.init(flats_list, constraint_name)
 
@@ -56,7 +82,9 @@ def filter_flats_list(config, constraint_name, flats_list, fetch_details=True, p
     # Do a first pass with the available infos to try to remove as much
     # unwanted postings as possible
     if config["passes"] > 0:
-        first_pass_result = flatisfy.filters.first_pass(flats_list, constraint, config)
+        first_pass_result = flatisfy.filters.first_pass(
+            flats_list, constraint, config, geocoding_cache
+        )
     else:
         first_pass_result["new"] = flats_list
 
@@ -85,16 +113,29 @@ def filter_flats_list(config, constraint_name, flats_list, fetch_details=True, p
     # Do a second pass to consolidate all the infos we found and make use of
     # additional infos
     if config["passes"] > 1:
-        second_pass_result = flatisfy.filters.second_pass(first_pass_result["new"], constraint, config)
+        second_pass_result = flatisfy.filters.second_pass(
+            first_pass_result["new"], constraint, config, geocoding_cache
+        )
     else:
         second_pass_result["new"] = first_pass_result["new"]
 
     # Do a third pass to deduplicate better
     if config["passes"] > 2:
-        third_pass_result = flatisfy.filters.third_pass(second_pass_result["new"], config)
+        third_pass_result = flatisfy.filters.third_pass(
+            second_pass_result["new"], config, image_service
+        )
     else:
         third_pass_result["new"] = second_pass_result["new"]
 
+    # Mirror the photos of the remaining flats, once duplicates were removed
+    if config["serve_images_locally"] and config["passes"] > 1:
+        flatisfy.filters.mirror_images(third_pass_result["new"], config, image_service)
+
+    if save_cache:
+        flatisfy.filters.save_geocoding_cache(geocoding_cache)
+    if log_image_stats:
+        image_service.log_stats()
+
     return {
         "new": third_pass_result["new"],
         "duplicate": (
@@ -116,6 +157,10 @@ def filter_fetched_flats(config, fetched_flats, fetch_details=True, past_flats={
     :return: A dict mapping constraints to a dict mapping flat status and list
         of flat objects.
     """
+    # Share images and geocoding between every constraint, as the same
+    # housing posts can be fetched for multiple constraints
+    image_service = images.ImageService(config)
+    geocoding_cache = GeocodingCache(config)
     for constraint_name, flats_list in fetched_flats.items():
         fetched_flats[constraint_name] = filter_flats_list(
             config,
@@ -123,7 +168,11 @@ def filter_fetched_flats(config, fetched_flats, fetch_details=True, past_flats={
             flats_list,
             fetch_details,
             past_flats.get(constraint_name, None),
+            image_service,
+            geocoding_cache,
         )
+    image_service.log_stats()
+    flatisfy.filters.save_geocoding_cache(geocoding_cache)
     return fetched_flats
 
 
@@ -239,6 +288,12 @@ def purge_db(config):
         session.query(postal_code_model.PostalCode).delete()
         LOGGER.info("Purge all public transportations from the database.")
         session.query(public_transport_model.PublicTransport).delete()
+        LOGGER.info("Purge all addresses from the database.")
+        session.query(address_model.Address).delete()
+        session.query(opendata_build_model.OpendataBuild).delete()
+    data.remove_snapshots(config)
+    data.OPENDATA_CACHE.invalidate(config["database"])
+    GeocodingCache.invalidate(config)
 
 
 def serve(config):
@@ -67,10 +67,30 @@ DEFAULT_CONFIG = {
     "duplicate_image_hash_threshold": 10,
     # Whether images should be downloaded and served locally
     "serve_images_locally": True,
+    # Maximum number of concurrent image downloads, overall and per host
+    "image_download_workers": 8,
+    "image_download_workers_per_host": 2,
+    # Maximum bandwidth for image downloads, in bytes per second. ``None``
+    # for no limit.
+    "image_download_max_bandwidth": None,
     # Navitia API key
     "navitia_api_key": None,
     # Mapbox API key
     "mapbox_api_key": None,
+    # Whether to estimate travel times for walk, bike and car modes locally,
+    # from the distance, instead of using Mapbox.
+    "local_travel_times": False,
+    # Path to a BAN-style addresses CSV file, to geocode flats at the street
+    # level. ``None`` to only geocode flats at the city level.
+    "addresses_file": None,
+    # Path to a GTFS feed (zip file or directory) to compute public transport
+    # travel times locally instead of using Navitia. ``None`` to use Navitia.
+    "gtfs_feed": None,
+    # Travel times are cached in ``data_directory``. Maximum age of the
+    # cached travel times, in seconds, and maximum number of cached travel
+    # times.
+    "travel_time_cache_ttl": 7 * 24 * 3600,
+    "travel_time_cache_max_items": 10000,
     # Number of filtering passes to run
     "passes": 3,
     # Maximum number of entries to fetch
@@ -166,10 +186,22 @@ def validate_config(config, check_with_data):
         assert isinstance(config["max_distance_housing_station"], (int, float))
         assert isinstance(config["duplicate_threshold"], int)
         assert isinstance(config["duplicate_image_hash_threshold"], int)
+        assert isinstance(config["image_download_workers"], int) and config["image_download_workers"] > 0  # noqa: E501
+        assert isinstance(config["image_download_workers_per_host"], int) and config["image_download_workers_per_host"] > 0  # noqa: E501
+        assert config["image_download_max_bandwidth"] is None or (isinstance(config["image_download_max_bandwidth"], int) and config["image_download_max_bandwidth"] > 0)  # noqa: E501
 
         # API keys
         assert config["navitia_api_key"] is None or isinstance(config["navitia_api_key"], str)  # noqa: E501
         assert config["mapbox_api_key"] is None or isinstance(config["mapbox_api_key"], str)  # noqa: E501
+        assert isinstance(config["local_travel_times"], bool)
+        assert config["addresses_file"] is None or (
+            isinstance(config["addresses_file"], str) and os.path.isfile(config["addresses_file"])
+        )
+        assert config["gtfs_feed"] is None or (
+            isinstance(config["gtfs_feed"], str) and os.path.exists(config["gtfs_feed"])
+        )
+        assert isinstance(config["travel_time_cache_ttl"], int) and config["travel_time_cache_ttl"] >= 0  # noqa: E501
+        assert isinstance(config["travel_time_cache_max_items"], int) and config["travel_time_cache_max_items"] >= 0  # noqa: E501
 
         assert config["ignore_station"] is None or isinstance(config["ignore_station"], bool)  # noqa: E501
 
@@ -218,13 +250,11 @@ def validate_config(config, check_with_data):
                 data.preprocess_data(config, force=False)
                 # Check postal codes
                 opendata = data.load_data(PostalCode, constraint, config)
-                opendata_postal_codes = [x.postal_code for x in opendata]
-                opendata_insee_codes = [x.insee_code for x in opendata]
                 for postal_code in constraint["postal_codes"]:
-                    assert postal_code in opendata_postal_codes  # noqa: E501
+                    assert opendata.lookup("postal_code", postal_code)  # noqa: E501
                 if "insee_codes" in constraint:
                     for insee in constraint["insee_codes"]:
-                        assert insee in opendata_insee_codes  # noqa: E501
+                        assert opendata.lookup("insee_code", insee)  # noqa: E501
 
             assert "area" in constraint
             _check_constraints_bounds(constraint["area"])
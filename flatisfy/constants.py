@@ -20,8 +20,43 @@ BACKENDS_BY_PRECEDENCE = [
 ]
 
 
+# Routes by public transport are searched for next Monday at 8am, to avoid
+# looking for a route in the middle of the night if the fetch is done by
+# night.
+PUBLIC_TRANSPORT_DEPARTURE = {"weekday": 0, "hour": 8, "minute": 0}
+
+
 class TimeToModes(Enum):
     PUBLIC_TRANSPORT = -1
     WALK = 1
     BIKE = 2
     CAR = 3
+
+
+# Maximum average speed (in meters per second) for each mode of
+# transportation, as the crow flies. Used to compute a lower bound of travel
+# times without querying any API, so they should never be underestimated.
+TIME_TO_MODES_MAX_SPEEDS = {
+    TimeToModes.PUBLIC_TRANSPORT: 45,  # About 160 km/h, for regional trains
+    TimeToModes.WALK: 2.5,  # 9 km/h
+    TimeToModes.BIKE: 10,  # 36 km/h
+    TimeToModes.CAR: 40,  # About 145 km/h
+}
+
+# Model used to estimate travel times locally, without querying any API, for
+# each mode of transportation but public transport: average speed along the
+# road (in meters per second) and fixed overhead (in seconds, e.g. to park a
+# car). Distances as the crow flies are multiplied by
+# ``TIME_TO_MODES_DETOUR_FACTOR`` to account for the road network. Estimated
+# speeds as the crow flies must stay below ``TIME_TO_MODES_MAX_SPEEDS``.
+TIME_TO_MODES_DETOUR_FACTOR = 1.3
+TIME_TO_MODES_AVERAGE_SPEEDS = {
+    TimeToModes.WALK: 1.4,  # 5 km/h
+    TimeToModes.BIKE: 4.4,  # 16 km/h
+    TimeToModes.CAR: 8.3,  # 30 km/h, in urban areas
+}
+TIME_TO_MODES_OVERHEADS = {
+    TimeToModes.WALK: 0,
+    TimeToModes.BIKE: 60,
+    TimeToModes.CAR: 300,
+}
@@ -5,37 +5,52 @@ the source opendata files.
 """
 from __future__ import absolute_import, print_function, unicode_literals
 
+import collections
+import concurrent.futures
+import contextlib
+import itertools
+import json
 import logging
+import os
+import pickle
+import re
+import sys
+import tempfile
+import threading
+
+import numpy
+from sqlalchemy import func
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, builds are then not guarded against
+    # concurrent processes
+    fcntl = None
 
 import flatisfy.exceptions
 
 from flatisfy import database
 from flatisfy import data_files
+from flatisfy import gtfs
+from flatisfy import snapshot
+from flatisfy import tools
+from flatisfy.filters.cache import GeocodingCache
+from flatisfy.models.address import Address
+from flatisfy.models.opendata_build import OpendataBuild
 from flatisfy.models.postal_code import PostalCode
 from flatisfy.models.public_transport import PublicTransport
-from flatisfy.tools import hash_dict
+from flatisfy.geo import SpatialIndex
+from flatisfy.tools import FuzzyMatcher, normalize_for_matching
 
 LOGGER = logging.getLogger(__name__)
 
-# Try to load lru_cache
-try:
-    from functools import lru_cache
-except ImportError:
-    try:
-        from functools32 import lru_cache
-    except ImportError:
-
-        def lru_cache(maxsize=None):  # pylint: disable=unused-argument
-            """
-            Identity implementation of ``lru_cache`` for fallback.
-            """
-            return lambda func: func
-
-        LOGGER.warning(
-            "`functools.lru_cache` is not available on your system. Consider "
-            "installing `functools32` Python module if using Python2 for "
-            "better performances."
-        )
+# Number of opendata rows inserted in database at once
+INSERT_CHUNK_SIZE = 10000
+# Models of the opendata built per area, with a snapshot
+SNAPSHOT_MODELS = [PostalCode, PublicTransport]
+# Lock file of the opendata builds, in the data directory
+BUILD_LOCK_FILE = "opendata_build.lock"
 
 
 def preprocess_data(config, force=False):
@@ -43,58 +58,868 @@ def preprocess_data(config, force=False):
     Ensures that all the necessary data have been inserted in db from the raw
     opendata files.
 
+    Only the areas covered by the constraints in config are built, and only
+    if their data files changed since they were last built. Other areas are
+    built on demand, see ``build_areas``. Snapshots of the built data are
+    written along, see ``write_snapshots``.
+
     :params config: A config dictionary.
     :params force: Whether to force rebuild or not.
     :return bool: Whether data have been built or not.
     """
-    # Check if a build is required
+    areas = set()
+    for constraint in config["constraints"].values():
+        areas.update(get_constraint_areas(constraint))
+    areas = sorted(x for x in areas if x)
+
+    is_built = False
+    # The database is only queried if the snapshots are not up to date
+    if force or not _are_snapshots_up_to_date(areas, config):
+        get_session = database.init_db(config["database"], config["search_index"])
+        with get_session() as session:
+            # Data built before normalized names were stored should be rebuilt
+            if any(
+                session.query(model.id).filter(model.normalized_name.is_(None)).first()
+                for model in SNAPSHOT_MODELS
+            ):
+                session.query(OpendataBuild).delete()
+        is_built = build_areas(areas, config, force=force)
+        if not is_built:
+            write_snapshots(config)
+
+    if config["addresses_file"] and (force or not _are_addresses_up_to_date(config)):
+        build_addresses(config)
+        is_built = True
+    if config["gtfs_feed"] and (force or not gtfs.is_timetable_up_to_date(config)):
+        gtfs.build_timetable(config)
+        is_built = True
+
+    if is_built:
+        # Drop anything loaded or guessed while the data was being rebuilt
+        OPENDATA_CACHE.invalidate(config["database"])
+        GeocodingCache.invalidate(config)
+        LOGGER.info("Done building data!")
+    return is_built
+
+
+def build_areas(areas, config, force=False, missing_only=False, parallel=True):
+    """
+    Build the opendata of some areas into the database, replacing any
+    previously built data for these areas.
+
+    Areas are only built if they were never built, or if the content of their
+    data files changed since they were built.
+
+    :params areas: An iterable of the areas to build, see
+        ``data_files.TRANSPORT_DATA_FILES``. Unknown areas are ignored.
+    :params config: A config dictionary.
+    :params force: Whether to build the areas even if they are up to date.
+    :params missing_only: Whether to only build the areas which were never
+        built, without checking whether they are up to date.
+    :params parallel: Whether to parse the data files in parallel, in a pool
+        of processes.
+    :return bool: Whether some data have been built or not.
+    """
+    # Builds are serialized between processes (e.g. the web app building
+    # areas on demand while the data are imported), the areas to build are
+    # only found once the lock is held, not to build them twice
+    with _build_lock(config):
+        return _build_areas(areas, config, force, missing_only, parallel)
+
+
+@contextlib.contextmanager
+def _build_lock(config):
+    """
+    Context manager holding an exclusive lock on the opendata builds of a
+    data directory, waiting for other processes to release it.
+
+    :param config: A config dictionary.
+    """
+    with open(os.path.join(config["data_directory"], BUILD_LOCK_FILE), "a") as fh:
+        if fcntl is not None:
+            # The lock is released when the file is closed
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+        yield
+
+
+def _build_areas(areas, config, force, missing_only, parallel):
+    """
+    Build the opendata of some areas, see ``build_areas``. The build lock must
+    be held.
+    """
     get_session = database.init_db(config["database"], config["search_index"])
     with get_session() as session:
-        is_built = session.query(PublicTransport).count() > 0 and session.query(PostalCode).count() > 0
-        if is_built and not force:
-            # No need to rebuild the database, skip
-            return False
-        # Otherwise, purge all existing data
-        session.query(PublicTransport).delete()
-        session.query(PostalCode).delete()
-
-    # Build all opendata files
-    LOGGER.info("Rebuilding data...")
-    for preprocess in data_files.PREPROCESSING_FUNCTIONS:
-        data_objects = preprocess()
-        if not data_objects:
-            raise flatisfy.exceptions.DataBuildError("Error with %s." % preprocess.__name__)
+        built = {(x.table, x.area): x.content_hash for x in session.query(OpendataBuild)}
+
+    # Find the data to (re)build, grouping the areas built from the same data
+    # file so that it is only parsed once
+    jobs = collections.OrderedDict()
+    content_hashes = {}
+    for area in areas:
+        if area not in data_files.TRANSPORT_DATA_FILES:
+            continue
+        for model, data_file in data_files.get_data_files(area):
+            key = (model.__tablename__, area)
+            if not force and missing_only and key in built:
+                continue
+            if data_file not in content_hashes:
+                content_hashes[data_file] = data_files.compute_content_hash(data_file)
+            if missing_only and content_hashes[data_file] is None:
+                LOGGER.warning(
+                    "Unable to build %s data for area %s, %s is missing.", key[0], area, data_file
+                )
+                continue
+            if force or key not in built or built[key] != content_hashes[data_file]:
+                jobs.setdefault((model, data_file), []).append(area)
+    if not jobs:
+        return False
+
+    LOGGER.info(
+        "Building data for areas %s...", ", ".join(sorted(set(itertools.chain(*jobs.values()))))
+    )
+    preprocessing_functions = [
+        data_files.get_preprocessing_function(model, data_file, job_areas)
+        for (model, data_file), job_areas in jobs.items()
+    ]
+    with contextlib.ExitStack() as stack:
+        if parallel:
+            # Worker processes spool their rows to temporary files, not to
+            # send whole data files back through the executor
+            spool_directory = stack.enter_context(
+                tempfile.TemporaryDirectory(dir=config["data_directory"])
+            )
+            executor = stack.enter_context(concurrent.futures.ProcessPoolExecutor())
+            futures = [
+                executor.submit(_run_preprocessing_function, preprocess, spool_directory)
+                for preprocess in preprocessing_functions
+            ]
+            results = (_iter_spooled_rows(x.result()) for x in futures)
+        else:
+            results = (preprocess() for preprocess in preprocessing_functions)
         with get_session() as session:
-            session.add_all(data_objects)
-    LOGGER.info("Done building data!")
+            # Results are inserted in order, to get the same ids on each build
+            for ((model, data_file), job_areas), rows in zip(jobs.items(), results):
+                session.query(model).filter(model.area.in_(job_areas)).delete(
+                    synchronize_session=False
+                )
+                counts = collections.Counter()
+                _bulk_insert(session, model, _count_areas(rows, counts))
+                for area in job_areas:
+                    if not counts[area]:
+                        raise flatisfy.exceptions.DataBuildError(
+                            "Error with %s data for area %s." % (data_file, area)
+                        )
+                    session.query(OpendataBuild).filter_by(
+                        table=model.__tablename__, area=area
+                    ).delete()
+                    session.add(
+                        OpendataBuild(
+                            table=model.__tablename__,
+                            area=area,
+                            data_file=data_file,
+                            content_hash=content_hashes[data_file],
+                        )
+                    )
+    write_snapshots(config)
+    return True
+
+
+def get_snapshot_path(model, config):
+    """
+    Get the path of the snapshot of the opendata of a model.
+
+    :param model: One of the ``SNAPSHOT_MODELS``.
+    :param config: A config dictionary.
+    :return: The path to the snapshot file.
+    """
+    return os.path.join(config["data_directory"], "opendata_%s.snapshot" % model.__tablename__)
+
+
+def _open_snapshot(model, config):
+    """
+    Open the snapshot of the opendata of a model.
+
+    :param model: One of the ``SNAPSHOT_MODELS``.
+    :param config: A config dictionary.
+    :return: A ``snapshot.Snapshot``, or ``None`` if there is no snapshot.
+    """
+    return snapshot.open_snapshot(get_snapshot_path(model, config))
+
+
+def write_snapshots(config):
+    """
+    Write the snapshots of the opendata built in database, one per model, to
+    be memory-mapped instead of loading the data from the database. Rows are
+    sorted by area, and the metadata of the snapshot map each area built to
+    the range of its rows and to the hash of the data file it was built from.
+
+    The metadata also map each data file to its size, modification time and
+    current hash, so that checking whether the snapshots are up to date does
+    not need to hash the data files again, see ``_are_snapshots_up_to_date``.
+
+    :param config: A config dictionary.
+    """
+    get_session = database.init_db(config["database"], config["search_index"])
+    with get_session() as session:
+        for model in SNAPSHOT_MODELS:
+            builds = session.query(OpendataBuild).filter_by(table=model.__tablename__).all()
+            content_hashes = {x.area: x.content_hash for x in builds}
+            stats = {}
+            for data_file in set(x.data_file for x in builds):
+                # Stat before hashing, so that a file changed meanwhile is
+                # hashed again
+                stat = data_files.get_data_file_stat(data_file)
+                if stat is not None:
+                    stats[data_file] = stat + [data_files.compute_content_hash(data_file)]
+            # Count the rows of each area first, to stream the rows to the
+            # snapshot
+            areas = {}
+            rows = 0
+            counts = (
+                session.query(model.area, func.count(model.id))
+                .filter(model.area.in_(content_hashes))
+                .group_by(model.area)
+                .order_by(model.area)
+            )
+            for area, count in counts:
+                areas[area] = [rows, rows + count, content_hashes[area]]
+                rows += count
+            types = OpendataTable.get_column_types(model)
+            query = (
+                session.query(*[getattr(model, x) for x in types])
+                .filter(model.area.in_(content_hashes))
+                .order_by(model.area, model.id)
+            )
+            snapshot.write_snapshot(
+                get_snapshot_path(model, config),
+                types,
+                rows,
+                tools.batch(query.yield_per(INSERT_CHUNK_SIZE), INSERT_CHUNK_SIZE),
+                {"areas": areas, "data_files": stats},
+            )
+
+
+def remove_snapshots(config):
+    """
+    Remove the snapshots of the opendata.
+
+    :param config: A config dictionary.
+    """
+    for model in SNAPSHOT_MODELS:
+        try:
+            os.remove(get_snapshot_path(model, config))
+        except OSError:
+            pass
+
+
+def _are_snapshots_up_to_date(areas, config):
+    """
+    Check whether the snapshots contain some areas, built from the current
+    data files.
+
+    :param areas: An iterable of areas, see
+        ``data_files.TRANSPORT_DATA_FILES``. Unknown areas are ignored.
+    :param config: A config dictionary.
+    :return: ``True`` if the snapshots are up to date, ``False`` otherwise.
+    """
+    snapshots = {model: _open_snapshot(model, config) for model in SNAPSHOT_MODELS}
+    content_hashes = {}
+    for area in areas:
+        if area not in data_files.TRANSPORT_DATA_FILES:
+            continue
+        for model, data_file in data_files.get_data_files(area):
+            if snapshots[model] is None or area not in snapshots[model].metadata["areas"]:
+                return False
+            if data_file not in content_hashes:
+                # Data files are only hashed again if their size or
+                # modification time changed since the snapshot was written
+                known = snapshots[model].metadata.get("data_files", {}).get(data_file)
+                stat = data_files.get_data_file_stat(data_file)
+                if known is not None and stat is not None and known[:2] == stat:
+                    content_hashes[data_file] = known[2]
+                else:
+                    content_hashes[data_file] = data_files.compute_content_hash(data_file)
+            if snapshots[model].metadata["areas"][area][2] != content_hashes[data_file]:
+                return False
     return True
 
 
-@hash_dict
-@lru_cache(maxsize=5)
+def _run_preprocessing_function(preprocess, directory):
+    """
+    Run a preprocessing function, in a worker process, spooling its rows to a
+    temporary file by chunks.
+
+    :param preprocess: A function from
+        ``data_files.get_preprocessing_function``.
+    :param directory: The directory of the temporary file.
+    :return: The path of the temporary file, see ``_iter_spooled_rows``.
+    """
+    fd, path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, "wb") as fh:
+        for chunk in tools.batch(preprocess(), INSERT_CHUNK_SIZE):
+            pickle.dump(list(chunk), fh, pickle.HIGHEST_PROTOCOL)
+    return path
+
+
+def _iter_spooled_rows(path):
+    """
+    Iterate over the rows spooled by ``_run_preprocessing_function``, one
+    chunk in memory at a time. The file is removed once consumed.
+
+    :param path: The path of the temporary file.
+    :return: A generator of dicts of columns.
+    """
+    with open(path, "rb") as fh:
+        while True:
+            try:
+                chunk = pickle.load(fh)
+            except EOFError:
+                break
+            for row in chunk:
+                yield row
+    os.remove(path)
+
+
+def _count_areas(rows, counts):
+    """
+    Count the rows of each area, while iterating over them.
+
+    :param rows: An iterable of dicts of columns, with an ``area``.
+    :param counts: A ``collections.Counter`` of the rows of each area,
+        updated in place.
+    :return: A generator of the rows.
+    """
+    for row in rows:
+        counts[row["area"]] += 1
+        yield row
+
+
+def _bulk_insert(session, model, rows):
+    """
+    Insert rows in the table of a model, by chunks and without building any
+    ORM object.
+
+    :param session: An SQLAlchemy session.
+    :param model: The SQLAlchemy model of the rows.
+    :param rows: An iterable of dicts of columns.
+    :return: The number of inserted rows.
+    """
+    count = 0
+    for chunk in tools.batch(rows, INSERT_CHUNK_SIZE):
+        chunk = list(chunk)
+        session.execute(model.__table__.insert(), chunk)
+        count += len(chunk)
+    return count
+
+
+def build_addresses(config):
+    """
+    Insert the addresses from the ``addresses_file`` of the config in
+    database, replacing any existing ones.
+
+    The addresses file is recorded in ``OpendataBuild``, along with its
+    hash, size and modification time, see ``_are_addresses_up_to_date``.
+
+    :params config: A config dictionary.
+    """
+    addresses_file = config["addresses_file"]
+    # Stat before hashing, so that a file changed meanwhile is hashed again
+    stat = data_files.get_file_stat(addresses_file)
+    content_hash = data_files.compute_file_hash(addresses_file)
+    get_session = database.init_db(config["database"], config["search_index"])
+    with get_session() as session:
+        session.query(Address).delete()
+        # Addresses files are large, stream them to the database
+        count = _bulk_insert(session, Address, data_files.preprocess_addresses(addresses_file))
+        if not count:
+            raise flatisfy.exceptions.DataBuildError("Error with %s." % addresses_file)
+        session.query(OpendataBuild).filter_by(table=Address.__tablename__).delete()
+        session.add(
+            OpendataBuild(
+                table=Address.__tablename__,
+                data_file=addresses_file,
+                content_hash=content_hash,
+                data_file_stat=json.dumps(stat),
+            )
+        )
+    LOGGER.info("Inserted %d addresses.", count)
+    # Positions geocoded from the previous addresses are outdated
+    GeocodingCache.invalidate(config)
+
+
+def _are_addresses_up_to_date(config):
+    """
+    Check whether the addresses were built from the current content of the
+    ``addresses_file`` of the config. The file is only hashed again if its
+    size or modification time changed.
+
+    :param config: A config dictionary.
+    :return: ``True`` if the addresses are up to date, ``False`` otherwise.
+    """
+    addresses_file = config["addresses_file"]
+    get_session = database.init_db(config["database"], config["search_index"])
+    with get_session() as session:
+        build = session.query(OpendataBuild).filter_by(table=Address.__tablename__).first()
+        if build is None or build.data_file != addresses_file:
+            return False
+        stat = data_files.get_file_stat(addresses_file)
+        if stat is None:
+            LOGGER.warning(
+                "Addresses file %s is missing, keeping the built addresses.", addresses_file
+            )
+            return True
+        if build.data_file_stat and json.loads(build.data_file_stat) == stat:
+            return True
+        if build.content_hash != data_files.compute_file_hash(addresses_file):
+            return False
+        # Only the modification time changed, store it to avoid hashing the
+        # file again
+        build.data_file_stat = json.dumps(stat)
+    return True
+
+
+class OpendataTable(object):
+    """
+    Compact in-memory storage of the opendata of a model, for some areas.
+
+    Data is stored column-wise, positions in NumPy float arrays and strings
+    interned, instead of as SQLAlchemy objects. Rows are identified by their
+    index and materialized as light named tuples on access, and lookups by
+    value go through indexes built on first use.
+    """
+
+    def __init__(self, model, rows):
+        """
+        :param model: The SQLAlchemy model of the data.
+        :param rows: An iterable of tuples of values, one per column of the
+            model (except the ``id`` column) in the order of
+            ``OpendataTable.get_column_names(model)``.
+        """
+        self.model = model
+        self.column_names = self.get_column_names(model)
+        self.record = collections.namedtuple("%sRecord" % model.__name__, self.column_names)
+
+        columns = [[] for _ in self.column_names]
+        for row in rows:
+            for column, value in zip(columns, row):
+                column.append(sys.intern(value) if isinstance(value, str) else value)
+        self.columns = dict(zip(self.column_names, columns))
+        # Positions are stored in float arrays, for vectorized computations
+        self.lat = self.columns["lat"] = numpy.array(self.columns["lat"], dtype=float)
+        self.lng = self.columns["lng"] = numpy.array(self.columns["lng"], dtype=float)
+
+        self._indexes = {}
+
+    @classmethod
+    def from_snapshot(cls, model, opendata_snapshot, areas):
+        """
+        Get the data of some areas from a snapshot, without copying it when
+        possible.
+
+        :param model: The SQLAlchemy model of the data.
+        :param opendata_snapshot: A ``snapshot.Snapshot`` of the data of the
+            model, see ``write_snapshots``.
+        :param areas: The areas to get data for, all of them in the
+            snapshot.
+        :return: An ``OpendataTable``.
+        """
+        ranges = [opendata_snapshot.metadata["areas"][area][:2] for area in areas]
+        if len(ranges) == 1:
+            # Views on the mapped file
+            index = slice(*ranges[0])
+        else:
+            index = numpy.array(
+                [row for start, stop in ranges for row in range(start, stop)], dtype=numpy.intp
+            )
+
+        table = cls(model, [])
+        table.columns = {x: opendata_snapshot.columns[x][index] for x in table.column_names}
+        table.lat = table.columns["lat"] = numpy.asarray(table.columns["lat"])
+        table.lng = table.columns["lng"] = numpy.asarray(table.columns["lng"])
+        return table
+
+    @staticmethod
+    def get_column_names(model):
+        """
+        Get the names of the columns to store for a given model.
+
+        :param model: An SQLAlchemy model.
+        :return: A list of column names.
+        """
+        return [column.name for column in model.__table__.columns if column.name != "id"]
+
+    @staticmethod
+    def get_column_types(model):
+        """
+        Get the snapshot types of the columns to store for a given model, see
+        ``snapshot.write_snapshot``.
+
+        :param model: An SQLAlchemy model.
+        :return: A dict mapping column names to ``"string"`` or ``"float"``.
+        """
+        return {
+            column.name: "string" if column.type.python_type is str else "float"
+            for column in model.__table__.columns
+            if column.name != "id"
+        }
+
+    def __len__(self):
+        return len(self.lat)
+
+    def __getitem__(self, row):
+        """
+        Get a row as a named tuple, with the same fields as the model.
+
+        :param row: The index of the row.
+        :return: A named tuple.
+        """
+        values = (self.columns[column][row] for column in self.column_names)
+        # Convert back NumPy scalars to Python ones
+        return self.record(*(x.item() if isinstance(x, numpy.generic) else x for x in values))
+
+    def __iter__(self):
+        return (self[row] for row in range(len(self)))
+
+    def get_position(self, row):
+        """
+        Get the position of a row.
+
+        :param row: The index of the row.
+        :return: A tuple of (latitude, longitude).
+        """
+        return (float(self.lat[row]), float(self.lng[row]))
+
+    def lookup(self, column, value):
+        """
+        Find the rows with a given value in a column. The column is indexed on
+        first lookup.
+
+        :param column: The name of the column. Use ``"position"`` to look up
+            a (latitude, longitude) tuple.
+        :param value: The value to look for.
+        :return: The list of the indexes of the matching rows, in order.
+        """
+        if column not in self._indexes:
+            if column == "position":
+                values = zip(self.lat.tolist(), self.lng.tolist())
+            else:
+                values = self.columns[column]
+            index = collections.defaultdict(list)
+            for row, row_value in enumerate(values):
+                index[row_value].append(row)
+            self._indexes[column] = dict(index)
+        return self._indexes[column].get(value, [])
+
+
+class OpendataCache(object):
+    """
+    Process-wide cache of the opendata loaded from the database, and of the
+    structures built on top of it, shared by the CLI, the filters and the web
+    app.
+
+    Entries are keyed by the database URI and a key tuple, typically made of
+    the model and the set of areas of the data, so that all the constraints
+    covering the same areas share them. The cache must be invalidated
+    whenever the opendata in database changes.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.RLock()
+
+    def get(self, database_uri, key, build):
+        """
+        Get an entry from the cache, building it if missing.
+
+        :param database_uri: The URI of the database the data come from.
+        :param key: A hashable key for the entry.
+        :param build: A function without arguments returning the entry.
+        :return: The cached entry.
+        """
+        with self._lock:
+            try:
+                return self._entries[(database_uri, key)]
+            except KeyError:
+                entry = self._entries[(database_uri, key)] = build()
+                return entry
+
+    def invalidate(self, database_uri=None):
+        """
+        Drop cached entries.
+
+        :param database_uri: Only drop the entries loaded from this database.
+            Drop all entries if ``None``.
+        """
+        with self._lock:
+            if database_uri is None:
+                self._entries.clear()
+            else:
+                for key in [x for x in self._entries if x[0] == database_uri]:
+                    del self._entries[key]
+
+
+OPENDATA_CACHE = OpendataCache()
+
+
+class AddressIndex(object):
+    """
+    Street-level geocoder over the addresses of a postal code.
+
+    Streets are found in a location string the same way as cities, looking
+    for the longest street name it contains, and house numbers are then
+    looked up exactly.
+    """
+
+    # Common abbreviations of street types in housing posts
+    ABBREVIATIONS = [
+        (re.compile(r"\b(bd|bld|bvd|boul)\b\.?", re.IGNORECASE), "boulevard"),
+        (re.compile(r"\b(av|ave)\b\.?", re.IGNORECASE), "avenue"),
+        (re.compile(r"\bpl\b\.?", re.IGNORECASE), "place"),
+        (re.compile(r"\bimp\b\.?", re.IGNORECASE), "impasse"),
+        (re.compile(r"\bsq\b\.?", re.IGNORECASE), "square"),
+        (re.compile(r"\b(fg|fbg)\b\.?", re.IGNORECASE), "faubourg"),
+        (re.compile(r"\bchem\b\.?", re.IGNORECASE), "chemin"),
+        (re.compile(r"\brte\b\.?", re.IGNORECASE), "route"),
+    ]
+    # Numbers which may be house numbers, with their repetition index, but
+    # neither postal codes nor ordinals (e.g. "Paris 14e"). They are only
+    # house numbers if they are followed by a street type or street name.
+    HOUSE_NUMBER_REGEX = re.compile(
+        r"(?<!\w)(\d{1,4})(?:\s*(bis|ter|quater))?[\s,]+", re.IGNORECASE
+    )
+    # Common street types, normalized
+    STREET_TYPES = (
+        "allee",
+        "avenue",
+        "boulevard",
+        "chaussee",
+        "chemin",
+        "cite",
+        "cours",
+        "faubourg",
+        "impasse",
+        "passage",
+        "place",
+        "promenade",
+        "quai",
+        "route",
+        "rue",
+        "sentier",
+        "square",
+        "villa",
+        "voie",
+    )
+
+    def __init__(self, rows):
+        """
+        :param rows: An iterable of tuples of street, normalized street,
+            number, latitude and longitude.
+        """
+        # Map streets to their house numbers and positions
+        self.streets = collections.defaultdict(dict)
+        self.normalized_streets = {}
+        for street, normalized_street, number, lat, lng in rows:
+            self.streets[street][number] = (lat, lng)
+            self.normalized_streets[street] = normalized_street
+        self.matcher = FuzzyMatcher(
+            list(self.streets), normalized_key=self.normalized_streets.__getitem__
+        )
+
+    def __len__(self):
+        return len(self.streets)
+
+    def geocode(self, location):
+        """
+        Find the position of a location string at the street level.
+
+        :param location: The location string of a flat.
+        :return: A tuple of a tuple of (latitude, longitude) and the
+            precision of the position, either ``"housenumber"`` or
+            ``"street"`` (the middle of the street), or ``None`` if no street
+            matched.
+        """
+        if not self.streets:
+            return None
+        query = location
+        for regex, replacement in self.ABBREVIATIONS:
+            query = regex.sub(replacement, query)
+        matches = self.matcher.match(query, limit=1)
+        if not matches:
+            return None
+        street = matches[0][0]
+        numbers = self.streets[street]
+
+        prefixes = self.STREET_TYPES + (self.normalized_streets[street],)
+        for match in self.HOUSE_NUMBER_REGEX.finditer(query):
+            following = normalize_for_matching(query[match.end() :]) + " "
+            if not any(following.startswith(prefix + " ") for prefix in prefixes):
+                continue
+            number, repetition = match.groups()
+            candidates = [number]
+            if repetition:
+                candidates.insert(0, "%s %s" % (number, repetition.lower()))
+            for candidate in candidates:
+                if candidate in numbers:
+                    return numbers[candidate], "housenumber"
+
+        positions = numpy.array(list(numbers.values()))
+        return tuple(numpy.median(positions, axis=0).tolist()), "street"
+
+
+def get_constraint_areas(constraint):
+    """
+    Get the areas covered by the postal codes of a constraint.
+
+    :param constraint: A constraint from configuration.
+    :return: A sorted tuple of areas.
+    """
+    areas = set(data_files.french_postal_codes_to_quarter(x) for x in constraint["postal_codes"])
+    return tuple(sorted(areas))
+
+
+def _load_table(model, areas, config):
+    """
+    Load data of the specified model for some areas from their snapshot, or
+    from the database if they are not in the snapshot.
+
+    :param model: SQLAlchemy model to load.
+    :param areas: The areas to load data for.
+    :param config: A config dictionary.
+    :returns: An ``OpendataTable`` of the loaded data.
+    """
+    opendata_snapshot = _open_snapshot(model, config)
+    if opendata_snapshot is None or not set(areas) <= opendata_snapshot.metadata["areas"].keys():
+        # Areas needed for the first time are built on demand. They may also
+        # have been built by another process in the meantime.
+        LOGGER.info(
+            "Missing %s data for areas %s, building them on demand.",
+            model.__tablename__,
+            ", ".join(areas),
+        )
+        build_areas(areas, config, missing_only=True, parallel=False)
+        opendata_snapshot = _open_snapshot(model, config)
+    if opendata_snapshot is not None and set(areas) <= opendata_snapshot.metadata["areas"].keys():
+        return OpendataTable.from_snapshot(model, opendata_snapshot, areas)
+
+    get_session = database.init_db(config["database"], config["search_index"])
+    columns = [getattr(model, x) for x in OpendataTable.get_column_names(model)]
+    with get_session() as session:
+        # Only fetch the values, not full SQLAlchemy objects. Rows are in the
+        # same order as in snapshots.
+        query = session.query(*columns).filter(model.area.in_(areas)).order_by(model.area, model.id)
+        return OpendataTable(model, query.yield_per(1000))
+
+
 def load_data(model, constraint, config):
     """
     Load data of the specified model from the database. Only load data for the
-    specific areas of the postal codes in config.
+    specific areas of the postal codes in config. Data is only loaded once
+    per set of areas, see ``OPENDATA_CACHE``.
 
     :param model: SQLAlchemy model to load.
     :param constraint: A constraint from configuration to limit the spatial
     extension of the loaded data.
     :param config: A config dictionary.
-    :returns: A list of loaded SQLAlchemy objects from the db
+    :returns: An ``OpendataTable`` of the loaded data.
     """
-    get_session = database.init_db(config["database"], config["search_index"])
-    results = []
-    with get_session() as session:
-        areas = []
-        # Get areas to fetch from, using postal codes
-        for postal_code in constraint["postal_codes"]:
-            areas.append(data_files.french_postal_codes_to_quarter(postal_code))
-        # Load data for each area
-        areas = list(set(areas))
-        for area in areas:
-            results.extend(session.query(model).filter(model.area == area).all())
-        # Expunge loaded data from the session to be able to use them
-        # afterwards
-        session.expunge_all()
-    return results
+    areas = get_constraint_areas(constraint)
+    return OPENDATA_CACHE.get(
+        config["database"],
+        (model, areas),
+        lambda: _load_table(model, areas, config),
+    )
+
+
+def load_addresses(postal_code, config):
+    """
+    Load the addresses of a postal code from the database. Addresses are only
+    loaded once per postal code, see ``OPENDATA_CACHE``.
+
+    :param postal_code: The postal code to load addresses for.
+    :param config: A config dictionary.
+    :returns: An ``AddressIndex`` of the loaded addresses, empty if no
+        addresses were built.
+    """
+
+    def build():
+        """
+        Load the addresses.
+        """
+        get_session = database.init_db(config["database"], config["search_index"])
+        with get_session() as session:
+            query = session.query(
+                Address.street, Address.normalized_street, Address.number, Address.lat, Address.lng
+            ).filter(Address.postal_code == postal_code)
+            return AddressIndex(query.yield_per(1000))
+
+    return OPENDATA_CACHE.get(config["database"], (Address, postal_code), build)
+
+
+def load_spatial_index(model, constraint, config):
+    """
+    Build a spatial index over the rows of the data of the specified model,
+    for the specific areas of the postal codes in config.
+
+    :param model: SQLAlchemy model to load.
+    :param constraint: A constraint from configuration to limit the spatial
+    extension of the loaded data.
+    :param config: A config dictionary.
+    :returns: A ``geo.SpatialIndex`` over the indexes of the rows of the
+        ``OpendataTable``.
+    """
+    table = load_data(model, constraint, config)
+    return OPENDATA_CACHE.get(
+        config["database"],
+        (model, get_constraint_areas(constraint), "spatial_index"),
+        lambda: SpatialIndex(range(len(table)), key=table.get_position),
+    )
+
+
+def load_matcher(model, constraint, config, clip_radius=None):
+    """
+    Build a matcher over the names of the data of the specified model, for
+    the specific areas of the postal codes in config. The matcher is only
+    built once, when it is first needed.
+
+    :param model: SQLAlchemy model to load.
+    :param constraint: A constraint from configuration to limit the spatial
+    extension of the loaded data.
+    :param config: A config dictionary.
+    :param clip_radius: If not ``None``, only consider the rows within this
+        distance (in meters) of one of the postal codes of the constraint.
+    :returns: A ``tools.FuzzyMatcher`` whose choices are the indexes of the
+        rows of the ``OpendataTable``.
+    """
+
+    def build():
+        """
+        Build the matcher.
+        """
+        table = load_data(model, constraint, config)
+        rows = range(len(table))
+        if clip_radius is not None:
+            spatial_index = load_spatial_index(model, constraint, config)
+            postal_codes = load_data(PostalCode, constraint, config)
+            clipped = set()
+            for postal_code in constraint["postal_codes"]:
+                postal_code_rows = postal_codes.lookup("postal_code", postal_code)
+                if postal_code_rows:
+                    clipped.update(
+                        row
+                        for row, _ in spatial_index.query_radius(
+                            postal_codes.get_position(postal_code_rows[0]), clip_radius
+                        )
+                    )
+            # Keep the initial ordering of the rows
+            rows = sorted(clipped)
+        return FuzzyMatcher(
+            rows,
+            key=table.columns["name"].__getitem__,
+            normalized_key=table.columns["normalized_name"].__getitem__,
+        )
+
+    key = (model, get_constraint_areas(constraint), "matcher")
+    if clip_radius is not None:
+        # Clipped matchers depend on the postal codes of the constraint
+        key += (clip_radius, tuple(sorted(constraint["postal_codes"])))
+    return OPENDATA_CACHE.get(config["database"], key, build)
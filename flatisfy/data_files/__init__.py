@@ -1,20 +1,26 @@
 # coding: utf-8
 """
-Preprocessing functions to convert input opendata files into SQLAlchemy objects
-ready to be stored in the database.
+Preprocessing functions to convert input opendata files into rows ready to be
+stored in the database.
 """
 from __future__ import absolute_import, print_function, unicode_literals
+import functools
+import gzip
+import hashlib
 import io
 import json
 import logging
+import lzma
 import os
+import re
 import sys
 
 import titlecase
 
+from flatisfy.exceptions import DataBuildError
 from flatisfy.models.postal_code import PostalCode
 from flatisfy.models.public_transport import PublicTransport
-from flatisfy.tools import normalize_string
+from flatisfy.tools import normalize_for_matching, normalize_string
 
 import csv
 
@@ -28,6 +34,18 @@ titlecase.set_small_word_list(
     + titlecase.SMALL
 )
 
+# Data files can be compressed, they are then found with one of these
+# extensions and decompressed on the fly
+COMPRESSED_FILE_OPENERS = {".gz": gzip.open, ".xz": lzma.open}
+# Errors raised when reading invalid compressed files
+COMPRESSION_ERRORS = (EOFError, lzma.LZMAError)
+# Size of the chunks read when streaming JSON data files
+JSON_CHUNK_SIZE = 64 * 1024
+JSON_WHITESPACE_REGEX = re.compile(r"[ \t\n\r]*")
+JSON_DELIMITERS = " \t\n\r,]"
+
+LAPOSTE_DATA_FILE = "laposte.json"
+# Areas which can be built, with their public transport data file
 TRANSPORT_DATA_FILES = {
     "FR-IDF": "stops_fr-idf.txt",
     "FR-NW": "stops_fr-nw.txt",
@@ -37,6 +55,54 @@ TRANSPORT_DATA_FILES = {
 }
 
 
+# Mapping between areas (main subdivisions in French, ISO 3166-2) and French
+# departements
+# Taken from Wikipedia data.
+DEPARTMENT_TO_SUBDIVISION = {
+    "FR-ARA": ["01", "03", "07", "15", "26", "38", "42", "43", "63", "69", "73", "74"],
+    "FR-BFC": ["21", "25", "39", "58", "70", "71", "89", "90"],
+    "FR-BRE": ["22", "29", "35", "44", "56"],
+    "FR-CVL": ["18", "28", "36", "37", "41", "45"],
+    "FR-COR": ["20"],
+    "FR-GES": ["08", "10", "51", "52", "54", "55", "57", "67", "68", "88"],
+    "FR-HDF": ["02", "59", "60", "62", "80"],
+    "FR-IDF": ["75", "77", "78", "91", "92", "93", "94", "95"],
+    "FR-NOR": ["14", "27", "50", "61", "76"],
+    "FR-NAQ": ["16", "17", "19", "23", "24", "33", "40", "47", "64", "79", "86", "87"],
+    "FR-OCC": ["09", "11", "12", "30", "31", "32", "34", "46", "48", "65", "66", "81", "82"],
+    "FR-PDL": ["44", "49", "53", "72", "85"],
+    "FR-PAC": ["04", "05", "06", "13", "83", "84"],
+}
+SUBDIVISION_TO_QUARTERS = {
+    "FR-IDF": ["FR-IDF"],
+    "FR-NW": ["FR-BRE", "FR-CVL", "FR-NOR", "FR-PDL"],
+    "FR-NE": ["FR-BFC", "FR-GES", "FR-HDF"],
+    "FR-SE": ["FR-ARA", "FR-COR", "FR-PAC", "FR-OCC"],
+    "FR-SW": ["FR-NAQ"],
+}
+
+
+def _build_department_to_quarter():
+    """
+    Build the mapping between French departements and the main quarters in
+    France, from ``DEPARTMENT_TO_SUBDIVISION`` and
+    ``SUBDIVISION_TO_QUARTERS``. The first matching subdivision and quarter
+    win.
+
+    :returns: A dict mapping departements to quarters.
+    """
+    department_to_quarter = {}
+    for subdivision, departments in DEPARTMENT_TO_SUBDIVISION.items():
+        quarter = next((i for i, x in SUBDIVISION_TO_QUARTERS.items() if subdivision in x), None)
+        for department in departments:
+            department_to_quarter.setdefault(department, quarter)
+    return department_to_quarter
+
+
+# Built once, as it is needed for every postal code
+DEPARTMENT_TO_QUARTER = _build_department_to_quarter()
+
+
 def french_postal_codes_to_quarter(postal_code):
     """
     Convert a French postal code to the main quarter in France this postal
@@ -44,163 +110,342 @@ def french_postal_codes_to_quarter(postal_code):
 
     :param postal_code: The postal code to convert.
     :returns: The quarter of France or ``None``.
+
+    :Example:
+
+        >>> french_postal_codes_to_quarter("75014")
+        'FR-IDF'
+        >>> french_postal_codes_to_quarter("44000")
+        'FR-NW'
     """
-    departement = postal_code[:2]
-
-    # Mapping between areas (main subdivisions in French, ISO 3166-2) and
-    # French departements
-    # Taken from Wikipedia data.
-    department_to_subdivision = {
-        "FR-ARA": [
-            "01",
-            "03",
-            "07",
-            "15",
-            "26",
-            "38",
-            "42",
-            "43",
-            "63",
-            "69",
-            "73",
-            "74",
-        ],
-        "FR-BFC": ["21", "25", "39", "58", "70", "71", "89", "90"],
-        "FR-BRE": ["22", "29", "35", "44", "56"],
-        "FR-CVL": ["18", "28", "36", "37", "41", "45"],
-        "FR-COR": ["20"],
-        "FR-GES": ["08", "10", "51", "52", "54", "55", "57", "67", "68", "88"],
-        "FR-HDF": ["02", "59", "60", "62", "80"],
-        "FR-IDF": ["75", "77", "78", "91", "92", "93", "94", "95"],
-        "FR-NOR": ["14", "27", "50", "61", "76"],
-        "FR-NAQ": [
-            "16",
-            "17",
-            "19",
-            "23",
-            "24",
-            "33",
-            "40",
-            "47",
-            "64",
-            "79",
-            "86",
-            "87",
-        ],
-        "FR-OCC": [
-            "09",
-            "11",
-            "12",
-            "30",
-            "31",
-            "32",
-            "34",
-            "46",
-            "48",
-            "65",
-            "66",
-            "81",
-            "82",
-        ],
-        "FR-PDL": ["44", "49", "53", "72", "85"],
-        "FR-PAC": ["04", "05", "06", "13", "83", "84"],
-    }
-    subdivision_to_quarters = {
-        "FR-IDF": ["FR-IDF"],
-        "FR-NW": ["FR-BRE", "FR-CVL", "FR-NOR", "FR-PDL"],
-        "FR-NE": ["FR-BFC", "FR-GES", "FR-HDF"],
-        "FR-SE": ["FR-ARA", "FR-COR", "FR-PAC", "FR-OCC"],
-        "FR-SW": ["FR-NAQ"],
-    }
-
-    subdivision = next(
-        (i for i, departments in department_to_subdivision.items() if departement in departments),
-        None,
-    )
-    return next(
-        (i for i, subdivisions in subdivision_to_quarters.items() if subdivision in subdivisions),
-        None,
-    )
-
-
-def _preprocess_laposte():
-    """
-    Build SQLAlchemy objects from the postal codes data.
-
-    :return: A list of ``PostalCode`` objects to be inserted in database.
-    """
-    data_file = "laposte.json"
-    LOGGER.info("Building from %s data.", data_file)
-
-    raw_laposte_data = []
-    # Load opendata file
-    try:
-        with io.open(os.path.join(MODULE_DIR, data_file), "r", encoding="utf-8") as fh:
-            raw_laposte_data = json.load(fh)
-    except (IOError, ValueError):
-        LOGGER.error("Invalid raw LaPoste opendata file.")
-        return []
+    return DEPARTMENT_TO_QUARTER.get(postal_code[:2])
 
-    # Build postal codes to other infos file
-    postal_codes_data = []
-    # Keep track of seen (postal_codes, names) to avoid inserting useless
-    # duplicates (already in the OpenData file)
-    seen_postal_codes = []
-    for item in raw_laposte_data:
-        fields = item["fields"]
-        try:
-            area = french_postal_codes_to_quarter(fields["code_postal"])
-            if area is None:
-                LOGGER.debug(
-                    "No matching area found for postal code %s, skipping it.",
-                    fields["code_postal"],
-                )
-                continue
 
-            name = normalize_string(titlecase.titlecase(fields["nom_de_la_commune"]), lowercase=False)
+def get_data_file_path(data_file):
+    """
+    Find a data file in the data files directory, either as is or compressed.
 
-            if (fields["code_postal"], name) in seen_postal_codes:
+    :param data_file: The name of the data file, without compression
+        extension.
+    :return: The path to the data file, or ``None`` if it does not exist.
+    """
+    for extension in [""] + sorted(COMPRESSED_FILE_OPENERS):
+        path = os.path.join(MODULE_DIR, data_file + extension)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def open_data_file(path):
+    """
+    Open a text data file, decompressing it as a stream if it is compressed,
+    according to its extension.
+
+    :param path: The path to the data file.
+    :return: A file object, reading decoded text.
+    """
+    opener = COMPRESSED_FILE_OPENERS.get(os.path.splitext(path)[1], io.open)
+    return opener(path, "rt", encoding="utf-8", newline="")
+
+
+def _iter_json_array(fh, chunk_size=JSON_CHUNK_SIZE):
+    """
+    Iterate over the items of a JSON array read from a text file object,
+    without loading the whole file in memory.
+
+    :param fh: A text file object.
+    :param chunk_size: The number of characters to read at once.
+    :return: A generator of the items of the array.
+    :raises ValueError: If the file is not a valid JSON array.
+
+    :Example:
+
+        >>> list(_iter_json_array(io.StringIO('[{"a": [1]}, 23 , "b"]'), chunk_size=3))
+        [{'a': [1]}, 23, 'b']
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+    # Next expected token: "[", the first item (or "]"), a separator (or
+    # "]") or an item
+    expected = "["
+    while True:
+        position = JSON_WHITESPACE_REGEX.match(buffer, position).end()
+        if position == len(buffer):
+            if eof:
+                raise ValueError("Unexpected end of JSON data.")
+            buffer, position = fh.read(chunk_size), 0
+            eof = not buffer
+            continue
+
+        char = buffer[position]
+        if expected == "[":
+            if char != "[":
+                raise ValueError("JSON data is not an array.")
+            position += 1
+            expected = "first item"
+        elif char == "]" and expected in ("first item", "separator"):
+            return
+        elif expected == "separator":
+            if char != ",":
+                raise ValueError("Invalid JSON array separator.")
+            position += 1
+            expected = "item"
+        else:
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                if eof:
+                    raise
+                end = None
+            # Items are only decoded once followed by a delimiter, not to
+            # decode truncated ones (e.g. numbers)
+            if end is None or (
+                not eof and (end == len(buffer) or buffer[end] not in JSON_DELIMITERS)
+            ):
+                chunk = fh.read(chunk_size)
+                eof = not chunk
+                buffer, position = buffer[position:] + chunk, 0
                 continue
+            yield item
+            position = end
+            expected = "separator"
+
+
+def _preprocess_laposte(areas, data_file):
+    """
+    Build the rows of the postal codes table from the postal codes data, for
+    some areas at once, so that the data file is only parsed once.
 
-            seen_postal_codes.append((fields["code_postal"], name))
-            postal_codes_data.append(
-                PostalCode(
-                    area=area,
-                    postal_code=fields["code_postal"],
-                    insee_code=fields["code_commune_insee"],
-                    name=name,
-                    lat=fields["coordonnees_gps"][0],
-                    lng=fields["coordonnees_gps"][1],
-                )
-            )
-        except KeyError:
-            LOGGER.debug("Missing data for postal code %s, skipping it.", fields["code_postal"])
+    :param areas: A tuple of the areas to build.
+    :param data_file: The name of the data file, possibly compressed, see
+        ``get_data_file_path``.
+    :return: A generator of dicts of ``PostalCode`` columns to be inserted in
+        database, streamed from the data file.
+    :raises DataBuildError: If the data file is invalid.
+    """
+    LOGGER.info("Building from %s data for areas %s.", data_file, ", ".join(areas))
+
+    areas = set(areas)
+    # Keep track of seen (postal_codes, names) to avoid inserting useless
+    # duplicates (already in the OpenData file)
+    seen_postal_codes = set()
+    # Many postal codes share the same city name, only normalize it once
+    names = {}
+    path = get_data_file_path(data_file)
+    try:
+        if path is None:
+            raise IOError("No such data file: %s." % data_file)
+        # Stream the opendata file, it is large
+        with open_data_file(path) as fh:
+            for item in _iter_json_array(fh):
+                fields = item["fields"]
+                try:
+                    area = french_postal_codes_to_quarter(fields["code_postal"])
+                    if area not in areas:
+                        continue
 
-    return postal_codes_data
+                    name = names.get(fields["nom_de_la_commune"])
+                    if name is None:
+                        name = normalize_string(
+                            titlecase.titlecase(fields["nom_de_la_commune"]), lowercase=False
+                        )
+                        names[fields["nom_de_la_commune"]] = name
 
+                    if (fields["code_postal"], name) in seen_postal_codes:
+                        continue
 
-def _preprocess_public_transport():
+                    row = {
+                        "area": area,
+                        "postal_code": fields["code_postal"],
+                        "insee_code": fields["code_commune_insee"],
+                        "name": name,
+                        "normalized_name": normalize_for_matching(name),
+                        "lat": fields["coordonnees_gps"][0],
+                        "lng": fields["coordonnees_gps"][1],
+                    }
+                    seen_postal_codes.add((fields["code_postal"], name))
+                except KeyError:
+                    LOGGER.debug(
+                        "Missing data for postal code %s, skipping it.", fields["code_postal"]
+                    )
+                    continue
+                yield row
+    except (IOError, ValueError, KeyError) + COMPRESSION_ERRORS:
+        LOGGER.error("Invalid raw LaPoste opendata file.")
+        raise DataBuildError("Error with %s." % data_file)
+
+
+def _preprocess_public_transport(areas, data_file):
     """
-    Build SQLAlchemy objects from the Navitia public transport data.
+    Build the rows of the public transport table from the Navitia public
+    transport data of an area.
 
-    :return: A list of ``PublicTransport`` objects to be inserted in database.
+    :param areas: A tuple of the area of the data file, see
+        ``TRANSPORT_DATA_FILES``.
+    :param data_file: The name of the data file, possibly compressed, see
+        ``get_data_file_path``.
+    :return: A generator of dicts of ``PublicTransport`` columns to be
+        inserted in database, streamed from the data file.
+    :raises DataBuildError: If the data file is invalid.
     """
-    public_transport_data = []
+    (area,) = areas
+    # Stops with the same name are frequent, only normalize them once
+    normalized_names = {}
     # Load opendata file
-    for area, data_file in TRANSPORT_DATA_FILES.items():
-        LOGGER.info("Building from public transport data %s.", data_file)
-        try:
-            with io.open(os.path.join(MODULE_DIR, data_file), "r", encoding="utf-8") as fh:
-                filereader = csv.reader(fh)
-                next(filereader, None)  # Skip first row (headers)
-                for row in filereader:
-                    public_transport_data.append(PublicTransport(name=row[2], area=area, lat=row[3], lng=row[4]))
-        except (IOError, IndexError):
-            LOGGER.error("Invalid raw opendata file: %s.", data_file)
-            return []
-
-    return public_transport_data
-
-
-# List of all the available preprocessing functions. Order can be important.
-PREPROCESSING_FUNCTIONS = [_preprocess_laposte, _preprocess_public_transport]
+    LOGGER.info("Building from public transport data %s.", data_file)
+    path = get_data_file_path(data_file)
+    try:
+        if path is None:
+            raise IOError("No such data file: %s." % data_file)
+        with open_data_file(path) as fh:
+            filereader = csv.reader(fh)
+            next(filereader, None)  # Skip first row (headers)
+            for row in filereader:
+                normalized_name = normalized_names.get(row[2])
+                if normalized_name is None:
+                    normalized_name = normalized_names[row[2]] = normalize_for_matching(row[2])
+                yield {
+                    "name": row[2],
+                    "normalized_name": normalized_name,
+                    "area": area,
+                    "lat": float(row[3]),
+                    "lng": float(row[4]),
+                }
+    except (IOError, IndexError, ValueError) + COMPRESSION_ERRORS:
+        LOGGER.error("Invalid raw opendata file: %s.", data_file)
+        raise DataBuildError("Error with %s." % data_file)
+
+
+def preprocess_addresses(addresses_file):
+    """
+    Read the addresses from a BAN (Base Adresse Nationale) CSV file, as
+    available on https://adresse.data.gouv.fr/data/ban/adresses/latest/csv.
+
+    :param addresses_file: Path to the CSV file, ``;``-separated, with at
+        least ``numero``, ``rep``, ``nom_voie``, ``code_postal``, ``lat`` and
+        ``lon`` columns. It can be compressed with gzip or xz, see
+        ``open_data_file``.
+    :return: A generator of dicts of ``Address`` columns, to be inserted in
+        database.
+    """
+    LOGGER.info("Building from addresses data %s.", addresses_file)
+    # Streets appear once per house number, only normalize them once
+    normalized_streets = {}
+    try:
+        with open_data_file(addresses_file) as fh:
+            for row in csv.DictReader(fh, delimiter=";"):
+                try:
+                    street = row["nom_voie"]
+                    if not street or not row["numero"]:
+                        continue
+                    normalized_street = normalized_streets.get(street)
+                    if normalized_street is None:
+                        normalized_street = normalize_for_matching(street)
+                        normalized_streets[street] = normalized_street
+                    yield {
+                        "postal_code": row["code_postal"],
+                        "street": street,
+                        "normalized_street": normalized_street,
+                        "number": ("%s %s" % (row["numero"], row["rep"] or "")).strip().lower(),
+                        "lat": float(row["lat"]),
+                        "lng": float(row["lon"]),
+                    }
+                except (KeyError, ValueError):
+                    LOGGER.debug("Missing data for address %s, skipping it.", row.get("id"))
+    except (IOError,) + COMPRESSION_ERRORS:
+        LOGGER.error("Invalid raw addresses opendata file: %s.", addresses_file)
+
+
+def get_data_file_stat(data_file):
+    """
+    Get the size and modification time of a data file, to cheaply check
+    whether it changed.
+
+    :param data_file: The name of the data file, without compression
+        extension.
+    :return: A list of the size and modification time of the file, as stored
+        (compressed or not), or ``None`` if it cannot be found.
+    """
+    path = get_data_file_path(data_file)
+    if path is None:
+        return None
+    return get_file_stat(path)
+
+
+def get_file_stat(path):
+    """
+    Get the size and modification time of a file.
+
+    :param path: The path of the file.
+    :return: A list of the size and modification time of the file, or
+        ``None`` if it cannot be found.
+    """
+    try:
+        return [os.path.getsize(path), os.path.getmtime(path)]
+    except OSError:
+        return None
+
+
+def compute_content_hash(data_file):
+    """
+    Compute the hash of the content of a data file, to know whether the data
+    built from it are up to date.
+
+    :param data_file: The name of the data file, without compression
+        extension.
+    :return: The SHA256 hex digest of the file, as stored (compressed or
+        not), or ``None`` if it cannot be read.
+    """
+    path = get_data_file_path(data_file)
+    if path is None:
+        return None
+    return compute_file_hash(path)
+
+
+def compute_file_hash(path):
+    """
+    Compute the hash of the content of a file.
+
+    :param path: The path of the file.
+    :return: The SHA256 hex digest of the file, or ``None`` if it cannot be
+        read.
+    """
+    sha = hashlib.sha256()
+    try:
+        with io.open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+                sha.update(chunk)
+    except IOError:
+        return None
+    return sha.hexdigest()
+
+
+def get_data_files(area):
+    """
+    Get the data files the data of an area are built from.
+
+    :param area: The area to build, see ``TRANSPORT_DATA_FILES``.
+    :return: A list of tuples of the model of the rows built and the name of
+        the data file the rows are built from. Rows should be inserted in this
+        order.
+    """
+    return [(PostalCode, LAPOSTE_DATA_FILE), (PublicTransport, TRANSPORT_DATA_FILES[area])]
+
+
+def get_preprocessing_function(model, data_file, areas):
+    """
+    Get the preprocessing function building the rows of a model from a data
+    file, for some areas at once. Preprocessing functions are independent from
+    each other, so that they can run in parallel.
+
+    :param model: The model of the rows built, see ``get_data_files``.
+    :param data_file: The name of the data file the rows are built from.
+    :param areas: An iterable of the areas built from this data file.
+    :return: A function without arguments returning a generator of the rows
+        of all the areas, see ``_preprocess_laposte`` and
+        ``_preprocess_public_transport``.
+    """
+    preprocess = {PostalCode: _preprocess_laposte, PublicTransport: _preprocess_public_transport}
+    return functools.partial(preprocess[model], tuple(areas), data_file)
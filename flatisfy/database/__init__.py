@@ -5,6 +5,7 @@ This module contains functions related to the database.
 from __future__ import absolute_import, print_function, unicode_literals
 
 import sqlite3
+import threading
 
 from contextlib import contextmanager
 
@@ -15,7 +16,7 @@ from sqlalchemy.exc import OperationalError, SQLAlchemyError
 
 import flatisfy.models.flat  # noqa: F401
 from flatisfy.database.base import BASE
-from flatisfy.database.whooshalchemy import IndexService
+from flatisfy.database.whooshalchemy import close_index_services, get_index_service
 
 
 @event.listens_for(Engine, "connect")
@@ -30,26 +31,69 @@ def set_sqlite_pragma(dbapi_connection, _):
         cursor.close()
 
 
+# Engines, sessionmakers and session factories, per database URI, shared by
+# the whole process
+_DATABASES = {}
+_DATABASES_LOCK = threading.Lock()
+
+
 def init_db(database_uri=None, search_db_uri=None):
     """
     Initialize the database, ensuring tables exist etc.
 
+    The engine (and its connection pool) of a database is only created once
+    per process, and the tables checked at that time. Later calls with the
+    same database return the same session factory. Changes committed by its
+    sessions are indexed in the Whoosh indexes of ``search_db_uri``, once
+    whatever the number of calls.
+
     :param database_uri: An URI describing an engine to use. Defaults to
         in-memory SQLite database.
     :param search_db_uri: Path to the Whoosh index file to use.
-    :return: A tuple of an SQLAlchemy session maker and the created engine.
+    :return: A function returning a context manager of an SQLAlchemy
+        session, see ``_get_session_factory``.
     """
     if database_uri is None:
         database_uri = "sqlite:///:memory:"
 
-    engine = create_engine(database_uri)
-    BASE.metadata.create_all(engine, checkfirst=True)
-    Session = sessionmaker(bind=engine)  # pylint: disable=locally-disabled,invalid-name
+    with _DATABASES_LOCK:
+        try:
+            _, Session, get_session = _DATABASES[database_uri]  # pylint: disable=locally-disabled,invalid-name
+        except KeyError:
+            engine = create_engine(database_uri)
+            BASE.metadata.create_all(engine, checkfirst=True)
+            Session = sessionmaker(bind=engine)  # pylint: disable=locally-disabled,invalid-name
+            get_session = _get_session_factory(Session)
+            _DATABASES[database_uri] = (engine, Session, get_session)
 
     if search_db_uri:
-        index_service = IndexService(whoosh_base=search_db_uri)
+        index_service = get_index_service(search_db_uri, Session)
         index_service.register_class(flatisfy.models.flat.Flat)
 
+    return get_session
+
+
+def close_db():
+    """
+    Close all the databases initialized by ``init_db``, disposing of their
+    engines, and close the search indexes.
+    """
+    with _DATABASES_LOCK:
+        for engine, _, _ in _DATABASES.values():
+            engine.dispose()
+        _DATABASES.clear()
+    close_index_services()
+
+
+def _get_session_factory(Session):  # pylint: disable=locally-disabled,invalid-name
+    """
+    Build a session factory for a sessionmaker.
+
+    :param Session: An SQLAlchemy sessionmaker.
+    :return: A function returning a context manager of an SQLAlchemy
+        session, committed on exit.
+    """
+
     @contextmanager
     def get_session():
         # pylint: disable=locally-disabled,line-too-long
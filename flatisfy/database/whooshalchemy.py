@@ -17,6 +17,8 @@ Based on Flask-whooshalchemy by Karl Gyllstrom (Flask is still supported, but no
 from __future__ import absolute_import, print_function, unicode_literals
 
 import os
+import threading
+import weakref
 
 from six import text_type
 
@@ -28,37 +30,114 @@ from whoosh.analysis import StemmingAnalyzer
 from whoosh.fields import Schema
 from whoosh.qparser import MultifieldParser
 
+_INDEX_SERVICES = {}
+_INDEX_SERVICES_LOCK = threading.Lock()
+
+
+def get_index_service(whoosh_base, session_class=None):
+    """
+    Gets the index service of a Whoosh base directory. There is a single
+    service per directory in the process, created on first use.
+
+    If ``session_class`` is given, the service indexes the changes
+    committed by its sessions (see ``IndexService.listen``).
+    """
+    with _INDEX_SERVICES_LOCK:
+        key = os.path.abspath(whoosh_base)
+        index_service = _INDEX_SERVICES.get(key)
+        if index_service is None:
+            index_service = _INDEX_SERVICES[key] = IndexService(whoosh_base=whoosh_base, session_class=False)
+        if session_class is not None:
+            index_service.listen(session_class)
+        return index_service
+
+
+def close_index_services():
+    """
+    Closes all the index services returned by ``get_index_service``.
+    """
+    with _INDEX_SERVICES_LOCK:
+        for index_service in _INDEX_SERVICES.values():
+            index_service.close()
+        _INDEX_SERVICES.clear()
+
 
 class IndexService(object):
-    def __init__(self, config=None, whoosh_base=None):
+    def __init__(self, config=None, whoosh_base=None, session_class=None):
+        """
+        ``session_class`` is the class (or ``sessionmaker``) of the sessions
+        whose changes are indexed, defaulting to all sessions. Use ``False``
+        not to listen to any session yet.
+        """
         if not whoosh_base and config:
             whoosh_base = config.get("WHOOSH_BASE")
         if not whoosh_base:
             whoosh_base = "whoosh_indexes"  # Default value
         self.whoosh_base = whoosh_base
         self.indexes = {}
+        self.searchers = {}
+        # Changes to index, per session being committed
+        self.to_update = weakref.WeakKeyDictionary()
+        self.session_classes = []
 
-        event.listen(Session, "before_commit", self.before_commit)
-        event.listen(Session, "after_commit", self.after_commit)
+        if session_class is not False:
+            self.listen(session_class or Session)
+
+    def listen(self, session_class):
+        """
+        Indexes the changes committed by the sessions of a class (or a
+        ``sessionmaker``). Listening several times to the same class has no
+        effect.
+        """
+        for identifier, listener in self._get_listeners():
+            if not event.contains(session_class, identifier, listener):
+                event.listen(session_class, identifier, listener)
+        if session_class not in self.session_classes:
+            self.session_classes.append(session_class)
+
+    def _get_listeners(self):
+        return [
+            ("after_flush", self.after_flush),
+            ("after_commit", self.after_commit),
+            ("after_rollback", self.after_rollback),
+        ]
+
+    def close(self):
+        """
+        Stops listening to sessions and closes the indexes.
+        """
+        for session_class in self.session_classes:
+            for identifier, listener in self._get_listeners():
+                if event.contains(session_class, identifier, listener):
+                    event.remove(session_class, identifier, listener)
+        self.session_classes = []
+        for index in self.indexes.values():
+            index.close()
+        self.indexes = {}
+        self.searchers = {}
 
     def register_class(self, model_class):
         """
         Registers a model class, by creating the necessary Whoosh index if needed.
+        Registering a class again only makes it search this service indexes.
         """
 
-        index_path = os.path.join(self.whoosh_base, model_class.__name__)
+        index = self.indexes.get(model_class.__name__)
+        if index is None:
+            index_path = os.path.join(self.whoosh_base, model_class.__name__)
 
-        schema, primary = self._get_whoosh_schema_and_primary(model_class)
+            schema, primary = self._get_whoosh_schema_and_primary(model_class)
 
-        if whoosh.index.exists_in(index_path):
-            index = whoosh.index.open_dir(index_path)
-        else:
-            if not os.path.exists(index_path):
-                os.makedirs(index_path)
-            index = whoosh.index.create_in(index_path, schema)
+            if whoosh.index.exists_in(index_path):
+                index = whoosh.index.open_dir(index_path)
+            else:
+                if not os.path.exists(index_path):
+                    os.makedirs(index_path)
+                index = whoosh.index.create_in(index_path, schema)
 
-        self.indexes[model_class.__name__] = index
-        model_class.search_query = Searcher(model_class, primary, index)
+            self.indexes[model_class.__name__] = index
+            self.searchers[model_class.__name__] = Searcher(model_class, primary, index)
+        model_class.search_query = self.searchers[model_class.__name__]
         return index
 
     def index_for_model_class(self, model_class):
@@ -86,23 +165,39 @@ class IndexService(object):
                 schema[field.name] = whoosh.fields.TEXT(analyzer=StemmingAnalyzer())
         return Schema(**schema), primary
 
-    def before_commit(self, session):
-        self.to_update = {}
+    def after_flush(self, session, flush_context):
+        """
+        Collects the changes to index from each flush of a session, until it
+        is committed. Only the models whose ``__searchable__`` attributes
+        changed are indexed again.
+        """
+        to_update = self.to_update.setdefault(session, {})
 
         for model in session.new:
             model_class = model.__class__
             if hasattr(model_class, "__searchable__"):
-                self.to_update.setdefault(model_class.__name__, []).append(("new", model))
+                to_update.setdefault(model_class.__name__, {})[model] = "new"
 
         for model in session.deleted:
             model_class = model.__class__
             if hasattr(model_class, "__searchable__"):
-                self.to_update.setdefault(model_class.__name__, []).append(("deleted", model))
+                to_update.setdefault(model_class.__name__, {})[model] = "deleted"
 
         for model in session.dirty:
             model_class = model.__class__
-            if hasattr(model_class, "__searchable__"):
-                self.to_update.setdefault(model_class.__name__, []).append(("changed", model))
+            if hasattr(model_class, "__searchable__") and self._has_searchable_changes(model):
+                to_update.setdefault(model_class.__name__, {}).setdefault(model, "changed")
+
+    def after_rollback(self, session):
+        self.to_update.pop(session, None)
+
+    def _has_searchable_changes(self, model):
+        """
+        Checks whether the indexed attributes of a model changed, from their
+        history in the session (still available during ``after_flush``).
+        """
+        state = sqlalchemy.inspect(model)
+        return any(state.attrs[key].history.has_changes() for key in model.__class__.__searchable__)
 
     def after_commit(self, session):
         """
@@ -111,14 +206,14 @@ class IndexService(object):
         we update the whoosh index for the model. If no index exists, it will be
         created here; this could impose a penalty on the initial commit of a model.
         """
-        for typ, values in self.to_update.items():
-            model_class = values[0][1].__class__
+        for typ, values in self.to_update.pop(session, {}).items():
+            model_class = next(iter(values)).__class__
             index = self.index_for_model_class(model_class)
             with index.writer() as writer:
                 primary_field = model_class.search_query.primary
                 searchable = model_class.__searchable__
 
-                for change_type, model in values:
+                for model, change_type in values.items():
                     # delete everything. stuff that's updated or inserted will get
                     # added as a new doc. Could probably replace this with a whoosh
                     # update.
@@ -131,8 +226,6 @@ class IndexService(object):
                         attrs[primary_field] = text_type(getattr(model, primary_field))
                         writer.add_document(**attrs)
 
-        self.to_update = {}
-
 
 class Searcher(object):
     """
@@ -143,14 +236,13 @@ class Searcher(object):
         self.model_class = model_class
         self.primary = primary
         self.index = index
-        self.searcher = index.searcher()
         fields = set(index.schema._fields.keys()) - set([self.primary])
         self.parser = MultifieldParser(list(fields), index.schema)
 
     def __call__(self, session, query, limit=None):
-        results = self.index.searcher().search(self.parser.parse(query), limit=limit)
-
-        keys = [x[self.primary] for x in results]
+        with self.index.searcher() as searcher:
+            results = searcher.search(self.parser.parse(query), limit=limit)
+            keys = [x[self.primary] for x in results]
         primary_column = getattr(self.model_class, self.primary)
 
         db_query = session.query(self.model_class)
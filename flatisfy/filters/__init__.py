@@ -10,6 +10,7 @@ import logging
 
 from flatisfy import tools
 from flatisfy.filters import duplicates
+from flatisfy.filters.cache import GeocodingCache, TravelTimeCache
 from flatisfy.filters import images
 from flatisfy.filters import metadata
 
@@ -146,8 +147,25 @@ def refine_with_details_criteria(flats_list, constraint):
     )
 
 
+def save_geocoding_cache(geocoding_cache):
+    """
+    Persist the geocoding cache and log its statistics.
+
+    :param geocoding_cache: The ``GeocodingCache`` of the current run.
+    """
+    geocoding_cache.save()
+    if geocoding_cache.total():
+        LOGGER.info(
+            "Geocoding: %d lookups, %d%% served from cache (%d hits, %d misses).",
+            geocoding_cache.total(),
+            geocoding_cache.hit_rate(),
+            geocoding_cache.hits,
+            geocoding_cache.misses,
+        )
+
+
 @tools.timeit
-def first_pass(flats_list, constraint, config):
+def first_pass(flats_list, constraint, config, geocoding_cache=None):
     """
     First filtering pass.
 
@@ -158,6 +176,8 @@ def first_pass(flats_list, constraint, config):
     :param flats_list: A list of flats dict to filter.
     :param constraint: The constraint that the ``flats_list`` should satisfy.
     :param config: A config dict.
+    :param geocoding_cache: The ``GeocodingCache`` of the current run. A new
+        one is created and saved afterwards if not provided.
     :return: A dict mapping flat status and list of flat objects.
     """
     LOGGER.info("Running first filtering pass.")
@@ -172,11 +192,18 @@ def first_pass(flats_list, constraint, config):
     flats_list, duplicates_by_urls = duplicates.detect(flats_list, key="urls", merge=True, should_intersect=True)
 
     # Guess the postal codes
-    flats_list = metadata.guess_postal_code(flats_list, constraint, config)
+    save_cache = geocoding_cache is None
+    if save_cache:
+        geocoding_cache = GeocodingCache(config)
+    flats_list = metadata.guess_postal_code(
+        flats_list, constraint, config, geocoding_cache=geocoding_cache
+    )
 
     if not config["ignore_station"]:
         # Try to match with stations
-        flats_list = metadata.guess_stations(flats_list, constraint, config)
+        flats_list = metadata.guess_stations(flats_list, constraint, config, geocoding_cache)
+    if save_cache:
+        save_geocoding_cache(geocoding_cache)
 
     # Remove returned housing posts that do not match criteria
     flats_list, ignored_list = refine_with_housing_criteria(flats_list, constraint)
@@ -185,7 +212,7 @@ def first_pass(flats_list, constraint, config):
 
 
 @tools.timeit
-def second_pass(flats_list, constraint, config):
+def second_pass(flats_list, constraint, config, geocoding_cache=None):
     """
     Second filtering pass.
 
@@ -199,6 +226,8 @@ def second_pass(flats_list, constraint, config):
     :param flats_list: A list of flats dict to filter.
     :param constraint: The constraint that the ``flats_list`` should satisfy.
     :param config: A config dict.
+    :param geocoding_cache: The ``GeocodingCache`` of the current run. A new
+        one is created and saved afterwards if not provided.
     :return: A dict mapping flat status and list of flat objects.
     """
     LOGGER.info("Running second filtering pass.")
@@ -206,14 +235,37 @@ def second_pass(flats_list, constraint, config):
     # left and we already tried to find postal code and nearby stations.
 
     # Confirm postal code
-    flats_list = metadata.guess_postal_code(flats_list, constraint, config)
+    save_cache = geocoding_cache is None
+    if save_cache:
+        geocoding_cache = GeocodingCache(config)
+    flats_list = metadata.guess_postal_code(
+        flats_list, constraint, config, geocoding_cache=geocoding_cache
+    )
 
     # Better match with stations (confirm and check better)
     if not config["ignore_station"]:
-        flats_list = metadata.guess_stations(flats_list, constraint, config)
+        flats_list = metadata.guess_stations(flats_list, constraint, config, geocoding_cache)
 
         # Compute travel time to specified points
-        flats_list = metadata.compute_travel_times(flats_list, constraint, config)
+        travel_time_cache = TravelTimeCache(config)
+        flats_list = metadata.compute_travel_times(
+            flats_list, constraint, config, travel_time_cache
+        )
+        travel_time_cache.save()
+        if travel_time_cache.total():
+            LOGGER.info(
+                "Travel times: %d lookups, %d%% served from cache (%d hits, %d misses).",
+                travel_time_cache.total(),
+                travel_time_cache.hit_rate(),
+                travel_time_cache.hits,
+                travel_time_cache.misses,
+            )
+        if travel_time_cache.pruned:
+            LOGGER.info(
+                "Travel times: %d lookups saved using lower bounds.", travel_time_cache.pruned
+            )
+    if save_cache:
+        save_geocoding_cache(geocoding_cache)
 
     # Remove returned housing posts that do not match criteria
     flats_list, ignored_list = refine_with_housing_criteria(flats_list, constraint)
@@ -222,14 +274,11 @@ def second_pass(flats_list, constraint, config):
     # fetched details.
     flats_list, ignored_list = refine_with_details_criteria(flats_list, constraint)
 
-    if config["serve_images_locally"]:
-        images.download_images(flats_list, config)
-
     return {"new": flats_list, "ignored": ignored_list, "duplicate": []}
 
 
 @tools.timeit
-def third_pass(flats_list, config):
+def third_pass(flats_list, config, image_service=None):
     """
     Third filtering pass.
 
@@ -238,11 +287,31 @@ def third_pass(flats_list, config):
 
     :param flats_list: A list of flats dict to filter.
     :param config: A config dict.
+    :param image_service: The ``ImageService`` of the current run.
     :return: A dict mapping flat status and list of flat objects.
     """
     LOGGER.info("Running third filtering pass.")
 
     # Deduplicate the list using every available data
-    flats_list, duplicate_flats = duplicates.deep_detect(flats_list, config)
+    flats_list, duplicate_flats = duplicates.deep_detect(flats_list, config, image_service)
 
     return {"new": flats_list, "ignored": [], "duplicate": duplicate_flats}
+
+
+@tools.timeit
+def mirror_images(flats_list, config, image_service=None):
+    """
+    Images mirroring stage.
+
+    Download the photos of the flats to serve them locally. This stage is
+    expected to run after the deep duplicates detection, so that only the
+    photos of the remaining flats are stored.
+
+    :param flats_list: A list of flats dict.
+    :param config: A config dict.
+    :param image_service: The ``ImageService`` of the current run.
+    :return: The updated list of flats dict.
+    """
+    LOGGER.info("Mirroring images of %d flats.", len(flats_list))
+    images.download_images(flats_list, config, image_service)
+    return flats_list
@@ -1,21 +1,51 @@
 # coding: utf-8
 """
-Caching function for pictures.
+Caching functions for pictures, travel times and geocoding.
 """
 
 from __future__ import absolute_import, print_function, unicode_literals
 
 import collections
+import copy
 import hashlib
+import json
 import os
 import requests
 import logging
+import time
 from io import BytesIO
 
+import imagehash
 import PIL.Image
 
+from flatisfy import tools
+from flatisfy.constants import PUBLIC_TRANSPORT_DEPARTURE, TimeToModes
+
 LOGGER = logging.getLogger(__name__)
 
+# Minimal size (in pixels) at which images are decoded to compute their
+# perceptual hash. Average hashes are computed on a 8x8 thumbnail, so there is
+# no need to decode the full image. JPEG images are decoded directly at a
+# reduced scale (DCT scaling), which is much cheaper.
+HASH_DECODE_SIZE = 64
+
+
+def compute_image_hash(source):
+    """
+    Compute the average hash of an image, decoding it at reduced resolution.
+
+    The image is always decoded again from its encoded source, as a hash
+    computed on a fully decoded image slightly differs from a hash computed on
+    a draft-decoded one.
+
+    :param source: The path of the image file, or a file object.
+    :return: The ``imagehash.ImageHash`` of the image.
+    """
+    with PIL.Image.open(source) as image:
+        # No-op if the image is not a JPEG image
+        image.draft("L", (HASH_DECODE_SIZE, HASH_DECODE_SIZE))
+        return imagehash.average_hash(image)
+
 
 class MemoryCache(object):
     """
@@ -125,21 +155,341 @@ class ImageCache(MemoryCache):
             req = requests.get(url)
             req.raise_for_status()
             image = PIL.Image.open(BytesIO(req.content))
-            if filepath:
+            if filepath and self.persist:
                 image.save(filepath, format=image.format)
+            # Keep the encoded image, which is much smaller than the decoded
+            # one, to be able to store it later on without fetching it again.
+            if len(self.sources) > self.max_items:
+                self.sources.popitem(last=False)
+            self.sources[url] = req.content
             return image
         except (requests.HTTPError, IOError) as exc:
             LOGGER.info(f"Download photo from {url} failed: {exc}")
             return None
 
-    def __init__(self, max_items=200, storage_dir=None):
+    def get_hash(self, url):
+        """
+        Get the average hash of an image. Hashes are computed once and kept
+        even when the image itself is evicted from the cache.
+
+        :param url: The URL of the image.
+        :return: The ``imagehash.ImageHash`` of the image, or ``None`` if it
+            could not be fetched.
+        """
+        if url in self.hashes:
+            self.hash_hits += 1
+            return self.hashes[url]
+
+        image = self.get(url)
+        if image:
+            # The image is not needed anymore once hashed, do not keep it in
+            # memory and only decode it at reduced resolution.
+            self.map.pop(url, None)
+            if url in self.sources:
+                source = BytesIO(self.sources[url])
+            else:
+                source = image.filename
+            self.hashes[url] = compute_image_hash(source)
+        else:
+            self.hashes[url] = None
+        return self.hashes[url]
+
+    def __init__(self, max_items=200, storage_dir=None, persist=True):
         """
         :param max_items: Max number of items in the cache, to prevent Out Of
             Memory errors.
         :param storage_dir: Directory in which images should be stored.
+        :param persist: Whether fetched images should be written to
+            ``storage_dir``. If ``False``, images are only read from it.
         """
         self.max_items = max_items
         self.storage_dir = storage_dir
+        self.persist = persist
+        self.hashes = {}
+        self.hash_hits = 0
+        self.sources = collections.OrderedDict()
         if self.storage_dir and not os.path.isdir(self.storage_dir):
             os.makedirs(self.storage_dir)
         super(ImageCache, self).__init__()
+
+
+class TravelTimeCache(MemoryCache):
+    """
+    A cache for travel times, persisted as JSON in the data directory so that
+    routes are not requested again on each run.
+
+    Keys are tuples of (origin, destination, ``TimeToModes`` mode). Travel
+    times are stored along with the backend which computed them, so that they
+    are computed again if another backend is configured.
+    """
+
+    FILENAME = "travel_times.json"
+    # Number of decimals kept for the positions in the keys, about 10 meters
+    POSITION_PRECISION = 4
+
+    def __init__(self, config):
+        """
+        :param config: A config dict.
+        """
+        super(TravelTimeCache, self).__init__()
+        self.config = config
+        # Number of travel times which were not looked up, as they could not
+        # be short enough to matter
+        self.pruned = 0
+        self.ttl = config["travel_time_cache_ttl"]
+        self.max_items = config["travel_time_cache_max_items"]
+        self.filepath = None
+        if config["data_directory"]:
+            self.filepath = os.path.join(config["data_directory"], self.FILENAME)
+        # Backend of each mode, see ``tools.get_travel_time_backend``
+        self.backends = {}
+        self.load()
+
+    def compute_key(self, latlng_from, latlng_to, mode):
+        """
+        Compute the key of a travel time in the persisted cache.
+
+        :param latlng_from: A tuple of (latitude, longitude) for the starting
+            point.
+        :param latlng_to: A tuple of (latitude, longitude) for the
+            destination.
+        :param mode: A ``TimeToModes`` enum value.
+        :return: The key, as a string.
+        """
+        departure_slot = ""
+        if mode == TimeToModes.PUBLIC_TRANSPORT:
+            departure_slot = "%(weekday)d-%(hour)02d:%(minute)02d" % PUBLIC_TRANSPORT_DEPARTURE
+        if mode not in self.backends:
+            self.backends[mode] = tools.get_travel_time_backend(mode, self.config)
+        return "%.*f,%.*f|%.*f,%.*f|%s|%s|%s" % (
+            self.POSITION_PRECISION,
+            latlng_from[0],
+            self.POSITION_PRECISION,
+            latlng_from[1],
+            self.POSITION_PRECISION,
+            latlng_to[0],
+            self.POSITION_PRECISION,
+            latlng_to[1],
+            mode.name,
+            departure_slot,
+            self.backends[mode],
+        )
+
+    def on_miss(self, key):
+        """
+        Helper to actually compute travel times if not already cached.
+        """
+        return tools.get_travel_time_between(*key, config=self.config)
+
+    def get_cached(self, key):
+        """
+        Get a travel time from cache, without computing it if missing.
+
+        :param key: A tuple of (origin, destination, mode).
+        :return: A dict of the travel time and sections of the journey, or
+            ``None`` if it is not cached or expired.
+        """
+        cached = self.map.get(self.compute_key(*key), None)
+        if cached is not None and time.time() - cached["timestamp"] <= self.ttl:
+            return cached["value"]
+        return None
+
+    def get(self, key):
+        """
+        Get a travel time from cache. Eventually call ``on_miss`` if it is not
+        already cached or expired.
+
+        :param key: A tuple of (origin, destination, mode).
+        :return: A dict of the travel time and sections of the journey, or
+            ``None``.
+        """
+        cache_key = self.compute_key(*key)
+        cached = self.map.get(cache_key, None)
+        if cached is not None and time.time() - cached["timestamp"] <= self.ttl:
+            self.hits += 1
+            self.map.move_to_end(cache_key)
+            return cached["value"]
+
+        item = self.on_miss(key)
+        self.misses += 1
+        # Failed lookups are not cached, as errors are often transient
+        if item is not None:
+            self.map[cache_key] = {"timestamp": time.time(), "value": item}
+            self.map.move_to_end(cache_key)
+        return item
+
+    def put(self, key, item):
+        """
+        Store a travel time computed outside of the cache, e.g. in a batch.
+        It is counted as a miss.
+
+        :param key: A tuple of (origin, destination, mode).
+        :param item: A dict of the travel time and sections of the journey.
+        """
+        cache_key = self.compute_key(*key)
+        self.misses += 1
+        self.map[cache_key] = {"timestamp": time.time(), "value": item}
+        self.map.move_to_end(cache_key)
+
+    def load(self):
+        """
+        Load the persisted travel times, if any.
+        """
+        if not self.filepath or not os.path.isfile(self.filepath):
+            return
+        try:
+            with open(self.filepath, "r") as fh:
+                self.map = collections.OrderedDict(json.load(fh))
+        except (IOError, ValueError) as exc:
+            LOGGER.warning("Unable to load cached travel times from %s: %s.", self.filepath, exc)
+
+    def save(self):
+        """
+        Persist the travel times, dropping expired entries and the least
+        recently used ones above ``max_items``.
+        """
+        now = time.time()
+        for key in [k for k, v in self.map.items() if now - v["timestamp"] > self.ttl]:
+            del self.map[key]
+        while len(self.map) > self.max_items:
+            self.map.popitem(last=False)
+
+        if not self.filepath:
+            return
+        try:
+            # Write to a temporary file first, to never leave a partially
+            # written cache behind
+            with open(self.filepath + ".tmp", "w") as fh:
+                json.dump(list(self.map.items()), fh)
+            os.replace(self.filepath + ".tmp", self.filepath)
+        except IOError as exc:
+            LOGGER.warning("Unable to save cached travel times to %s: %s.", self.filepath, exc)
+
+
+class GeocodingCache(MemoryCache):
+    """
+    A cache for the postal codes, positions and stations guessed from the
+    location and station strings of the flats, persisted as JSON in the data
+    directory so that unchanged listings are not matched again on each pass
+    and run.
+
+    Cached values depend on the opendata, the cache is dropped whenever it is
+    rebuilt (see ``invalidate``).
+    """
+
+    FILENAME = "geocoding.json"
+    # Maximum number of cached items, least recently used ones are dropped
+    MAX_ITEMS = 50000
+
+    def __init__(self, config):
+        """
+        :param config: A config dict.
+        """
+        super(GeocodingCache, self).__init__()
+        self.filepath = self.get_filepath(config)
+        # Whether items were added since the cache was loaded
+        self.changed = False
+        self.load()
+
+    @classmethod
+    def get_filepath(cls, config):
+        """
+        Get the path of the persisted cache.
+
+        :param config: A config dict.
+        :return: The path of the file, or ``None`` if there is no data
+            directory.
+        """
+        if not config["data_directory"]:
+            return None
+        return os.path.join(config["data_directory"], cls.FILENAME)
+
+    @classmethod
+    def invalidate(cls, config):
+        """
+        Drop the persisted cache, typically after rebuilding the opendata.
+
+        :param config: A config dict.
+        """
+        filepath = cls.get_filepath(config)
+        if filepath and os.path.isfile(filepath):
+            os.remove(filepath)
+
+    @staticmethod
+    def normalize(string):
+        """
+        Normalize a location or station string for use in a key. Only case
+        and spacing are normalized, as anything else may change the result.
+
+        :param string: The string to normalize.
+        :return: The normalized string.
+        """
+        return " ".join(string.lower().split())
+
+    @staticmethod
+    def compute_key(key):
+        """
+        Compute the key of an item in the persisted cache.
+
+        :param key: A tuple of strings, numbers or lists of them.
+        :return: The key, as a string.
+        """
+        return json.dumps(key)
+
+    def get(self, key, compute):
+        """
+        Get an item from cache, calling ``compute`` if it is not already
+        cached. ``None`` values are cached as well.
+
+        :param key: A tuple of strings, numbers or lists of them, see
+            ``compute_key``.
+        :param compute: A function without arguments computing the item. It
+            should return a JSON serializable value.
+        :return: A copy of the item, as loaded back from JSON (tuples are
+            returned as lists), so that cached and computed items are
+            consistent.
+        """
+        cache_key = self.compute_key(key)
+        if cache_key in self.map:
+            self.hits += 1
+            self.map.move_to_end(cache_key)
+        else:
+            self.misses += 1
+            # Store the item as it would be loaded back from JSON
+            self.map[cache_key] = json.loads(json.dumps(compute()))
+            self.changed = True
+        return copy.deepcopy(self.map[cache_key])
+
+    def load(self):
+        """
+        Load the persisted items, if any.
+        """
+        if not self.filepath or not os.path.isfile(self.filepath):
+            return
+        try:
+            with open(self.filepath, "r") as fh:
+                self.map = collections.OrderedDict(json.load(fh))
+        except (IOError, ValueError) as exc:
+            LOGGER.warning("Unable to load cached geocoding from %s: %s.", self.filepath, exc)
+
+    def save(self):
+        """
+        Persist the items, dropping the least recently used ones above
+        ``MAX_ITEMS``. Nothing is written if no item was added.
+        """
+        if not self.changed:
+            return
+        while len(self.map) > self.MAX_ITEMS:
+            self.map.popitem(last=False)
+
+        if not self.filepath:
+            return
+        try:
+            # Write to a temporary file first, to never leave a partially
+            # written cache behind
+            with open(self.filepath + ".tmp", "w") as fh:
+                json.dump(list(self.map.items()), fh)
+            os.replace(self.filepath + ".tmp", self.filepath)
+            self.changed = False
+        except IOError as exc:
+            LOGGER.warning("Unable to save cached geocoding to %s: %s.", self.filepath, exc)
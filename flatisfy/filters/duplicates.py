@@ -7,15 +7,13 @@ from __future__ import absolute_import, print_function, unicode_literals
 import collections
 import itertools
 import logging
-import os
 import re
 
-import imagehash
 import requests
 
 from flatisfy import tools
 from flatisfy.constants import BACKENDS_BY_PRECEDENCE
-from flatisfy.filters.cache import ImageCache
+from flatisfy.filters.images import ImageService
 
 LOGGER = logging.getLogger(__name__)
 
@@ -67,10 +65,10 @@ def get_or_compute_photo_hash(photo, photo_cache):
         return photo["hash"]
     except KeyError:
         # Otherwise, get the image and compute the hash
-        image = photo_cache.get(photo["url"])
-        if not image:
+        photo_hash = photo_cache.get_hash(photo["url"])
+        if photo_hash is None:
             return None
-        photo["hash"] = imagehash.average_hash(image)
+        photo["hash"] = photo_hash
         return photo["hash"]
 
 
@@ -297,21 +295,21 @@ def get_duplicate_score(flat1, flat2, photo_cache, hash_threshold):
     return n_common_items
 
 
-def deep_detect(flats_list, config):
+def deep_detect(flats_list, config, image_service=None):
     """
     Deeper detection of duplicates based on any available data.
 
     :param flats_list: A list of flats dicts.
     :param config: A config dict.
+    :param image_service: The ``ImageService`` of the current run. A new one
+        is created if not provided.
     :return: A tuple of the deduplicated list of flat dicts and the list of all
         the flats objects that should be removed and considered as duplicates
         (they were already merged).
     """
-    if config["serve_images_locally"]:
-        storage_dir = os.path.join(config["data_directory"], "images")
-    else:
-        storage_dir = None
-    photo_cache = ImageCache(storage_dir=storage_dir)
+    if image_service is None:
+        image_service = ImageService(config)
+    photo_cache = image_service.cache
 
     LOGGER.info("Running deep duplicates detection.")
     matching_flats = collections.defaultdict(list)
@@ -338,13 +336,6 @@ def deep_detect(flats_list, config):
                 matching_flats[flat1["id"]].append(flat2["id"])
                 matching_flats[flat2["id"]].append(flat1["id"])
 
-    if photo_cache.total():
-        LOGGER.debug(
-            "Photo cache: hits: %d%% / misses: %d%%.",
-            photo_cache.hit_rate(),
-            photo_cache.miss_rate(),
-        )
-
     seen_ids = []
     duplicate_flats = []
     unique_flats_list = []
@@ -6,28 +6,397 @@ This includes functions to download images.
 """
 from __future__ import absolute_import, print_function, unicode_literals
 
+import collections
+import concurrent.futures
 import logging
 import os
+import threading
+import time
+from io import BytesIO
+from urllib.parse import urlparse
 
-from flatisfy.filters.cache import ImageCache
+import PIL.Image
+import requests
+
+from flatisfy.filters.cache import ImageCache, compute_image_hash
 
 
 LOGGER = logging.getLogger(__name__)
 
+# Size buckets of the derivatives generated for each downloaded image, mapping
+# the bucket name to the maximum width / height of the derivative, in pixels.
+# The ``full`` bucket is the original image as downloaded.
+IMAGE_SIZES = {"thumbnail": 300, "medium": 1024}
+# Formats in which derivatives are generated, mapping file extension to PIL
+# format and save options.
+IMAGE_FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpg": ("JPEG", {"quality": 80, "optimize": True, "progressive": True}),
+}
+
+
+def compute_derivative_filename(filename, size, extension):
+    """
+    Compute the filename of a derivative of a locally stored image.
+
+    :param filename: The filename of the original image, as returned by
+        ``ImageCache.compute_filename``.
+    :param size: The size bucket of the derivative, a key of ``IMAGE_SIZES``.
+    :param extension: The extension of the derivative, a key of
+        ``IMAGE_FORMATS``.
+    :return: The filename of the derivative.
+
+    :Example:
+
+        >>> compute_derivative_filename("abcdef.jpg", "thumbnail", "webp")
+        'abcdef-thumbnail.webp'
+    """
+    return "%s-%s.%s" % (os.path.splitext(filename)[0], size, extension)
+
+
+def generate_derivatives(image, filename, storage_dir):
+    """
+    Generate the size-bucketed derivatives of an image, in every available
+    format. Derivatives which already exist are not generated again.
+
+    :param image: A ``PIL.Image`` object.
+    :param filename: The filename of the original image, as returned by
+        ``ImageCache.compute_filename``.
+    :param storage_dir: Directory in which derivatives should be stored.
+    """
+    for size, max_dimension in IMAGE_SIZES.items():
+        derivative = None
+        for extension, (image_format, save_options) in IMAGE_FORMATS.items():
+            filepath = os.path.join(
+                storage_dir, compute_derivative_filename(filename, size, extension)
+            )
+            if os.path.isfile(filepath):
+                continue
+            if image_format == image.format and max(image.size) <= max_dimension:
+                # Original image already fits in this size bucket, it will be
+                # served directly.
+                continue
+
+            if derivative is None:
+                derivative = image.convert("RGB")
+                # Only downscale, never upscale
+                derivative.thumbnail((max_dimension, max_dimension), PIL.Image.LANCZOS)
+            try:
+                derivative.save(filepath, format=image_format, **save_options)
+            except (IOError, KeyError) as exc:
+                # KeyError is raised if the format is not supported by the
+                # available PIL build.
+                LOGGER.info("Unable to generate %s derivative %s: %s.", image_format, filepath, exc)
+
+
+class BandwidthLimiter(object):
+    """
+    A token bucket limiting the overall bandwidth used by concurrent
+    downloads. Safe to share between threads.
+    """
+
+    def __init__(self, max_bandwidth):
+        """
+        :param max_bandwidth: Maximum bandwidth, in bytes per second.
+        """
+        self.max_bandwidth = max_bandwidth
+        self.lock = threading.Lock()
+        self.tokens = max_bandwidth
+        self.last_refill = time.monotonic()
+
+    def consume(self, nbytes):
+        """
+        Consume ``nbytes`` from the bucket, blocking until enough bandwidth is
+        available.
+
+        :param nbytes: Number of downloaded bytes.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.max_bandwidth,
+                self.tokens + (now - self.last_refill) * self.max_bandwidth,
+            )
+            self.last_refill = now
+            self.tokens -= nbytes
+            # Negative tokens means we are over budget, wait for the bucket
+            # to be refilled. Sleeping with the lock held ensures the other
+            # downloads wait as well.
+            if self.tokens < 0:
+                time.sleep(-self.tokens / self.max_bandwidth)
+
+
+class ImageDownloader(object):
+    """
+    Concurrent downloader of images to a local storage directory, with a
+    bounded number of workers, a limit of concurrent downloads per host and an
+    optional overall bandwidth cap.
+    """
+
+    CHUNK_SIZE = 16 * 1024
+
+    def __init__(
+        self,
+        storage_dir,
+        max_workers=8,
+        max_workers_per_host=2,
+        max_bandwidth=None,
+        on_image=None,
+        get_source=None,
+    ):
+        """
+        :param storage_dir: Directory in which images should be stored.
+        :param max_workers: Maximum number of concurrent downloads.
+        :param max_workers_per_host: Maximum number of concurrent downloads
+            from a single host.
+        :param max_bandwidth: Overall maximum bandwidth in bytes per second,
+            ``None`` for no limit.
+        :param on_image: Optional callback, called from the workers with the
+            URL and the path of every stored image.
+        :param get_source: Optional callable returning the already fetched
+            content (as bytes) of a given URL (or ``None``), to avoid
+            downloading it again.
+        """
+        self.storage_dir = storage_dir
+        self.on_image = on_image
+        self.get_source = get_source
+        if not os.path.isdir(self.storage_dir):
+            os.makedirs(self.storage_dir)
+        self.max_workers = max_workers
+        self.max_workers_per_host = max_workers_per_host
+        self.bandwidth_limiter = BandwidthLimiter(max_bandwidth) if max_bandwidth else None
+
+        self.lock = threading.Lock()
+        self.host_semaphores = {}
+        self.stats = collections.Counter()
+
+    def _host_semaphore(self, url):
+        """
+        Get the semaphore limiting concurrent downloads from the host of the
+        given URL.
+        """
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.host_semaphores:
+                self.host_semaphores[host] = threading.BoundedSemaphore(self.max_workers_per_host)
+            return self.host_semaphores[host]
+
+    def _fetch(self, url):
+        """
+        Fetch the content at the given URL, honoring the per host and
+        bandwidth limits.
+
+        :return: The fetched content, as bytes.
+        """
+        with self._host_semaphore(url):
+            req = requests.get(url, stream=True, timeout=30)
+            try:
+                req.raise_for_status()
+                content = BytesIO()
+                for chunk in req.iter_content(chunk_size=self.CHUNK_SIZE):
+                    if self.bandwidth_limiter:
+                        self.bandwidth_limiter.consume(len(chunk))
+                    content.write(chunk)
+            finally:
+                req.close()
+        with self.lock:
+            self.stats["bytes"] += content.tell()
+        content.seek(0)
+        return content
+
+    def download(self, url):
+        """
+        Download a single image, unless it is already stored locally, and
+        generate its derivatives.
+
+        :param url: The URL of the image.
+        :return: The filename of the stored image, or ``None`` if it could
+            not be fetched.
+        """
+        if url.endswith(".svg"):
+            # Skip SVG photo which are unsupported and unlikely to be relevant
+            return None
+
+        filename = ImageCache.compute_filename(url)
+        filepath = os.path.join(self.storage_dir, filename)
+        try:
+            if os.path.isfile(filepath):
+                status = "cached"
+                source = filepath
+            else:
+                source = self.get_source(url) if self.get_source else None
+                if source is not None:
+                    status = "reused"
+                    source = BytesIO(source)
+                else:
+                    status = "downloaded"
+                    LOGGER.debug("Download photo from %s to %s.", url, filepath)
+                    source = self._fetch(url)
+            # Close the image file once done, not to leak file handles
+            with PIL.Image.open(source) as image:
+                if status != "cached":
+                    image.save(filepath, format=image.format)
+                generate_derivatives(image, filename, self.storage_dir)
+            if self.on_image:
+                self.on_image(url, filepath)
+        except (requests.exceptions.RequestException, IOError) as exc:
+            LOGGER.info("Download photo from %s failed: %s.", url, exc)
+            status = "failed"
+            filename = None
+
+        with self.lock:
+            self.stats[status] += 1
+        return filename
+
+    def run(self, urls):
+        """
+        Download all the given images concurrently.
+
+        :param urls: An iterable of image URLs.
+        :return: A dict mapping each URL to the filename of the stored image,
+            or ``None`` if it could not be fetched.
+        """
+        urls = list(urls)
+        # Statistics are per run, as the runtime
+        self.stats = collections.Counter()
+        before = time.time()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            filenames = dict(zip(urls, executor.map(self.download, urls)))
+        runtime = time.time() - before
+
+        LOGGER.info(
+            (
+                "Mirrored %d images in %.1fs: %d downloaded (%.1f MB, %.1f kB/s), "
+                "%d reused from memory, %d already stored, %d failures."
+            ),
+            len(filenames),
+            runtime,
+            self.stats["downloaded"],
+            self.stats["bytes"] / 1e6,
+            self.stats["bytes"] / 1e3 / runtime if runtime else 0,
+            self.stats["reused"],
+            self.stats["cached"],
+            self.stats["failed"],
+        )
+        return filenames
+
+
+class ImageService(object):
+    """
+    Run-scoped service handling images. It owns the in-memory cache of decoded
+    images, the perceptual hashes of the images and the mapping between image
+    URLs and locally stored files.
+
+    A single instance is meant to be shared by every filtering stage and every
+    constraint of a run, so that an image is only fetched and decoded once.
+    """
+
+    def __init__(self, config):
+        """
+        :param config: A config dict.
+        """
+        self.config = config
+        if config["serve_images_locally"]:
+            self.storage_dir = os.path.join(config["data_directory"], "images")
+        else:
+            self.storage_dir = None
+        # Images are only read from the storage directory here. They are only
+        # written to it when mirroring, so that photos of flats discarded
+        # during filtering never hit the disk.
+        self.cache = ImageCache(storage_dir=self.storage_dir, persist=False)
+        self.local_files = {}
+        self.downloader = None
+        # Statistics of all the runs of the downloader
+        self.download_stats = collections.Counter()
+
+    def get_hash(self, url):
+        """
+        Get the average hash of an image.
+
+        :param url: The URL of the image.
+        :return: The ``imagehash.ImageHash`` of the image, or ``None``.
+        """
+        return self.cache.get_hash(url)
+
+    def _store_hash(self, url, filepath):
+        """
+        Compute the hash of an image stored by the downloader, to avoid
+        fetching it again for duplicates detection.
+        """
+        if url not in self.cache.hashes:
+            self.cache.hashes[url] = compute_image_hash(filepath)
+
+    def mirror(self, urls):
+        """
+        Store the given images locally, downloading the ones which are not
+        already stored.
+
+        :param urls: An iterable of image URLs.
+        :return: A dict mapping each URL to the filename of the stored image,
+            or ``None`` if it could not be fetched.
+        """
+        if self.downloader is None:
+            self.downloader = ImageDownloader(
+                os.path.join(self.config["data_directory"], "images"),
+                max_workers=self.config["image_download_workers"],
+                max_workers_per_host=self.config["image_download_workers_per_host"],
+                max_bandwidth=self.config["image_download_max_bandwidth"],
+                on_image=self._store_hash,
+                get_source=self.cache.sources.get,
+            )
+        urls = [url for url in set(urls) if url not in self.local_files]
+        self.local_files.update(self.downloader.run(urls))
+        self.download_stats.update(self.downloader.stats)
+        return self.local_files
+
+    def log_stats(self):
+        """
+        Log the combined statistics of the images handled during the run.
+        """
+        if self.cache.total():
+            LOGGER.info(
+                "Photo cache: hits: %d%% / misses: %d%%, %d hashes computed (%d reused).",
+                self.cache.hit_rate(),
+                self.cache.miss_rate(),
+                len(self.cache.hashes),
+                self.cache.hash_hits,
+            )
+        if self.downloader:
+            LOGGER.info(
+                (
+                    "Mirrored images: %d downloaded (%.1f MB), %d reused from memory, "
+                    "%d already stored, %d failures."
+                ),
+                self.download_stats["downloaded"],
+                self.download_stats["bytes"] / 1e6,
+                self.download_stats["reused"],
+                self.download_stats["cached"],
+                self.download_stats["failed"],
+            )
+
 
-def download_images(flats_list, config):
+def download_images(flats_list, config, image_service=None):
     """
     Download images for all flats in the list, to serve them locally.
 
     :param flats_list: A list of flats dicts.
     :param config: A config dict.
+    :param image_service: The ``ImageService`` of the current run. A new one
+        is created if not provided.
     """
-    photo_cache = ImageCache(storage_dir=os.path.join(config["data_directory"], "images"))
-    for flat in flats_list:
-        for photo in flat["photos"]:
-            # Download photo
-            image = photo_cache.get(photo["url"])
-            # And store the local image
-            # Only add it if fetching was successful
-            if image:
-                photo["local"] = photo_cache.compute_filename(photo["url"])
+    if image_service is None:
+        image_service = ImageService(config)
+    storage_dir = os.path.join(config["data_directory"], "images")
+    # Only consider photos which are not already stored
+    photos = [
+        photo
+        for flat in flats_list
+        for photo in flat.get("photos", [])
+        if not (photo.get("local") and os.path.isfile(os.path.join(storage_dir, photo["local"])))
+    ]
+    filenames = image_service.mirror(photo["url"] for photo in photos)
+    for photo in photos:
+        # Store the local image
+        # Only add it if fetching was successful
+        if filenames[photo["url"]]:
+            photo["local"] = filenames[photo["url"]]
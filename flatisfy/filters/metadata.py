@@ -7,18 +7,26 @@ actual fetched data.
 """
 from __future__ import absolute_import, print_function, unicode_literals
 
+import collections
+import functools
 import logging
 import re
 
 from flatisfy import data
+from flatisfy import geo
 from flatisfy import tools
 from flatisfy.constants import TimeToModes
+from flatisfy.filters.cache import GeocodingCache, TravelTimeCache
 from flatisfy.models.postal_code import PostalCode
 from flatisfy.models.public_transport import PublicTransport
 
 
 LOGGER = logging.getLogger(__name__)
 
+# Default maximum distance in meters between the postal codes of the
+# constraint and the postal code found for a flat.
+POSTAL_CODE_DISTANCE_THRESHOLD = 20000
+
 
 def init(flats_list, constraint):
     """
@@ -88,47 +96,63 @@ def fuzzy_match(query, choices, limit=3, threshold=75):
         [('denfert rochereau', 100), ('saint-jacques', 76)]
     """
     # TODO: Is there a better confidence measure?
-    normalized_query = tools.normalize_string(query).replace("saint", "st")
-    normalized_choices = [tools.normalize_string(choice).replace("saint", "st") for choice in choices]
-
-    # Remove duplicates in the choices list
-    unique_normalized_choices = tools.uniqify(normalized_choices)
-
-    # Get the matches (normalized strings)
-    # Keep only ``limit`` matches.
-    matches = sorted(
-        [(choice, len(choice)) for choice in tools.uniqify(unique_normalized_choices) if choice in normalized_query],
-        key=lambda x: x[1],
-        reverse=True,
-    )
-    if limit:
-        matches = matches[:limit]
+    return tools.FuzzyMatcher(choices).match(query, limit=limit, threshold=threshold)
 
-    # Update confidence
-    if matches:
-        max_confidence = max(match[1] for match in matches)
-        matches = [(x[0], int(x[1] / max_confidence * 100)) for x in matches]
 
-    # Convert back matches to original strings
-    # Also filter out matches below threshold
-    matches = [(choices[normalized_choices.index(x[0])], x[1]) for x in matches if x[1] >= threshold]
+def get_postal_code_position(postal_codes, postal_code):
+    """
+    Get the position of a postal code, that is the position of its first city.
 
-    return matches
+    :param postal_codes: The ``data.OpendataTable`` of the postal codes.
+    :param postal_code: The postal code to look for.
+    :return: A tuple of (latitude, longitude), or ``None`` if the postal code
+        is unknown.
+    """
+    rows = postal_codes.lookup("postal_code", postal_code)
+    if not rows:
+        return None
+    return postal_codes.get_position(rows[0])
 
 
-def guess_location_position(location, cities, constraint, must_match):
+def guess_location_position(location, postal_codes, matcher, constraint, postal_code=None):
+    """
+    Try to find the city matching a location.
+
+    :param location: The location string of a flat.
+    :param postal_codes: The ``data.OpendataTable`` of the postal codes.
+    :param matcher: A ``tools.FuzzyMatcher`` built from the rows of
+        ``postal_codes`` to consider.
+    :param constraint: The constraint that the flat should satisfy.
+    :param postal_code: An optional postal code already found in the
+        location. Only cities with this postal code are considered then, and
+        the first one is used if none matches the location.
+    :return: A tuple of postal code, INSEE code and position.
+    """
+
+    expected_postal_code = postal_code
+
+    def cities_filter(row):
+        """
+        Only consider cities with the expected postal code, if any.
+        """
+        return (
+            expected_postal_code is None
+            or postal_codes.columns["postal_code"][row] == expected_postal_code
+        )
+
     # try to find a city
     # Find all fuzzy-matching cities
-    postal_code = None
     insee_code = None
     position = None
 
-    matched_cities = fuzzy_match(location, [x.name for x in cities], limit=None)
+    matched_cities = matcher.match(location, limit=None, choices_filter=cities_filter)
     if matched_cities:
         # Find associated postal codes
         matched_postal_codes = []
         for matched_city_name, _ in matched_cities:
-            postal_code_objects_for_city = [x for x in cities if x.name == matched_city_name]
+            postal_code_objects_for_city = [
+                postal_codes[x] for x in matcher.get_choices(matched_city_name, cities_filter)
+            ]
             insee_code = [pc.insee_code for pc in postal_code_objects_for_city][0]
             matched_postal_codes.extend(pc.postal_code for pc in postal_code_objects_for_city)
         # Try to match them with postal codes in config constraint
@@ -146,7 +170,9 @@ def guess_location_position(location, cities, constraint, must_match):
         # take the city position
         for matched_city_name, _ in matched_cities:
             postal_code_objects_for_city = [
-                x for x in cities if x.name == matched_city_name and x.postal_code == postal_code
+                postal_codes[x]
+                for x in matcher.get_choices(matched_city_name)
+                if postal_codes.columns["postal_code"][x] == postal_code
             ]
             if len(postal_code_objects_for_city):
                 position = {
@@ -155,19 +181,107 @@ def guess_location_position(location, cities, constraint, must_match):
                 }
                 LOGGER.debug(("Found position %s using city %s."), position, matched_city_name)
                 break
-
-    if not postal_code and must_match:
-        postal_code = cities[0].postal_code
+    elif postal_code:
+        city = postal_codes[postal_codes.lookup("postal_code", postal_code)[0]]
         position = {
-            "lat": cities[0].lat,
-            "lng": cities[0].lng,
+            "lat": city.lat,
+            "lng": city.lng,
         }
-        insee_code = cities[0].insee_code
+        insee_code = city.insee_code
+    else:
+        postal_code = None
+
+    return (postal_code, insee_code, position)
+
+
+def _guess_postal_code(
+    location,
+    postal_codes,
+    cities_matcher,
+    constraint_postal_codes_index,
+    constraint,
+    config,
+    flat_id,
+    distance_threshold,
+):
+    """
+    Guess the postal code, INSEE code and position of a location. See
+    ``guess_postal_code``.
+
+    :return: A tuple of postal code, INSEE code and position.
+    """
+    postal_code = None
+    insee_code = None
+    position = None
+
+    # Try to find a postal code directly
+    try:
+        postal_code = re.search(r"[0-9]{5}", location)
+        assert postal_code is not None
+        postal_code = postal_code.group(0)
+
+        # Check the postal code is within the db
+        assert postal_codes.lookup("postal_code", postal_code)
+
+        LOGGER.debug(
+            "Found postal code directly in location field for flat %s: %s.",
+            flat_id,
+            postal_code,
+        )
+    except AssertionError:
+        postal_code = None
+
+    # Then fetch position (and postal_code is couldn't be found earlier)
+    (postal_code, insee_code, position) = guess_location_position(
+        location, postal_codes, cities_matcher, constraint, postal_code
+    )
+
+    # Check that postal code is not too far from the ones listed in config,
+    # limit bad fuzzy matching
+    if postal_code and distance_threshold:
+        postal_code_position = get_postal_code_position(postal_codes, postal_code)
+        nearest = []
+        if postal_code_position:
+            nearest = constraint_postal_codes_index.query_nearest(postal_code_position)
+        # Nothing to compare to if the positions of the postal codes of the
+        # constraint are unknown
+        distance = nearest[0][1] if nearest else 0
+
+        if distance > distance_threshold:
+            LOGGER.info(
+                (
+                    "Postal code %s found for flat %s @ %s is off-constraints "
+                    "(distance is %dm > %dm). Let's consider it is an "
+                    "artifact match and keep the post without this postal "
+                    "code."
+                ),
+                postal_code,
+                flat_id,
+                location,
+                int(distance),
+                int(distance_threshold),
+            )
+            postal_code = None
+            position = None
+
+    # Refine the position at the street level, if addresses are available
+    if postal_code and config["addresses_file"]:
+        address_position = data.load_addresses(postal_code, config).geocode(location)
+        if address_position:
+            (lat, lng), precision = address_position
+            position = {"lat": lat, "lng": lng, "precision": precision}
+            LOGGER.debug("Found position %s using addresses for flat %s.", position, flat_id)
 
     return (postal_code, insee_code, position)
 
 
-def guess_postal_code(flats_list, constraint, config, distance_threshold=20000):
+def guess_postal_code(
+    flats_list,
+    constraint,
+    config,
+    distance_threshold=POSTAL_CODE_DISTANCE_THRESHOLD,
+    geocoding_cache=None,
+):
     """
     Try to guess the postal code from the location of the flats.
 
@@ -178,10 +292,30 @@ def guess_postal_code(flats_list, constraint, config, distance_threshold=20000):
         constraint postal codes (from config) and the one found by this
         function, to avoid bad fuzzy matching. Can be ``None`` to disable
         thresholding.
+    :param geocoding_cache: The ``GeocodingCache`` to look locations up in. A
+        new one is created and saved afterwards if not provided.
 
     :return: An updated list of flats dict with guessed postal code.
     """
-    opendata = {"postal_codes": data.load_data(PostalCode, constraint, config)}
+    save_cache = geocoding_cache is None
+    if save_cache:
+        geocoding_cache = GeocodingCache(config)
+
+    @functools.lru_cache(maxsize=None)
+    def load_opendata():
+        """
+        Load the opendata, only once a location is not found in cache.
+        """
+        postal_codes = data.load_data(PostalCode, constraint, config)
+        cities_matcher = data.load_matcher(PostalCode, constraint, config)
+        # Index the postal codes of the constraint, to find the closest one
+        constraint_postal_codes_positions = [
+            get_postal_code_position(postal_codes, x) for x in constraint["postal_codes"]
+        ]
+        constraint_postal_codes_index = geo.SpatialIndex(
+            [x for x in constraint_postal_codes_positions if x]
+        )
+        return postal_codes, cities_matcher, constraint_postal_codes_index
 
     for flat in flats_list:
         location = flat.get("location", None)
@@ -198,63 +332,18 @@ def guess_postal_code(flats_list, constraint, config, distance_threshold=20000):
             )
             continue
 
-        postal_code = None
-        insee_code = None
-        position = None
-
-        # Try to find a postal code directly
-        try:
-            postal_code = re.search(r"[0-9]{5}", location)
-            assert postal_code is not None
-            postal_code = postal_code.group(0)
-
-            # Check the postal code is within the db
-            assert postal_code in [x.postal_code for x in opendata["postal_codes"]]
-
-            LOGGER.debug(
-                "Found postal code directly in location field for flat %s: %s.",
-                flat["id"],
-                postal_code,
-            )
-        except AssertionError:
-            postal_code = None
-
-        # Then fetch position (and postal_code is couldn't be found earlier)
-        cities = opendata["postal_codes"]
-        if postal_code:
-            cities = [x for x in cities if x.postal_code == postal_code]
-        (postal_code, insee_code, position) = guess_location_position(
-            location, cities, constraint, postal_code is not None
+        (postal_code, insee_code, position) = geocoding_cache.get(
+            (
+                "postal_code",
+                GeocodingCache.normalize(location),
+                sorted(constraint["postal_codes"]),
+                distance_threshold,
+            ),
+            lambda: _guess_postal_code(
+                location, *load_opendata(), constraint, config, flat["id"], distance_threshold
+            ),
         )
 
-        # Check that postal code is not too far from the ones listed in config,
-        # limit bad fuzzy matching
-        if postal_code and distance_threshold:
-            distance = min(
-                tools.distance(
-                    next((x.lat, x.lng) for x in opendata["postal_codes"] if x.postal_code == postal_code),
-                    next((x.lat, x.lng) for x in opendata["postal_codes"] if x.postal_code == constraint_postal_code),
-                )
-                for constraint_postal_code in constraint["postal_codes"]
-            )
-
-            if distance > distance_threshold:
-                LOGGER.info(
-                    (
-                        "Postal code %s found for flat %s @ %s is off-constraints "
-                        "(distance is %dm > %dm). Let's consider it is an "
-                        "artifact match and keep the post without this postal "
-                        "code."
-                    ),
-                    postal_code,
-                    flat["id"],
-                    location,
-                    int(distance),
-                    int(distance_threshold),
-                )
-                postal_code = None
-                position = None
-
         # Store it
         if postal_code:
             existing_postal_code = flat["flatisfy"].get("postal_code", None)
@@ -283,24 +372,118 @@ def guess_postal_code(flats_list, constraint, config, distance_threshold=20000):
             location,
         )
 
+    if save_cache:
+        geocoding_cache.save()
     return flats_list
 
 
-def guess_stations(flats_list, constraint, config):
+def _guess_stations(
+    flat_station,
+    postal_code,
+    position,
+    postal_codes,
+    stations,
+    stations_matcher,
+    flat_id,
+    distance_threshold,
+):
+    """
+    Guess the stations close to a flat from its station field. See
+    ``guess_stations``.
+
+    :return: A list of the matched stations dicts.
+    """
+    # Woob modules can return several stations in a comma-separated list.
+    flat_stations = flat_station.split(",")
+    # But some stations containing a comma exist, so let's add the initial
+    # value to the list of stations to check if there was one.
+    if len(flat_stations) > 1:
+        flat_stations.append(flat_station)
+
+    matched_stations = []
+    for tentative_station in flat_stations:
+        matched_stations += stations_matcher.match(tentative_station, limit=10, threshold=50)
+
+    # Keep only one occurrence of each station
+    matched_stations = list(set(matched_stations))
+
+    # Filter out the stations that are obviously too far and not well
+    # guessed
+    good_matched_stations = []
+    if postal_code:
+        # If there is a postal code, check that the matched station is
+        # closed to it, or to the flat if its position is known at the
+        # street level
+        postal_code_gps = position or get_postal_code_position(postal_codes, postal_code)
+        for station in matched_stations:
+            # Note that multiple stations with the same name exist in a
+            # city, hence the list of stations objects for a given matching
+            # station name.
+            stations_objects = [stations[x] for x in stations_matcher.get_choices(station[0])]
+            stations_distances = geo.distances(
+                postal_code_gps, [(x.lat, x.lng) for x in stations_objects]
+            )
+            for station_data, distance in zip(stations_objects, stations_distances.tolist()):
+                if distance < distance_threshold:
+                    # If at least one of the coordinates for a given
+                    # station is close enough, that's ok and we can add
+                    # the station
+                    good_matched_stations.append(
+                        {
+                            "key": station[0],
+                            "name": station_data.name,
+                            "confidence": station[1],
+                            "gps": (station_data.lat, station_data.lng),
+                        }
+                    )
+                    break
+                LOGGER.info(
+                    ("Station %s is too far from flat %s (%dm > %dm), discarding this station."),
+                    station[0],
+                    flat_id,
+                    int(distance),
+                    int(distance_threshold),
+                )
+    else:
+        LOGGER.info("No postal code for flat %s, skipping stations detection.", flat_id)
+
+    return good_matched_stations
+
+
+def guess_stations(flats_list, constraint, config, geocoding_cache=None):
     """
     Try to match the station field with a list of available stations nearby.
 
     :param flats_list: A list of flats dict.
     :param constraint: The constraint that the ``flats_list`` should satisfy.
     :param config: A config dict.
+    :param geocoding_cache: The ``GeocodingCache`` to look stations up in. A
+        new one is created and saved afterwards if not provided.
 
     :return: An updated list of flats dict with guessed nearby stations.
     """
+    save_cache = geocoding_cache is None
+    if save_cache:
+        geocoding_cache = GeocodingCache(config)
+
     distance_threshold = config["max_distance_housing_station"]
-    opendata = {
-        "postal_codes": data.load_data(PostalCode, constraint, config),
-        "stations": data.load_data(PublicTransport, constraint, config),
-    }
+
+    @functools.lru_cache(maxsize=None)
+    def load_opendata():
+        """
+        Load the opendata, only once a station is not found in cache.
+        """
+        postal_codes = data.load_data(PostalCode, constraint, config)
+        stations = data.load_data(PublicTransport, constraint, config)
+        # Only consider the stations which can be close enough to a flat
+        # matching the constraint
+        stations_matcher = data.load_matcher(
+            PublicTransport,
+            constraint,
+            config,
+            clip_radius=POSTAL_CODE_DISTANCE_THRESHOLD + distance_threshold,
+        )
+        return postal_codes, stations, stations_matcher
 
     for flat in flats_list:
         flat_station = flat.get("station", None)
@@ -310,62 +493,30 @@ def guess_stations(flats_list, constraint, config):
             LOGGER.info("No stations field for flat %s, skipping stations lookup.", flat["id"])
             continue
 
-        # Woob modules can return several stations in a comma-separated list.
-        flat_stations = flat_station.split(",")
-        # But some stations containing a comma exist, so let's add the initial
-        # value to the list of stations to check if there was one.
-        if len(flat_stations) > 1:
-            flat_stations.append(flat_station)
-
-        matched_stations = []
-        for tentative_station in flat_stations:
-            matched_stations += fuzzy_match(
-                tentative_station,
-                [x.name for x in opendata["stations"]],
-                limit=10,
-                threshold=50,
-            )
-
-        # Keep only one occurrence of each station
-        matched_stations = list(set(matched_stations))
-
-        # Filter out the stations that are obviously too far and not well
-        # guessed
-        good_matched_stations = []
         postal_code = flat["flatisfy"].get("postal_code", None)
-        if postal_code:
-            # If there is a postal code, check that the matched station is
-            # closed to it
-            postal_code_gps = next((x.lat, x.lng) for x in opendata["postal_codes"] if x.postal_code == postal_code)
-            for station in matched_stations:
-                # Note that multiple stations with the same name exist in a
-                # city, hence the list of stations objects for a given matching
-                # station name.
-                stations_objects = [x for x in opendata["stations"] if x.name == station[0]]
-                for station_data in stations_objects:
-                    distance = tools.distance((station_data.lat, station_data.lng), postal_code_gps)
-                    if distance < distance_threshold:
-                        # If at least one of the coordinates for a given
-                        # station is close enough, that's ok and we can add
-                        # the station
-                        good_matched_stations.append(
-                            {
-                                "key": station[0],
-                                "name": station_data.name,
-                                "confidence": station[1],
-                                "gps": (station_data.lat, station_data.lng),
-                            }
-                        )
-                        break
-                    LOGGER.info(
-                        ("Station %s is too far from flat %s (%dm > %dm), discarding this station."),
-                        station[0],
-                        flat["id"],
-                        int(distance),
-                        int(distance_threshold),
-                    )
+        position = flat["flatisfy"].get("position", None)
+        if position and "precision" in position:
+            position = (position["lat"], position["lng"])
         else:
-            LOGGER.info("No postal code for flat %s, skipping stations detection.", flat["id"])
+            position = None
+        good_matched_stations = geocoding_cache.get(
+            (
+                "stations",
+                GeocodingCache.normalize(flat_station),
+                postal_code,
+                position,
+                sorted(constraint["postal_codes"]),
+                distance_threshold,
+            ),
+            lambda: _guess_stations(
+                flat_station,
+                postal_code,
+                position,
+                *load_opendata(),
+                flat["id"],
+                distance_threshold
+            ),
+        )
 
         if not good_matched_stations:
             # No stations found, log it and cotninue with next housing
@@ -398,10 +549,12 @@ def guess_stations(flats_list, constraint, config):
 
         flat["flatisfy"]["matched_stations"] = good_matched_stations
 
+    if save_cache:
+        geocoding_cache.save()
     return flats_list
 
 
-def compute_travel_times(flats_list, constraint, config):
+def compute_travel_times(flats_list, constraint, config, travel_time_cache=None):
     """
     Compute the travel time between each flat and the points listed in the
     constraints.
@@ -409,11 +562,18 @@ def compute_travel_times(flats_list, constraint, config):
     :param flats_list: A list of flats dict.
     :param constraint: The constraint that the ``flats_list`` should satisfy.
     :param config: A config dict.
+    :param travel_time_cache: The ``TravelTimeCache`` to look travel times up
+        in. A new one is created and saved afterwards if not provided.
 
     :return: An updated list of flats dict with computed travel times.
 
     .. note :: Requires a Navitia or CityMapper API key in the config.
     """
+    save_cache = travel_time_cache is None
+    if save_cache:
+        travel_time_cache = TravelTimeCache(config)
+
+    flats_with_stations = []
     for flat in flats_list:
         if not flat["flatisfy"].get("matched_stations", []):
             # Skip any flat without matched stations
@@ -426,24 +586,106 @@ def compute_travel_times(flats_list, constraint, config):
         if "time_to" not in flat["flatisfy"]:
             # Ensure time_to key is initialized
             flat["flatisfy"]["time_to"] = {}
+        flats_with_stations.append(flat)
 
-        # For each place, loop over the stations close to the flat, and find
-        # the minimum travel time.
-        for place_name, place in constraint["time_to"].items():
-            mode = place.get("mode", "PUBLIC_TRANSPORT")
-            time_to_place_dict = None
+    for place_name, place in constraint["time_to"].items():
+        mode = place.get("mode", "PUBLIC_TRANSPORT")
+        place_gps = tuple(place["gps"])
+        max_time = place["time"][1] if place.get("time") else None
+
+        # Compute lower bounds of the travel times from all the stations,
+        # without querying any API
+        stations_gps = collections.OrderedDict()
+        for flat in flats_with_stations:
             for station in flat["flatisfy"]["matched_stations"]:
-                # Time from station is a dict with time and route
-                time_from_station_dict = tools.get_travel_time_between(
-                    station["gps"], place["gps"], TimeToModes[mode], config
+                stations_gps[tuple(station["gps"])] = True
+        stations_gps = list(stations_gps.keys())
+        lower_bounds = dict(
+            zip(
+                stations_gps,
+                tools.get_travel_times_lower_bounds(stations_gps, place_gps, TimeToModes[mode]),
+            )
+        )
+
+        # Stations are shared by many flats, fetch at once the travel times
+        # from all the stations which are not already cached, and which can
+        # be close enough to the place.
+        stations_gps = [
+            x
+            for x in stations_gps
+            if travel_time_cache.get_cached((x, place_gps, TimeToModes[mode])) is None
+        ]
+        if max_time is not None:
+            travel_time_cache.pruned += sum(1 for x in stations_gps if lower_bounds[x] > max_time)
+            stations_gps = [x for x in stations_gps if lower_bounds[x] <= max_time]
+        stations_times = dict(
+            zip(
+                stations_gps,
+                tools.get_travel_times_to(stations_gps, place_gps, TimeToModes[mode], config),
+            )
+        )
+        # Cache the travel times fetched at once, so that they are not looked
+        # for again one route at a time. Batched lookups have no sections.
+        for station_gps, time_from_station in stations_times.items():
+            if time_from_station is not None:
+                travel_time_cache.put(
+                    (station_gps, place_gps, TimeToModes[mode]),
+                    {"time": time_from_station, "sections": []},
                 )
-                if time_from_station_dict and (
-                    time_from_station_dict["time"] < time_to_place_dict or time_to_place_dict is None
+
+        # For each flat, loop over the stations close to the flat, and find
+        # the one with the minimum travel time.
+        for flat in flats_with_stations:
+            best_station_gps = None
+            best_time = None
+            for station in flat["flatisfy"]["matched_stations"]:
+                key = (tuple(station["gps"]), place_gps, TimeToModes[mode])
+                if (max_time is not None and lower_bounds[key[0]] > max_time) or (
+                    best_time is not None and lower_bounds[key[0]] >= best_time
+                ):
+                    # Starting from this station cannot match the constraint,
+                    # or cannot be better than the best station so far
+                    continue
+
+                # Travel times which could not be fetched at once are looked
+                # for one route at a time
+                time_from_station = None
+                time_from_station_dict = travel_time_cache.get(key)
+                if time_from_station_dict:
+                    time_from_station = time_from_station_dict["time"]
+                if time_from_station is not None and (
+                    best_time is None or time_from_station < best_time
                 ):
                     # If starting from this station makes the route to the
                     # specified place shorter, update
-                    time_to_place_dict = time_from_station_dict
+                    best_station_gps = key[0]
+                    best_time = time_from_station
 
+            if best_station_gps is None:
+                lower_bound = min(
+                    lower_bounds[tuple(x["gps"])] for x in flat["flatisfy"]["matched_stations"]
+                )
+                if max_time is not None and lower_bound > max_time:
+                    # Even the lower bound of the travel time is too long,
+                    # store it so that the flat is rejected without any query,
+                    # flagged as it is not the time of an actual journey
+                    LOGGER.info(
+                        "Travel time between %s and flat %s by %s is at least %ds.",
+                        place_name,
+                        flat["id"],
+                        mode,
+                        lower_bound,
+                    )
+                    flat["flatisfy"]["time_to"][place_name] = {
+                        "time": lower_bound,
+                        "sections": [],
+                        "estimate": True,
+                    }
+                continue
+            # Time from station is a dict with time and route
+            time_to_place_dict = travel_time_cache.get(
+                (best_station_gps, place_gps, TimeToModes[mode])
+            )
             if time_to_place_dict:
                 LOGGER.info(
                     "Travel time between %s and flat %s by %s is %ds.",
@@ -453,4 +695,7 @@ def compute_travel_times(flats_list, constraint, config):
                     time_to_place_dict["time"],
                 )
                 flat["flatisfy"]["time_to"][place_name] = time_to_place_dict
+
+    if save_cache:
+        travel_time_cache.save()
     return flats_list
@@ -0,0 +1,173 @@
+# coding: utf-8
+"""
+This module contains geometry helpers, to compute distances between GPS
+positions and to look for the items close to a position.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import math
+
+import numpy
+import scipy.spatial
+
+
+def distance(gps1, gps2):
+    """
+    Compute the distance between two tuples of latitude and longitude.
+
+    :param gps1: First tuple of (latitude, longitude).
+    :param gps2: Second tuple of (latitude, longitude).
+    :return: The distance in meters.
+
+    :Example:
+
+        >>> int(distance([48.86786647303717, 2.19368117495212], \
+                         [48.95314107920405, 2.3368043817358464]))
+        14117
+    """
+    lat1 = math.radians(gps1[0])
+    long1 = math.radians(gps1[1])
+
+    lat2 = math.radians(gps2[0])
+    long2 = math.radians(gps2[1])
+
+    # pylint: disable=locally-disabled,invalid-name
+    a = (
+        math.sin((lat2 - lat1) / 2.0) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((long2 - long1) / 2.0) ** 2
+    )
+    c = 2.0 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    earth_radius = 6371000
+
+    return earth_radius * c
+
+
+def _haversine(lat1, long1, lat2, long2):
+    """
+    Vectorized version of the haversine formula used in ``distance``, taking
+    NumPy arrays of angles in radians.
+    """
+    # pylint: disable=locally-disabled,invalid-name
+    a = (
+        numpy.sin((lat2 - lat1) / 2.0) ** 2
+        + numpy.cos(lat1) * numpy.cos(lat2) * numpy.sin((long2 - long1) / 2.0) ** 2
+    )
+    c = 2.0 * numpy.arctan2(numpy.sqrt(a), numpy.sqrt(1 - a))
+    earth_radius = 6371000
+
+    return earth_radius * c
+
+
+def distances(gps, gps_list):
+    """
+    Compute the distances between a tuple of latitude and longitude and a
+    list of such tuples, at once.
+
+    :param gps: A tuple of (latitude, longitude).
+    :param gps_list: A list of tuples of (latitude, longitude).
+    :return: A NumPy array of the distances in meters, in the order of
+        ``gps_list``.
+
+    :Example:
+
+        >>> [int(x) for x in distances([48.86786647303717, 2.19368117495212], \
+                                       [[48.95314107920405, 2.3368043817358464]])]
+        [14117]
+    """
+    lat1, long1 = numpy.radians(numpy.asarray(gps, dtype=float))
+    positions = numpy.radians(numpy.asarray(gps_list, dtype=float).reshape(-1, 2))
+    return _haversine(lat1, long1, positions[:, 0], positions[:, 1])
+
+
+def pairwise_distances(gps_list1, gps_list2):
+    """
+    Compute the distances between every tuple of latitude and longitude of a
+    list and every tuple of another list, at once.
+
+    :param gps_list1: A list of tuples of (latitude, longitude).
+    :param gps_list2: A list of tuples of (latitude, longitude).
+    :return: A NumPy array of shape ``(len(gps_list1), len(gps_list2))``
+        holding the distances in meters.
+    """
+    positions1 = numpy.radians(numpy.asarray(gps_list1, dtype=float).reshape(-1, 2))
+    positions2 = numpy.radians(numpy.asarray(gps_list2, dtype=float).reshape(-1, 2))
+    return _haversine(
+        positions1[:, 0, numpy.newaxis],
+        positions1[:, 1, numpy.newaxis],
+        positions2[numpy.newaxis, :, 0],
+        positions2[numpy.newaxis, :, 1],
+    )
+
+
+class SpatialIndex(object):
+    """
+    A spatial index over a list of items with a GPS position, to perform
+    radius and nearest neighbours queries in logarithmic time.
+
+    Positions are projected on the unit sphere and stored in a KD-tree. The
+    euclidean (chord) distance between two projected points is a monotonic
+    function of their great-circle distance, which is used to filter results.
+    """
+
+    EARTH_RADIUS = 6371000
+
+    @staticmethod
+    def _to_cartesian(positions):
+        """
+        Project a list of (latitude, longitude) tuples on the unit sphere.
+        """
+        positions = numpy.radians(numpy.asarray(positions, dtype=float).reshape(-1, 2))
+        lat, lng = positions[:, 0], positions[:, 1]
+        return numpy.column_stack(
+            (numpy.cos(lat) * numpy.cos(lng), numpy.cos(lat) * numpy.sin(lng), numpy.sin(lat))
+        )
+
+    def __init__(self, items, key=None):
+        """
+        :param items: The list of items to index.
+        :param key: A function returning the (latitude, longitude) tuple of
+            each item. Defaults to the item itself, for a list of tuples.
+        """
+        self.items = list(items)
+        self.positions = [key(item) if key else item for item in self.items]
+        self.tree = scipy.spatial.cKDTree(self._to_cartesian(self.positions))
+
+    def query_radius(self, gps, radius):
+        """
+        Find all the items within a given distance of a point.
+
+        :param gps: A tuple of (latitude, longitude).
+        :param radius: The maximum distance, in meters.
+        :return: A list of tuples of items and their distance to ``gps``, in
+            meters, in the initial order of the items.
+        """
+        # Chord length matching the radius, with some margin for rounding
+        # errors, exact distances are checked afterwards
+        chord = 2 * math.sin(min(radius / self.EARTH_RADIUS, math.pi) / 2) * 1.0001
+        indices = sorted(self.tree.query_ball_point(self._to_cartesian(gps)[0], chord))
+        items_distances = distances(gps, [self.positions[index] for index in indices])
+        return [
+            (self.items[index], item_distance)
+            for index, item_distance in zip(indices, items_distances.tolist())
+            if item_distance <= radius
+        ]
+
+    def query_nearest(self, gps, k=1):
+        """
+        Find the nearest items to a point.
+
+        :param gps: A tuple of (latitude, longitude).
+        :param k: The number of items to return.
+        :return: A list of at most ``k`` tuples of items and their distance to
+            ``gps``, in meters, sorted by increasing distance.
+        """
+        k = min(k, len(self.items))
+        if not k:
+            return []
+        _, indices = self.tree.query(self._to_cartesian(gps)[0], k=k)
+        indices = numpy.atleast_1d(indices).tolist()
+        items_distances = distances(gps, [self.positions[index] for index in indices])
+        return [
+            (self.items[index], item_distance)
+            for index, item_distance in zip(indices, items_distances.tolist())
+        ]
@@ -0,0 +1,704 @@
+# coding: utf-8
+"""
+This module contains an offline public transport router, computing travel
+times from a GTFS feed with the RAPTOR algorithm, as an alternative to the
+Navitia API.
+
+The GTFS feed is converted at ``build-data`` time into a compact timetable,
+stored in the data directory, which is then loaded once per process.
+"""
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import bisect
+import collections
+import csv
+import hashlib
+import io
+import logging
+import os
+import pickle
+import threading
+import zipfile
+
+import numpy
+
+from flatisfy import geo
+from flatisfy.constants import PUBLIC_TRANSPORT_DEPARTURE
+
+LOGGER = logging.getLogger(__name__)
+
+# Name of the timetable file in the data directory
+TIMETABLE_FILENAME = "gtfs_timetable.pickle"
+# Walking speed used for access, egress and transfers, in meters per second
+WALKING_SPEED = 1.25
+# Maximum walking distance between two stops for a transfer, in meters
+TRANSFER_MAX_DISTANCE = 400
+# Maximum walking distance from the starting point or to the destination to a
+# stop, in meters
+ACCESS_MAX_DISTANCE = 800
+# Maximum number of trips in a journey
+MAX_ROUNDS = 6
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+
+def _has_feed_file(feed_path, filename):
+    """
+    Check whether a GTFS feed contains a given file.
+
+    :param feed_path: Path to the GTFS feed, either a zip file or a directory.
+    :param filename: Name of the file in the feed.
+    :return: ``True`` if the file is in the feed.
+    """
+    if zipfile.is_zipfile(feed_path):
+        with zipfile.ZipFile(feed_path) as feed:
+            return filename in feed.namelist()
+    return os.path.isfile(os.path.join(feed_path, filename))
+
+
+def _read_feed_file(feed_path, filename):
+    """
+    Read a file from a GTFS feed, without loading it entirely in memory.
+
+    :param feed_path: Path to the GTFS feed, either a zip file or a directory.
+    :param filename: Name of the file to read in the feed.
+    :return: A generator of dicts, one per row.
+    """
+    if zipfile.is_zipfile(feed_path):
+        with zipfile.ZipFile(feed_path) as feed:
+            with feed.open(filename) as fh:
+                for row in csv.DictReader(io.TextIOWrapper(fh, encoding="utf-8-sig")):
+                    yield row
+    else:
+        with io.open(os.path.join(feed_path, filename), "r", encoding="utf-8-sig") as fh:
+            for row in csv.DictReader(fh):
+                yield row
+
+
+def _parse_time(value):
+    """
+    Parse a GTFS time, which can be over 24:00:00 for trips running past
+    midnight.
+
+    :param value: A time as ``HH:MM:SS``.
+    :return: The number of seconds since midnight.
+    """
+    hours, minutes, seconds = value.strip().split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+class Timetable(object):
+    """
+    A compact timetable built from a GTFS feed, for the trips running on the
+    day public transport routes are looked for.
+
+    Trips are grouped in patterns, sharing the same route and sequence of
+    stops, as the RAPTOR algorithm expects.
+    """
+
+    def __init__(self, feed_path, weekday=None):
+        """
+        :param feed_path: Path to the GTFS feed, either a zip file or a
+            directory.
+        :param weekday: Only keep the trips running on this weekday (0 for
+            Monday), according to ``calendar.txt``. Defaults to the weekday of
+            ``constants.PUBLIC_TRANSPORT_DEPARTURE``.
+        """
+        if weekday is None:
+            weekday = PUBLIC_TRANSPORT_DEPARTURE["weekday"]
+
+        # Stops
+        stops_index = {}
+        self.stops_names = []
+        positions = []
+        for row in _read_feed_file(feed_path, "stops.txt"):
+            if row.get("location_type", "") not in ("", "0"):
+                # Skip stations and entrances, only stop points have trips
+                continue
+            stops_index[row["stop_id"]] = len(self.stops_names)
+            self.stops_names.append(row["stop_name"])
+            positions.append((float(row["stop_lat"]), float(row["stop_lon"])))
+        self.stops_positions = numpy.array(positions, dtype=float).reshape(-1, 2)
+
+        # Services running on the weekday. Keep everything if there is no
+        # calendar.
+        services = None
+        if _has_feed_file(feed_path, "calendar.txt"):
+            services = {
+                row["service_id"]
+                for row in _read_feed_file(feed_path, "calendar.txt")
+                if row[WEEKDAYS[weekday]] == "1"
+            }
+
+        # Routes and trips
+        routes = {}
+        for row in _read_feed_file(feed_path, "routes.txt"):
+            routes[row["route_id"]] = (
+                row.get("route_short_name") or row.get("route_long_name", ""),
+                row.get("route_color") or None,
+            )
+        trips_routes = {}
+        for row in _read_feed_file(feed_path, "trips.txt"):
+            if services is None or row["service_id"] in services:
+                trips_routes[row["trip_id"]] = row["route_id"]
+
+        # Stop times of the trips
+        trips_stop_times = collections.defaultdict(list)
+        for row in _read_feed_file(feed_path, "stop_times.txt"):
+            if row["trip_id"] not in trips_routes or row["stop_id"] not in stops_index:
+                continue
+            arrival = _parse_time(row["arrival_time"] or row["departure_time"])
+            departure = _parse_time(row["departure_time"] or row["arrival_time"])
+            trips_stop_times[row["trip_id"]].append(
+                (int(row["stop_sequence"]), stops_index[row["stop_id"]], arrival, departure)
+            )
+
+        # Group trips by pattern
+        patterns = collections.defaultdict(list)
+        for trip_id, stop_times in trips_stop_times.items():
+            if len(stop_times) < 2:
+                continue
+            stop_times.sort()
+            stops = tuple(x[1] for x in stop_times)
+            patterns[(trips_routes[trip_id], stops)].append(stop_times)
+
+        # For each pattern, the stops, the route and the arrival and departure
+        # times of the trips (sorted by departure time), as arrays of shape
+        # (number of stops, number of trips)
+        self.patterns_stops = []
+        self.patterns_routes = []
+        self.patterns_arrivals = []
+        self.patterns_departures = []
+        for (route_id, stops), trips in patterns.items():
+            trips.sort(key=lambda x: x[0][3])
+            self.patterns_stops.append(list(stops))
+            self.patterns_routes.append(routes.get(route_id, ("", None)))
+            self.patterns_arrivals.append(
+                numpy.ascontiguousarray(
+                    numpy.array([[x[2] for x in trip] for trip in trips], dtype=numpy.int32).T
+                )
+            )
+            self.patterns_departures.append(
+                numpy.ascontiguousarray(
+                    numpy.array([[x[3] for x in trip] for trip in trips], dtype=numpy.int32).T
+                )
+            )
+
+        # Patterns serving each stop, with the position of the stop
+        self.stops_patterns = [[] for _ in self.stops_names]
+        for pattern, stops in enumerate(self.patterns_stops):
+            for position, stop in enumerate(stops):
+                self.stops_patterns[stop].append((pattern, position))
+
+        # Transfers between close stops, with the walking time
+        stops_spatial_index = geo.SpatialIndex(
+            range(len(self.stops_names)), key=lambda x: positions[x]
+        )
+        self.transfers = []
+        for stop, position in enumerate(positions):
+            self.transfers.append(
+                [
+                    (other_stop, int(distance / WALKING_SPEED))
+                    for other_stop, distance in stops_spatial_index.query_radius(
+                        position, TRANSFER_MAX_DISTANCE
+                    )
+                    if other_stop != stop
+                ]
+            )
+
+        LOGGER.info(
+            "Built GTFS timetable with %d stops, %d patterns and %d trips.",
+            len(self.stops_names),
+            len(self.patterns_stops),
+            sum(x.shape[1] for x in self.patterns_departures),
+        )
+
+
+class Router(object):
+    """
+    A public transport router over a ``Timetable``, using the RAPTOR
+    algorithm (Delling et al., Round-Based Public Transit Routing).
+    """
+
+    def __init__(self, timetable):
+        """
+        :param timetable: A ``Timetable``.
+        """
+        self.timetable = timetable
+        # Scanning the patterns is the hot loop of RAPTOR, which reads the
+        # times one at a time: plain lists are much faster than arrays there.
+        self.patterns_arrivals = [x.tolist() for x in timetable.patterns_arrivals]
+        self.patterns_departures = [x.tolist() for x in timetable.patterns_departures]
+        self.stops_index = geo.SpatialIndex(
+            range(len(timetable.stops_names)),
+            key=lambda x: tuple(timetable.stops_positions[x]),
+        )
+
+    def _walk_to_stops(self, latlng):
+        """
+        Find the stops within walking distance of a point.
+
+        :param latlng: A tuple of (latitude, longitude).
+        :return: A dict mapping stops to the walking time, in seconds.
+        """
+        return {
+            stop: int(distance / WALKING_SPEED)
+            for stop, distance in self.stops_index.query_radius(latlng, ACCESS_MAX_DISTANCE)
+        }
+
+    def _raptor(self, latlng_from, egress, departure):
+        """
+        Run the RAPTOR algorithm from a starting point.
+
+        :param latlng_from: A tuple of (latitude, longitude) for the starting
+            point.
+        :param egress: A dict mapping the stops close to the destination to
+            the walking time to the destination.
+        :param departure: The departure time, in seconds since midnight.
+        :return: A tuple of the arrival time at the destination, the last stop
+            (``None`` for a direct walk) and the dict of labels to rebuild the
+            journey.
+        """
+        timetable = self.timetable
+        infinity = float("inf")
+
+        # Earliest arrival time at each stop, and how it was reached
+        best = {}
+        labels = {}
+        for stop, walk_time in self._walk_to_stops(latlng_from).items():
+            best[stop] = departure + walk_time
+            labels[stop] = ("access", walk_time)
+        marked = set(best)
+
+        # Arrival at destination, walking all the way by default
+        target_arrival = infinity
+        target_stop = None
+        for stop in marked & set(egress):
+            if best[stop] + egress[stop] < target_arrival:
+                target_arrival = best[stop] + egress[stop]
+                target_stop = stop
+
+        for _ in range(MAX_ROUNDS):
+            if not marked:
+                break
+            # Earliest arrival times with one trip less, at the stops improved
+            # during the previous round. A trip can only be improved by
+            # boarding at one of these stops.
+            previous_best = {stop: best[stop] for stop in marked}
+
+            # Patterns to scan, from their first marked stop
+            queue = {}
+            for stop in marked:
+                for pattern, position in timetable.stops_patterns[stop]:
+                    if position < queue.get(pattern, infinity):
+                        queue[pattern] = position
+            marked = set()
+
+            for pattern, start in queue.items():
+                stops = timetable.patterns_stops[pattern]
+                arrivals = self.patterns_arrivals[pattern]
+                departures = self.patterns_departures[pattern]
+                trip = None
+                for position in range(start, len(stops)):
+                    stop = stops[position]
+                    if trip is not None:
+                        arrival = arrivals[position][trip]
+                        if arrival < best.get(stop, infinity) and arrival < target_arrival:
+                            best[stop] = arrival
+                            labels[stop] = ("trip", pattern, trip, board_position, position)
+                            marked.add(stop)
+                    # Check whether an earlier trip can be caught at this stop
+                    previous_arrival = previous_best.get(stop, None)
+                    if previous_arrival is not None and (
+                        trip is None or previous_arrival <= departures[position][trip]
+                    ):
+                        earliest_trip = bisect.bisect_left(departures[position], previous_arrival)
+                        if earliest_trip < len(departures[position]) and (
+                            trip is None or earliest_trip < trip
+                        ):
+                            trip = earliest_trip
+                            board_position = position
+
+            # Transfers from the stops reached in this round
+            for stop in list(marked):
+                for other_stop, walk_time in timetable.transfers[stop]:
+                    arrival = best[stop] + walk_time
+                    if arrival < best.get(other_stop, infinity) and arrival < target_arrival:
+                        best[other_stop] = arrival
+                        labels[other_stop] = ("transfer", stop, walk_time)
+                        marked.add(other_stop)
+
+            for stop in marked & set(egress):
+                if best[stop] + egress[stop] < target_arrival:
+                    target_arrival = best[stop] + egress[stop]
+                    target_stop = stop
+
+        return target_arrival, target_stop, labels
+
+    def _build_sections(self, latlng_from, latlng_to, target_stop, labels):
+        """
+        Rebuild the sections of a journey from the RAPTOR labels.
+
+        :return: A list of sections, with a GeoJSON path and a color, as
+            returned by ``tools.get_travel_time_between``.
+        """
+        timetable = self.timetable
+
+        def to_coordinates(latlng):
+            return [float(latlng[1]), float(latlng[0])]
+
+        def walk_section(latlng_start, latlng_end):
+            return {
+                "geojson": {
+                    "type": "LineString",
+                    "coordinates": [to_coordinates(latlng_start), to_coordinates(latlng_end)],
+                },
+                "color": None,
+            }
+
+        if target_stop is None:
+            return [walk_section(latlng_from, latlng_to)]
+
+        sections = [walk_section(timetable.stops_positions[target_stop], latlng_to)]
+        stop = target_stop
+        while labels[stop][0] != "access":
+            label = labels[stop]
+            if label[0] == "transfer":
+                sections.append(
+                    walk_section(
+                        timetable.stops_positions[label[1]], timetable.stops_positions[stop]
+                    )
+                )
+                stop = label[1]
+            else:
+                _, pattern, _, board_position, alight_position = label
+                stops = timetable.patterns_stops[pattern][board_position : alight_position + 1]
+                sections.append(
+                    {
+                        "geojson": {
+                            "type": "LineString",
+                            "coordinates": [
+                                to_coordinates(timetable.stops_positions[x]) for x in stops
+                            ],
+                        },
+                        "color": timetable.patterns_routes[pattern][1],
+                    }
+                )
+                stop = stops[0]
+        sections.append(walk_section(latlng_from, timetable.stops_positions[stop]))
+        return sections[::-1]
+
+    def _walking_time(self, latlng_from, latlng_to):
+        """
+        Get the walking time between two points, as the crow flies, if they
+        are close enough to walk all the way.
+
+        :return: The walking time in seconds, or ``None``.
+        """
+        distance = geo.distance(latlng_from, latlng_to)
+        if distance > 2 * ACCESS_MAX_DISTANCE:
+            return None
+        return int(distance / WALKING_SPEED)
+
+    def route(self, latlng_from, latlng_to, departure):
+        """
+        Find the fastest journey between two points.
+
+        :param latlng_from: A tuple of (latitude, longitude) for the starting
+            point.
+        :param latlng_to: A tuple of (latitude, longitude) for the
+            destination.
+        :param departure: The departure time, in seconds since midnight.
+        :return: A dict of the travel time in seconds and sections of the
+            journey with GeoJSON paths, or ``None`` if no journey was found.
+        """
+        egress = self._walk_to_stops(latlng_to)
+        target_arrival, target_stop, labels = self._raptor(latlng_from, egress, departure)
+        walking_time = self._walking_time(latlng_from, latlng_to)
+        if walking_time is not None and departure + walking_time <= target_arrival:
+            return {
+                "time": walking_time,
+                "sections": self._build_sections(latlng_from, latlng_to, None, labels),
+            }
+        if target_stop is None:
+            return None
+        return {
+            "time": int(target_arrival - departure),
+            "sections": self._build_sections(latlng_from, latlng_to, target_stop, labels),
+        }
+
+    def _reverse_raptor(self, egress, arrival):
+        """
+        Run the RAPTOR algorithm backwards from a destination, to find the
+        latest departure from every stop to reach it in time.
+
+        :param egress: A dict mapping the stops close to the destination to
+            the walking time to the destination.
+        :param arrival: The arrival time at the destination, in seconds since
+            midnight.
+        :return: A dict mapping the stops from which the destination can be
+            reached, by boarding a trip or walking, to a tuple of the latest
+            departure time from the stop and the arrival time at the
+            destination.
+        """
+        timetable = self.timetable
+        no_label = (float("-inf"), None, None)
+
+        # Latest departure time from each stop, arrival time at the
+        # destination and walking time to the destination (``None`` if there
+        # is a trip left to take)
+        best = {}
+        for stop, walk_time in egress.items():
+            best[stop] = (arrival - walk_time, arrival, walk_time)
+        marked = set(best)
+        # Same, without the stops left by walking to another stop, as the
+        # forward algorithm does not walk before the first trip
+        boarding = {stop: label[:2] for stop, label in best.items()}
+
+        for _ in range(MAX_ROUNDS):
+            if not marked:
+                break
+            # Transfers to the stops reached in the previous round
+            for stop in list(marked):
+                departure, target_arrival, walk_time = best[stop]
+                for other_stop, transfer_time in timetable.transfers[stop]:
+                    if departure - transfer_time > best.get(other_stop, no_label)[0]:
+                        best[other_stop] = (
+                            departure - transfer_time,
+                            target_arrival,
+                            None if walk_time is None else walk_time + transfer_time,
+                        )
+                        marked.add(other_stop)
+
+            # Latest departure times with one trip less, at the stops
+            # improved during the previous round. A trip can only be improved
+            # by leaving it at one of these stops.
+            previous_best = {stop: best[stop] for stop in marked}
+
+            # Patterns to scan backwards, from their last marked stop
+            queue = {}
+            for stop in marked:
+                for pattern, position in timetable.stops_patterns[stop]:
+                    if position > queue.get(pattern, -1):
+                        queue[pattern] = position
+            marked = set()
+
+            for pattern, start in queue.items():
+                stops = timetable.patterns_stops[pattern]
+                arrivals = self.patterns_arrivals[pattern]
+                departures = self.patterns_departures[pattern]
+                trip = None
+                for position in range(start, -1, -1):
+                    stop = stops[position]
+                    if trip is not None:
+                        departure = departures[position][trip]
+                        if departure > best.get(stop, no_label)[0]:
+                            best[stop] = (departure, target_arrival, None)
+                            boarding[stop] = (departure, target_arrival)
+                            marked.add(stop)
+                    # Check whether a later trip can be left at this stop
+                    previous = previous_best.get(stop, None)
+                    if previous is not None and (
+                        trip is None or previous[0] >= arrivals[position][trip]
+                    ):
+                        latest_trip = bisect.bisect_right(arrivals[position], previous[0]) - 1
+                        if latest_trip >= 0 and (trip is None or latest_trip > trip):
+                            trip = latest_trip
+                            if previous[2] is None:
+                                target_arrival = previous[1]
+                            else:
+                                # Walk to the destination right away
+                                target_arrival = arrivals[position][trip] + previous[2]
+
+        return boarding
+
+    def travel_times_to(self, latlngs_from, latlng_to, arrival):
+        """
+        Get the travel times from many points to a single destination, for
+        the journeys arriving at the destination in time and leaving as late
+        as possible. A single backwards search is shared by all the points.
+
+        :param latlngs_from: A list of tuples of (latitude, longitude) for the
+            starting points.
+        :param latlng_to: A tuple of (latitude, longitude) for the
+            destination.
+        :param arrival: The arrival time at the destination, in seconds since
+            midnight.
+        :return: A list of the travel times in seconds, in the order of
+            ``latlngs_from``, ``None`` if no journey was found.
+        """
+        boarding = self._reverse_raptor(self._walk_to_stops(latlng_to), arrival)
+        travel_times = []
+        for latlng_from in latlngs_from:
+            # Latest departure from the starting point, and arrival time at
+            # the destination, walking all the way if possible
+            journey = None
+            walking_time = self._walking_time(latlng_from, latlng_to)
+            if walking_time is not None:
+                journey = (arrival - walking_time, arrival)
+            for stop, walk_time in self._walk_to_stops(latlng_from).items():
+                label = boarding.get(stop, None)
+                if label is not None and (journey is None or label[0] - walk_time > journey[0]):
+                    journey = (label[0] - walk_time, label[1])
+            travel_times.append(None if journey is None else int(journey[1] - journey[0]))
+        return travel_times
+
+
+def get_timetable_path(config):
+    """
+    Get the path of the timetable file built from the GTFS feed.
+
+    :param config: A config dict.
+    :return: The path to the timetable file.
+    """
+    return os.path.join(config["data_directory"], TIMETABLE_FILENAME)
+
+
+def _get_feed_files(feed_path):
+    """
+    List the files of a GTFS feed.
+
+    :param feed_path: Path to the GTFS feed, either a zip file or a directory.
+    :return: A sorted list of paths.
+    """
+    if os.path.isdir(feed_path):
+        return sorted(
+            os.path.join(feed_path, x) for x in os.listdir(feed_path) if x.endswith(".txt")
+        )
+    return [feed_path]
+
+
+def get_feed_stat(feed_path):
+    """
+    Get the size and modification time of the files of a GTFS feed, to
+    cheaply check whether it changed.
+
+    :param feed_path: Path to the GTFS feed, either a zip file or a directory.
+    :return: A list of lists of file name, size and modification time.
+    """
+    return [
+        [os.path.basename(x), os.path.getsize(x), os.path.getmtime(x)]
+        for x in _get_feed_files(feed_path)
+    ]
+
+
+def compute_feed_hash(feed_path):
+    """
+    Compute the hash of the content of a GTFS feed, to know whether the
+    timetable built from it is up to date.
+
+    :param feed_path: Path to the GTFS feed, either a zip file or a directory.
+    :return: The SHA256 hex digest of the files of the feed.
+    """
+    sha = hashlib.sha256()
+    for path in _get_feed_files(feed_path):
+        sha.update(os.path.basename(path).encode("utf-8"))
+        with io.open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+                sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _write_timetable(timetable_path, feed, timetable):
+    """
+    Write a timetable file, replacing it atomically. The description of the
+    feed is pickled first, so that it can be read without loading the
+    timetable.
+    """
+    with open(timetable_path + ".tmp", "wb") as fh:
+        pickle.dump(feed, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(timetable, fh, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(timetable_path + ".tmp", timetable_path)
+
+
+def build_timetable(config):
+    """
+    Build the timetable from the GTFS feed in config, and store it in the data
+    directory, along with the hash of the feed.
+
+    :param config: A config dict.
+    :return: The built ``Timetable``.
+    """
+    LOGGER.info("Building timetable from GTFS feed %s...", config["gtfs_feed"])
+    feed = {
+        "stat": get_feed_stat(config["gtfs_feed"]),
+        "content_hash": compute_feed_hash(config["gtfs_feed"]),
+    }
+    timetable = Timetable(config["gtfs_feed"])
+    _write_timetable(get_timetable_path(config), feed, timetable)
+    return timetable
+
+
+def is_timetable_up_to_date(config):
+    """
+    Check whether the timetable was built from the current content of the
+    GTFS feed in config. The feed is only hashed if the size or modification
+    time of its files changed.
+
+    :param config: A config dict.
+    :return: ``True`` if the timetable is up to date.
+    """
+    timetable_path = get_timetable_path(config)
+    try:
+        with open(timetable_path, "rb") as fh:
+            feed = pickle.load(fh)
+            if not isinstance(feed, dict):
+                # Built before the feed was stored along with the timetable
+                return False
+            stat = get_feed_stat(config["gtfs_feed"])
+            if feed["stat"] == stat:
+                return True
+            if feed["content_hash"] != compute_feed_hash(config["gtfs_feed"]):
+                return False
+            # Only the modification time changed, store it to avoid hashing
+            # the feed again
+            feed["stat"] = stat
+            _write_timetable(timetable_path, feed, pickle.load(fh))
+    except (IOError, OSError, EOFError, pickle.UnpicklingError):
+        return False
+    return True
+
+
+def get_timetable_feed_hash(config):
+    """
+    Get the hash of the GTFS feed the timetable was built from, without
+    loading the timetable.
+
+    :param config: A config dict.
+    :return: The hash of the feed, see ``compute_feed_hash``, or ``None`` if
+        the timetable is not built.
+    """
+    try:
+        with open(get_timetable_path(config), "rb") as fh:
+            feed = pickle.load(fh)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError):
+        return None
+    return feed["content_hash"] if isinstance(feed, dict) else None
+
+
+_ROUTERS = {}
+_ROUTERS_LOCK = threading.Lock()
+
+
+def get_router(config):
+    """
+    Get the router for the timetable built from the GTFS feed. It is loaded
+    once per process, and reloaded if the timetable was rebuilt.
+
+    :param config: A config dict.
+    :return: A ``Router``, or ``None`` if the timetable is not built.
+    """
+    timetable_path = get_timetable_path(config)
+    try:
+        mtime = os.path.getmtime(timetable_path)
+    except OSError:
+        LOGGER.warning("GTFS timetable not found. Please run build-data.")
+        return None
+    with _ROUTERS_LOCK:
+        cached = _ROUTERS.get(timetable_path)
+        if cached is None or cached[0] != mtime:
+            with open(timetable_path, "rb") as fh:
+                # Skip the description of the feed
+                pickle.load(fh)
+                cached = _ROUTERS[timetable_path] = (mtime, Router(pickle.load(fh)))
+        return cached[1]
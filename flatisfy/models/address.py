@@ -0,0 +1,41 @@
+# coding: utf-8
+"""
+This modules defines an SQLAlchemy ORM model for addresses opendata.
+"""
+# pylint: disable=locally-disabled,invalid-name,too-few-public-methods
+from __future__ import absolute_import, print_function, unicode_literals
+
+import logging
+
+from sqlalchemy import Column, Float, Index, Integer, String
+
+from flatisfy.database.base import BASE
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Address(BASE):
+    """
+    SQLAlchemy ORM model to store addresses opendata, to geocode flats at the
+    street level.
+    """
+
+    __tablename__ = "addresses"
+
+    id = Column(Integer, primary_key=True)
+    postal_code = Column(String)
+    street = Column(String)
+    # Street name normalized for matching, see
+    # ``tools.normalize_for_matching``
+    normalized_street = Column(String)
+    # House number with its repetition index, if any (e.g. "12 bis")
+    number = Column(String)
+    lat = Column(Float)
+    lng = Column(Float)
+
+    # Addresses are looked up by postal code and street, possibly by prefix
+    __table_args__ = (Index("ix_addresses_postal_code_street", "postal_code", "normalized_street"),)
+
+    def __repr__(self):
+        return "<Address(id=%s)>" % self.id
@@ -0,0 +1,43 @@
+# coding: utf-8
+"""
+This modules defines an SQLAlchemy ORM model to keep track of the opendata
+built in database.
+"""
+# pylint: disable=locally-disabled,invalid-name,too-few-public-methods
+from __future__ import absolute_import, print_function, unicode_literals
+
+import logging
+
+from sqlalchemy import Column, Integer, String, UniqueConstraint
+
+from flatisfy.database.base import BASE
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class OpendataBuild(BASE):
+    """
+    SQLAlchemy ORM model to store which areas of an opendata table were built,
+    and from which version of the source data file. Tables which are not built
+    per area, such as addresses, have a ``None`` area.
+    """
+
+    __tablename__ = "opendata_builds"
+
+    id = Column(Integer, primary_key=True)
+    # Name of the table built
+    table = Column(String)
+    # Area built, see ``PostalCode.area``
+    area = Column(String)
+    data_file = Column(String)
+    # Hash of the content of the data file the area was built from
+    content_hash = Column(String)
+    # JSON list of the size and modification time of the data file, when
+    # they are not stored elsewhere, to only hash it again when they change
+    data_file_stat = Column(String)
+
+    __table_args__ = (UniqueConstraint("table", "area"),)
+
+    def __repr__(self):
+        return "<OpendataBuild(table=%s, area=%s)>" % (self.table, self.area)
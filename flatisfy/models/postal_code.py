@@ -29,6 +29,8 @@ class PostalCode(BASE):
     postal_code = Column(String, index=True)
     insee_code = Column(String, index=True)
     name = Column(String, index=True)
+    # Name normalized for matching, see ``tools.normalize_for_matching``
+    normalized_name = Column(String)
     lat = Column(Float)
     lng = Column(Float)
     UniqueConstraint("postal_code", "name")
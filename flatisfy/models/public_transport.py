@@ -27,6 +27,8 @@ class PublicTransport(BASE):
     # following ISO 3166-2.
     area = Column(String, index=True)
     name = Column(String)
+    # Name normalized for matching, see ``tools.normalize_for_matching``
+    normalized_name = Column(String)
     lat = Column(Float)
     lng = Column(Float)
 
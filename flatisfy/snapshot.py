@@ -0,0 +1,254 @@
+# coding: utf-8
+"""
+This module contains a compact binary format to store tables of opendata, so
+that they can be memory-mapped read-only instead of being loaded from the
+database.
+
+A snapshot file is made of:
+
+* A fixed-size preamble, with a magic string, the version of the format and
+  the size of the header.
+* A JSON header, describing the columns and holding some free metadata.
+* Fixed-width little-endian arrays, aligned on 8 bytes: one array of floats
+  per numeric column, one array of integer codes per string column, and a
+  string table shared by all the string columns (the offsets of each string
+  and the UTF-8 encoded strings).
+
+Reading a snapshot only parses its header, columns are views on the mapped
+file and strings are decoded on first access.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+
+import json
+import logging
+import os
+import struct
+
+import numpy
+
+LOGGER = logging.getLogger(__name__)
+
+MAGIC = b"FLATSNAP"
+VERSION = 1
+PREAMBLE = struct.Struct("<8sII")
+ALIGNMENT = 8
+FLOAT_DTYPE = numpy.dtype("<f8")
+CODE_DTYPE = numpy.dtype("<i4")
+OFFSET_DTYPE = numpy.dtype("<i8")
+# Larger than any offset or size, to reserve room for them in the header
+OFFSET_PLACEHOLDER = 2 ** 62
+
+
+class StringTable(object):
+    """
+    Read-only table of the strings of a snapshot, decoding them on first
+    access only.
+    """
+
+    def __init__(self, offsets, data):
+        """
+        :param offsets: An array of the start offsets of the strings in
+            ``data``, followed by the size of ``data``.
+        :param data: An array of bytes of the UTF-8 encoded strings.
+        """
+        self.offsets = offsets
+        self.data = data
+        self._strings = [None] * (len(offsets) - 1)
+        # Python objects are faster to access one by one than NumPy arrays
+        self._offsets = None
+        self._view = memoryview(data)
+
+    def __len__(self):
+        return len(self._strings)
+
+    def __getitem__(self, code):
+        string = self._strings[code]
+        if string is None:
+            if self._offsets is None:
+                self._offsets = self.offsets.tolist()
+            start, end = self._offsets[code], self._offsets[code + 1]
+            string = self._strings[code] = str(self._view[start:end], "utf-8")
+        return string
+
+
+class StringColumn(object):
+    """
+    Read-only column of strings of a snapshot, stored as codes in its
+    ``StringTable``. ``None`` values have a negative code.
+    """
+
+    def __init__(self, codes, strings):
+        """
+        :param codes: An array of codes, one per row.
+        :param strings: The ``StringTable`` of the codes.
+        """
+        self.codes = codes
+        self.strings = strings
+        self._codes = None
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, row):
+        """
+        Get the value of a row.
+
+        :param row: The index of the row, or a slice or an array of indexes
+            to get a new column with these rows only.
+        :return: A string, ``None`` or a ``StringColumn``.
+        """
+        if isinstance(row, (slice, numpy.ndarray)):
+            return StringColumn(self.codes[row], self.strings)
+        if self._codes is None:
+            self._codes = self.codes.tolist()
+        code = self._codes[row]
+        return self.strings[code] if code >= 0 else None
+
+    def __iter__(self):
+        if self._codes is None:
+            self._codes = self.codes.tolist()
+        strings = self.strings
+        return (strings[code] if code >= 0 else None for code in self._codes)
+
+
+def _align(offset):
+    """
+    Round up an offset to the alignment of the arrays.
+    """
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_snapshot(path, types, rows, chunks, metadata=None):
+    """
+    Write a snapshot file. The file is replaced atomically, so that it can
+    be written while being read.
+
+    Rows are written by chunks, so that only the strings of the snapshot are
+    held in memory while writing it.
+
+    :param path: The path of the snapshot file.
+    :param types: A dict mapping column names to their type, either
+        ``"string"`` (values are strings or ``None``) or ``"float"``, in the
+        order of the values of the rows.
+    :param rows: The number of rows of the snapshot.
+    :param chunks: An iterable of lists of rows, ``rows`` rows in total. Each
+        row is a tuple of values, in the order of ``types``.
+    :param metadata: A JSON-serializable object to store in the header.
+    """
+    header = {
+        "rows": rows,
+        "columns": {
+            name: {"type": "string" if type_ == "string" else "float", "offset": OFFSET_PLACEHOLDER}
+            for name, type_ in types.items()
+        },
+        "strings": {
+            "count": OFFSET_PLACEHOLDER,
+            "size": OFFSET_PLACEHOLDER,
+            "offsets_offset": OFFSET_PLACEHOLDER,
+            "data_offset": OFFSET_PLACEHOLDER,
+        },
+        "metadata": metadata,
+    }
+    # The string table is only known once all the rows are written, reserve
+    # room for the largest possible offsets in the header
+    header_size = len(json.dumps(header).encode("utf-8"))
+    offset = _align(PREAMBLE.size + header_size)
+    for description in header["columns"].values():
+        description["offset"] = offset
+        dtype = CODE_DTYPE if description["type"] == "string" else FLOAT_DTYPE
+        offset = _align(offset + rows * dtype.itemsize)
+
+    strings = {}
+    written = 0
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as fh:
+        for chunk in chunks:
+            chunk = list(chunk)
+            for description, values in zip(header["columns"].values(), zip(*chunk)):
+                if description["type"] == "string":
+                    array = numpy.fromiter(
+                        (-1 if x is None else strings.setdefault(x, len(strings)) for x in values),
+                        dtype=CODE_DTYPE,
+                        count=len(values),
+                    )
+                else:
+                    array = numpy.asarray(values, dtype=FLOAT_DTYPE)
+                fh.seek(description["offset"] + written * array.itemsize)
+                fh.write(array.tobytes())
+            written += len(chunk)
+        assert written == rows
+
+        encoded = [x.encode("utf-8") for x in strings]
+        string_offsets = numpy.zeros(len(encoded) + 1, dtype=OFFSET_DTYPE)
+        numpy.cumsum([len(x) for x in encoded], out=string_offsets[1:])
+        header["strings"] = {
+            "count": len(encoded),
+            "size": int(string_offsets[-1]),
+            "offsets_offset": offset,
+            "data_offset": _align(offset + string_offsets.nbytes),
+        }
+        fh.seek(header["strings"]["offsets_offset"])
+        fh.write(string_offsets.tobytes())
+        fh.seek(header["strings"]["data_offset"])
+        fh.write(b"".join(encoded))
+
+        # Pad the header with spaces, ignored when decoding it
+        encoded_header = json.dumps(header).encode("utf-8").ljust(header_size)
+        fh.seek(0)
+        fh.write(PREAMBLE.pack(MAGIC, VERSION, header_size))
+        fh.write(encoded_header)
+    os.replace(tmp_path, path)
+
+
+class Snapshot(object):
+    """
+    A snapshot file, memory-mapped read-only.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: The path of the snapshot file.
+        """
+        self.path = path
+        data = numpy.memmap(path, dtype=numpy.uint8, mode="r")
+        magic, version, header_size = PREAMBLE.unpack(data[: PREAMBLE.size].tobytes())
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Unsupported snapshot file: %s." % path)
+        header_end = PREAMBLE.size + header_size
+        header = json.loads(data[PREAMBLE.size : header_end].tobytes().decode("utf-8"))
+        self.metadata = header["metadata"]
+        self.rows = header["rows"] or 0
+
+        def get_array(offset, dtype, count):
+            """
+            Get a view on an array of the file.
+            """
+            return data[offset : offset + count * dtype.itemsize].view(dtype)
+
+        string_table = header["strings"]
+        strings = StringTable(
+            get_array(string_table["offsets_offset"], OFFSET_DTYPE, string_table["count"] + 1),
+            get_array(string_table["data_offset"], numpy.dtype(numpy.uint8), string_table["size"]),
+        )
+        self.columns = {}
+        for name, description in header["columns"].items():
+            if description["type"] == "string":
+                codes = get_array(description["offset"], CODE_DTYPE, self.rows)
+                self.columns[name] = StringColumn(codes, strings)
+            else:
+                self.columns[name] = get_array(description["offset"], FLOAT_DTYPE, self.rows)
+
+
+def open_snapshot(path):
+    """
+    Open a snapshot file, if it exists and is valid.
+
+    :param path: The path of the snapshot file.
+    :return: A ``Snapshot``, or ``None``.
+    """
+    try:
+        return Snapshot(path)
+    except (IOError, OSError, ValueError, KeyError, struct.error):
+        if os.path.exists(path):
+            LOGGER.warning("Invalid snapshot file %s, ignoring it.", path)
+        return None
@@ -7,20 +7,37 @@ import json
 import logging
 import os
 import random
+import re
 import sys
+import threading
 import unittest
 import tempfile
 
-from io import BytesIO
+from io import BytesIO, StringIO
+from unittest import mock as unittest_mock
 
+import imagehash
 import PIL
 import requests
 import requests_mock
 
+import flatisfy.filters
+from flatisfy import data
+from flatisfy import database
+from flatisfy.database import whooshalchemy
+from flatisfy import data_files
+from flatisfy import geo
+from flatisfy import gtfs
+from flatisfy import snapshot
 from flatisfy import tools
 from flatisfy.filters import duplicates
-from flatisfy.filters.cache import ImageCache
-from flatisfy.constants import BACKENDS_BY_PRECEDENCE
+from flatisfy.filters import images
+from flatisfy.filters import metadata
+from flatisfy.filters.cache import GeocodingCache, ImageCache, TravelTimeCache
+from flatisfy.constants import BACKENDS_BY_PRECEDENCE, TimeToModes
+from flatisfy.models.flat import Flat
+from flatisfy.models.postal_code import PostalCode
+from flatisfy.models.public_transport import PublicTransport
 
 LOGGER = logging.getLogger(__name__)
 TESTS_DATA_DIR = os.path.dirname(os.path.realpath(__file__)) + "/test_files/"
@@ -31,8 +48,7 @@ class LocalImageCache(ImageCache):
     A local cache for images, stored in memory.
     """
 
-    @staticmethod
-    def on_miss(path):
+    def on_miss(self, path):
         """
         Helper to actually retrieve photos if not already cached.
         """
@@ -40,7 +56,8 @@ class LocalImageCache(ImageCache):
         with requests_mock.Mocker() as mock:
             with open(path, "rb") as fh:
                 mock.get(url, content=fh.read())
-                return PIL.Image.open(BytesIO(requests.get(url).content))
+                self.sources[path] = requests.get(url).content
+                return PIL.Image.open(BytesIO(self.sources[path]))
 
 
 class TestTexts(unittest.TestCase):
@@ -110,6 +127,575 @@ class TestTexts(unittest.TestCase):
         self.assertEqual("eeeaui", tools.normalize_string(u"éèêàüï"))
 
 
+class TestFuzzyMatch(unittest.TestCase):
+    """
+    Checks fuzzy matching of names.
+    """
+
+    def test_multiple_patterns(self):
+        """
+        Checks all overlapping patterns are found.
+        """
+        matcher = tools.MultiPatternMatcher(["he", "she", "his", "hers"])
+        self.assertEqual({"he", "she", "hers"}, matcher.search("ushers"))
+        self.assertEqual(set(), matcher.search("foobar"))
+
+    def test_confidence(self):
+        """
+        Checks longest matches get the highest confidence.
+        """
+        self.assertEqual(
+            [("denfert rochereau", 100), ("saint-jacques", 58)],
+            metadata.fuzzy_match(
+                "Saint-Jacques, Denfert-Rochereau (Colonel Rol-Tanguy), Mouton-Duvernet",
+                ["saint-jacques", "denfert rochereau", "duvernet", "toto"],
+                limit=4,
+                threshold=50,
+            ),
+        )
+
+    def test_choices_filter(self):
+        """
+        Checks matches are restricted to the filtered choices.
+        """
+        matcher = tools.FuzzyMatcher(["Paris 14", "Ris"])
+        self.assertEqual([("Paris 14", 100)], matcher.match("Paris 14ème", limit=1))
+        self.assertEqual(
+            [("Ris", 100)],
+            matcher.match("Paris 14ème", choices_filter=lambda x: x != "Paris 14"),
+        )
+
+
+class TestSpatialIndex(unittest.TestCase):
+    """
+    Checks proximity queries on GPS positions.
+    """
+
+    # Paris, Versailles, Lyon
+    POSITIONS = [(48.8566, 2.3522), (48.8049, 2.1204), (45.764, 4.8357)]
+
+    def test_batch_distances(self):
+        """
+        Checks batch distances match the distances computed one at a time.
+        """
+        # Former location of distance, kept for existing callers
+        self.assertIs(geo.distance, tools.distance)
+        expected = [[geo.distance(x, y) for y in self.POSITIONS] for x in self.POSITIONS]
+        for computed, expected_row in zip(
+            geo.distances(self.POSITIONS[0], self.POSITIONS), expected[0]
+        ):
+            self.assertAlmostEqual(expected_row, computed, places=6)
+        computed = geo.pairwise_distances(self.POSITIONS, self.POSITIONS)
+        self.assertEqual((3, 3), computed.shape)
+        for computed_row, expected_row in zip(computed.tolist(), expected):
+            for computed_value, expected_value in zip(computed_row, expected_row):
+                self.assertAlmostEqual(expected_value, computed_value, places=6)
+
+    def test_query_radius(self):
+        """
+        Checks only the items within the radius are found, with their exact
+        distance.
+        """
+        index = geo.SpatialIndex(self.POSITIONS)
+        results = index.query_radius(self.POSITIONS[0], 20000)
+        self.assertEqual([self.POSITIONS[0], self.POSITIONS[1]], [x for x, _ in results])
+        self.assertAlmostEqual(geo.distance(self.POSITIONS[0], self.POSITIONS[1]), results[1][1])
+
+    def test_query_nearest(self):
+        """
+        Checks the nearest items are found, sorted by distance.
+        """
+        index = geo.SpatialIndex(
+            [
+                {"name": "Lyon", "gps": self.POSITIONS[2]},
+                {"name": "Versailles", "gps": self.POSITIONS[1]},
+            ],
+            key=lambda x: x["gps"],
+        )
+        self.assertEqual(
+            ["Versailles", "Lyon"],
+            [x["name"] for x, _ in index.query_nearest(self.POSITIONS[0], k=3)],
+        )
+        self.assertEqual([], geo.SpatialIndex([]).query_nearest(self.POSITIONS[0]))
+
+
+class TestOpendataTable(unittest.TestCase):
+    """
+    Checks the in-memory storage of opendata.
+    """
+
+    ROWS = [
+        (
+            "FR-IDF",
+            "75014",
+            "75114",
+            "Paris 14e Arrondissement",
+            "paris XIVe arrondissement",
+            48.8331,
+            2.3264,
+        ),
+        ("FR-IDF", "78000", "78646", "Versailles", "versailles", 48.8049, 2.1204),
+        (
+            "FR-IDF",
+            "75014",
+            "75114",
+            "Paris 14e Arrondissement bis",
+            "paris XIVe arrondissement bis",
+            48.8,
+            2.3,
+        ),
+    ]
+
+    def test_records(self):
+        """
+        Checks rows are returned with the fields of the model.
+        """
+        table = data.OpendataTable(PostalCode, self.ROWS)
+        self.assertEqual(3, len(table))
+        self.assertEqual("Versailles", table[1].name)
+        self.assertEqual((48.8049, 2.1204), (table[1].lat, table[1].lng))
+        self.assertEqual(
+            ["Paris 14e Arrondissement", "Versailles", "Paris 14e Arrondissement bis"],
+            [x.name for x in table],
+        )
+
+    def test_lookup(self):
+        """
+        Checks lookups by value.
+        """
+        table = data.OpendataTable(PostalCode, self.ROWS)
+        self.assertEqual([0, 2], table.lookup("postal_code", "75014"))
+        self.assertEqual([], table.lookup("postal_code", "75015"))
+        self.assertEqual([1], table.lookup("position", (48.8049, 2.1204)))
+
+    def test_snapshot(self):
+        """
+        Checks tables loaded from a snapshot are the same as the original
+        ones.
+        """
+        path = os.path.join(tempfile.mkdtemp(prefix="flatisfy-"), "postal_codes.snapshot")
+        # Rows of areas are contiguous, the areas column is not checked
+        snapshot.write_snapshot(
+            path,
+            data.OpendataTable.get_column_types(PostalCode),
+            len(self.ROWS),
+            [self.ROWS[:2], self.ROWS[2:]],
+            {"areas": {"FR-IDF": [0, 1, None], "FR-NW": [1, 3, None]}},
+        )
+        opendata_snapshot = snapshot.open_snapshot(path)
+
+        table = data.OpendataTable.from_snapshot(PostalCode, opendata_snapshot, ("FR-IDF", "FR-NW"))
+        self.assertEqual(list(data.OpendataTable(PostalCode, self.ROWS)), list(table))
+        self.assertEqual([0, 2], table.lookup("postal_code", "75014"))
+        self.assertEqual([1], table.lookup("position", (48.8049, 2.1204)))
+
+        table = data.OpendataTable.from_snapshot(PostalCode, opendata_snapshot, ("FR-NW",))
+        self.assertEqual(["Versailles", "Paris 14e Arrondissement bis"], [x.name for x in table])
+        self.assertEqual((48.8, 2.3), table.get_position(1))
+
+    def test_snapshot_types(self):
+        """
+        Checks column types of snapshots do not depend on their values.
+        """
+        path = os.path.join(tempfile.mkdtemp(prefix="flatisfy-"), "postal_codes.snapshot")
+        types = {"name": "string", "lat": "float"}
+        for values in [[], [None]]:
+            rows = [(x, 1.0) for x in values]
+            snapshot.write_snapshot(path, types, len(rows), [rows])
+            opendata_snapshot = snapshot.open_snapshot(path)
+            self.assertIsInstance(opendata_snapshot.columns["name"], snapshot.StringColumn)
+            self.assertEqual(values, list(opendata_snapshot.columns["name"]))
+
+    def test_cache(self):
+        """
+        Checks cached entries are built once, until invalidated.
+        """
+        cache = data.OpendataCache()
+        builds = []
+
+        def build():
+            builds.append(1)
+            return data.OpendataTable(PostalCode, self.ROWS)
+
+        table = cache.get("sqlite:///a.db", (PostalCode, ("FR-IDF",)), build)
+        self.assertIs(table, cache.get("sqlite:///a.db", (PostalCode, ("FR-IDF",)), build))
+        cache.get("sqlite:///b.db", (PostalCode, ("FR-IDF",)), build)
+        self.assertEqual(2, len(builds))
+
+        cache.invalidate("sqlite:///a.db")
+        cache.get("sqlite:///a.db", (PostalCode, ("FR-IDF",)), build)
+        cache.get("sqlite:///b.db", (PostalCode, ("FR-IDF",)), build)
+        self.assertEqual(3, len(builds))
+
+
+class TestAddresses(unittest.TestCase):
+    """
+    Checks the street-level geocoding of flats.
+    """
+
+    def write_addresses(self):
+        """
+        Write a BAN CSV file of addresses.
+        """
+        addresses_file = os.path.join(tempfile.mkdtemp(prefix="flatisfy-"), "adresses.csv")
+        with open(addresses_file, "w") as fh:
+            fh.write("id;numero;rep;nom_voie;code_postal;lon;lat\n")
+            fh.write("1;12;;Rue de la Gaîté;75014;2.3230;48.8390\n")
+            fh.write("2;12;bis;Rue de la Gaîté;75014;2.3232;48.8391\n")
+            fh.write("3;20;;Rue de la Gaîté;75014;2.3240;48.8396\n")
+            fh.write("4;3;;Boulevard Saint-Michel;75014;2.3393;48.8443\n")
+            # Skipped, without house number
+            fh.write("5;;;Rue de la Gaîté;75014;2.3;48.8\n")
+        return addresses_file
+
+    def get_index(self):
+        """
+        Build an address index from a BAN CSV file.
+        """
+        rows = list(data_files.preprocess_addresses(self.write_addresses()))
+        self.assertEqual(4, len(rows))
+        self.assertEqual("12 bis", rows[1]["number"])
+        return data.AddressIndex(
+            (x["street"], x["normalized_street"], x["number"], x["lat"], x["lng"]) for x in rows
+        )
+
+    def test_geocode(self):
+        """
+        Check that house numbers and streets are found in locations.
+        """
+        index = self.get_index()
+        self.assertEqual(
+            ((48.8391, 2.3232), "housenumber"), index.geocode("12 bis rue de la Gaîté, 75014 Paris")
+        )
+        self.assertEqual(((48.8443, 2.3393), "housenumber"), index.geocode("3, bd St Michel 75014"))
+        # Unknown house numbers and ordinals fall back on the street
+        self.assertEqual("street", index.geocode("14 rue de la Gaite, 75014 Paris")[1])
+        self.assertEqual("street", index.geocode("Paris 14e, rue de la Gaite")[1])
+        self.assertIsNone(index.geocode("Paris 14e"))
+        # Only numbers followed by a street type or name are house numbers
+        self.assertEqual("street", index.geocode("T3 de 20 m2, rue de la Gaite")[1])
+        self.assertEqual(
+            ((48.8396, 2.3240), "housenumber"),
+            index.geocode("Appartement 3 pieces au 20, rue de la Gaite"),
+        )
+        self.assertEqual(
+            ((48.8396, 2.3240), "housenumber"), index.geocode("Paris 3, 20 Rue de la Gaite")
+        )
+
+    def test_build_addresses(self):
+        """
+        Check that addresses are built again only when the addresses file
+        changes, dropping the geocoding cache.
+        """
+        directory = tempfile.mkdtemp(prefix="flatisfy-")
+        config = {
+            "addresses_file": self.write_addresses(),
+            "data_directory": directory,
+            "database": "sqlite:///%s" % os.path.join(directory, "flatisfy.db"),
+            "search_index": os.path.join(directory, "search_index"),
+        }
+        self.assertFalse(data._are_addresses_up_to_date(config))
+        geocoding_cache_path = GeocodingCache.get_filepath(config)
+        with open(geocoding_cache_path, "w"):
+            pass
+        data.build_addresses(config)
+        self.assertFalse(os.path.exists(geocoding_cache_path))
+
+        with unittest_mock.patch.object(
+            data_files, "compute_file_hash", wraps=data_files.compute_file_hash
+        ) as compute_file_hash:
+            self.assertTrue(data._are_addresses_up_to_date(config))
+            self.assertEqual(0, compute_file_hash.call_count)
+            # Only the modification time changed, the file is hashed once
+            os.utime(config["addresses_file"], (0, 0))
+            self.assertTrue(data._are_addresses_up_to_date(config))
+            self.assertTrue(data._are_addresses_up_to_date(config))
+            self.assertEqual(1, compute_file_hash.call_count)
+
+        with open(config["addresses_file"], "a") as fh:
+            fh.write("6;1;;Rue de la Gaîté;75014;2.3;48.8\n")
+        self.assertFalse(data._are_addresses_up_to_date(config))
+
+
+class TestDatabase(unittest.TestCase):
+    """
+    Checks database initialization.
+    """
+
+    def test_registry(self):
+        """
+        Check that a database is only initialized once per process.
+        """
+        directory = tempfile.mkdtemp(prefix="flatisfy-")
+        database_uri = "sqlite:///%s" % os.path.join(directory, "flatisfy.db")
+        get_session = database.init_db(database_uri, os.path.join(directory, "search_index"))
+        self.assertIs(
+            get_session, database.init_db(database_uri, os.path.join(directory, "search_index"))
+        )
+        self.assertIs(get_session, database.init_db(database_uri))
+        self.assertIsNot(
+            get_session, database.init_db("sqlite:///%s" % os.path.join(directory, "other.db"))
+        )
+
+        with get_session() as session:
+            session.add(
+                PostalCode(
+                    area="FR-IDF", postal_code="75014", name="Paris", lat=48.8331, lng=2.3264
+                )
+            )
+        with database.init_db(database_uri)() as session:
+            self.assertEqual(1, session.query(PostalCode).count())
+
+    def test_search_index(self):
+        """
+        Check that flats are indexed once per commit, whatever the number of
+        times the database was initialized, until it is closed.
+        """
+        directory = tempfile.mkdtemp(prefix="flatisfy-")
+        database_uri = "sqlite:///%s" % os.path.join(directory, "flatisfy.db")
+        search_index = os.path.join(directory, "search_index")
+        for _ in range(3):
+            get_session = database.init_db(database_uri, search_index)
+        index = whooshalchemy.get_index_service(search_index).indexes["Flat"]
+
+        with unittest_mock.patch.object(index, "writer", wraps=index.writer) as writer:
+            with get_session() as session:
+                session.add(Flat(id="1@seloger", title="Rue de la Gaîté"))
+            self.assertEqual(1, writer.call_count)
+        with get_session() as session:
+            self.assertEqual(["1@seloger"], [x.id for x in Flat.search_query(session, "Gaîté")])
+
+        # Flats are only indexed again if their searchable fields changed
+        with unittest_mock.patch.object(index, "writer", wraps=index.writer) as writer:
+            with get_session() as session:
+                flat = session.query(Flat).get("1@seloger")
+                flat.is_expired = True
+                flat.title = "Rue de la Gaîté"
+            self.assertEqual(0, writer.call_count)
+            with get_session() as session:
+                session.merge(Flat(id="1@seloger", title="Boulevard Saint-Michel"))
+                # Changes flushed before the commit are indexed as well
+                session.flush()
+            self.assertEqual(1, writer.call_count)
+        with get_session() as session:
+            self.assertEqual([], list(Flat.search_query(session, "Gaîté")))
+            self.assertEqual(["1@seloger"], [x.id for x in Flat.search_query(session, "Michel")])
+
+        database.close_db()
+        self.assertIsNot(get_session, database.init_db(database_uri))
+        with unittest_mock.patch.object(index, "writer", wraps=index.writer) as writer:
+            with database.init_db(database_uri)() as session:
+                session.add(Flat(id="2@seloger", title="Rue de la Gaîté"))
+            self.assertEqual(0, writer.call_count)
+
+
+class TestJSONStreaming(unittest.TestCase):
+    """
+    Checks JSON arrays are streamed as they would be fully decoded.
+    """
+
+    DATA = '[{"a": [1, "]"]}, 12345, -1.5e3 , "b,]\\"c" ,true,null, "\\u00e9t\\u00e9"]'
+
+    def iter_json_array(self, text, chunk_size):
+        """
+        Stream a JSON array from a string, read by chunks.
+        """
+        return list(data_files._iter_json_array(StringIO(text), chunk_size=chunk_size))
+
+    def test_chunk_edges(self):
+        """
+        Checks items split across chunks, including numbers and strings with
+        delimiters, are decoded whole.
+        """
+        expected = json.loads(self.DATA)
+        for chunk_size in range(1, len(self.DATA) + 1):
+            self.assertEqual(expected, self.iter_json_array(self.DATA, chunk_size))
+
+    def test_empty_array(self):
+        """
+        Checks empty arrays have no items.
+        """
+        for text in ["[]", " [\n ] "]:
+            for chunk_size in [1, 2, 64]:
+                self.assertEqual([], self.iter_json_array(text, chunk_size))
+
+    def test_invalid_data(self):
+        """
+        Checks truncated or invalid data are rejected.
+        """
+        for end in range(len(self.DATA)):
+            for chunk_size in [1, 7, 64]:
+                with self.assertRaises(ValueError):
+                    self.iter_json_array(self.DATA[:end], chunk_size)
+        for text in ['{"a": 1}', "[1 2]", "[1,]"]:
+            with self.assertRaises(ValueError):
+                self.iter_json_array(text, 2)
+
+
+class TestOpendataBuild(unittest.TestCase):
+    """
+    Checks opendata is only built for the needed areas, when it changed.
+    """
+
+    def setUp(self):
+        self.module_dir = data_files.MODULE_DIR
+        data_files.MODULE_DIR = tempfile.mkdtemp(prefix="flatisfy-")
+        with open(os.path.join(data_files.MODULE_DIR, data_files.LAPOSTE_DATA_FILE), "w") as fh:
+            json.dump(
+                [
+                    {
+                        "fields": {
+                            "code_postal": postal_code,
+                            "code_commune_insee": insee_code,
+                            "nom_de_la_commune": name,
+                            "coordonnees_gps": [lat, lng],
+                        }
+                    }
+                    for postal_code, insee_code, name, lat, lng in [
+                        ("75014", "75114", "PARIS", 48.8331, 2.3264),
+                        ("44000", "44109", "NANTES", 47.2316, -1.5483),
+                    ]
+                ],
+                fh,
+            )
+        for area in ["FR-IDF", "FR-NW"]:
+            self.write_stops(area, "Gare Montparnasse" if area == "FR-IDF" else "Commerce")
+        directory = tempfile.mkdtemp(prefix="flatisfy-")
+        self.config = {
+            "data_directory": directory,
+            "database": "sqlite:///%s" % os.path.join(directory, "flatisfy.db"),
+            "search_index": os.path.join(directory, "search_index"),
+        }
+
+    def tearDown(self):
+        data_files.MODULE_DIR = self.module_dir
+
+    def write_stops(self, area, name):
+        """
+        Write the public transport data file of an area, with a single stop.
+        """
+        with open(
+            os.path.join(data_files.MODULE_DIR, data_files.TRANSPORT_DATA_FILES[area]), "w"
+        ) as fh:
+            fh.write("stop_id,stop_code,stop_name,stop_lat,stop_lon\n")
+            fh.write("1,,%s,48.8412,2.3210\n" % name)
+
+    def get_names(self, model):
+        """
+        Get the names of the rows of a model in database, by area.
+        """
+        get_session = database.init_db(self.config["database"], self.config["search_index"])
+        with get_session() as session:
+            return sorted(session.query(model.area, model.name))
+
+    def test_build_areas(self):
+        """
+        Check that areas are only built once, unless their data files change.
+        """
+        self.assertTrue(data.build_areas(["FR-IDF"], self.config, parallel=False))
+        self.assertEqual([("FR-IDF", "Paris")], self.get_names(PostalCode))
+        self.assertEqual([("FR-IDF", "Gare Montparnasse")], self.get_names(PublicTransport))
+        self.assertFalse(data.build_areas(["FR-IDF"], self.config, parallel=False))
+
+        # Only the public transport data of the changed area are rebuilt
+        self.write_stops("FR-IDF", "Denfert-Rochereau")
+        self.assertTrue(
+            data.build_areas(["FR-IDF", "FR-NW"], self.config, missing_only=True, parallel=False)
+        )
+        self.assertEqual(
+            [("FR-IDF", "Gare Montparnasse"), ("FR-NW", "Commerce")],
+            self.get_names(PublicTransport),
+        )
+        self.assertTrue(data.build_areas(["FR-IDF", "FR-NW"], self.config, parallel=False))
+        self.assertEqual(
+            [("FR-IDF", "Denfert-Rochereau"), ("FR-NW", "Commerce")],
+            self.get_names(PublicTransport),
+        )
+        self.assertEqual([("FR-IDF", "Paris"), ("FR-NW", "Nantes")], self.get_names(PostalCode))
+
+        # Built data are loaded from snapshots
+        self.assertTrue(os.path.isfile(data.get_snapshot_path(PublicTransport, self.config)))
+        table = data.load_data(PublicTransport, {"postal_codes": ["75014", "44000"]}, self.config)
+        self.assertIsInstance(table.columns["name"], snapshot.StringColumn)
+        self.assertEqual(["Denfert-Rochereau", "Commerce"], [x.name for x in table])
+
+    def test_single_parse(self):
+        """
+        Check that the postal codes data file is parsed once for all areas.
+        """
+        with unittest_mock.patch.object(
+            data_files, "_iter_json_array", wraps=data_files._iter_json_array
+        ) as iter_json_array:
+            self.assertTrue(data.build_areas(["FR-IDF", "FR-NW"], self.config, parallel=False))
+        self.assertEqual(1, iter_json_array.call_count)
+        self.assertEqual([("FR-IDF", "Paris"), ("FR-NW", "Nantes")], self.get_names(PostalCode))
+
+    def test_spooled_rows(self):
+        """
+        Check that rows preprocessed in worker processes are streamed back
+        through temporary files.
+        """
+        preprocess = data_files.get_preprocessing_function(
+            PostalCode, data_files.LAPOSTE_DATA_FILE, ("FR-IDF", "FR-NW")
+        )
+        path = data._run_preprocessing_function(preprocess, self.config["data_directory"])
+        self.assertEqual(
+            [("FR-IDF", "Paris"), ("FR-NW", "Nantes")],
+            [(x["area"], x["name"]) for x in data._iter_spooled_rows(path)],
+        )
+        self.assertFalse(os.path.exists(path))
+
+    def test_snapshots_up_to_date(self):
+        """
+        Check that data files are only hashed again when their size or
+        modification time changed.
+        """
+        self.assertTrue(data.build_areas(["FR-IDF"], self.config, parallel=False))
+        with unittest_mock.patch.object(
+            data_files, "compute_content_hash", wraps=data_files.compute_content_hash
+        ) as compute_content_hash:
+            self.assertTrue(data._are_snapshots_up_to_date(["FR-IDF"], self.config))
+            self.assertEqual(0, compute_content_hash.call_count)
+            self.write_stops("FR-IDF", "Denfert-Rochereau")
+            self.assertFalse(data._are_snapshots_up_to_date(["FR-IDF"], self.config))
+            self.assertEqual(1, compute_content_hash.call_count)
+
+    @unittest.skipIf(data.fcntl is None, "File locks are not available.")
+    def test_build_lock(self):
+        """
+        Check that areas are not built while another build holds the lock.
+        """
+        results = []
+        with data._build_lock(self.config):
+            thread = threading.Thread(
+                target=lambda: results.append(
+                    data.build_areas(["FR-IDF"], self.config, parallel=False)
+                )
+            )
+            thread.start()
+            thread.join(0.2)
+            self.assertTrue(thread.is_alive())
+        thread.join()
+        self.assertEqual([True], results)
+
+    def test_compressed_files(self):
+        """
+        Check that compressed data files are read as the original ones.
+        """
+        for data_file, extension in [
+            (data_files.LAPOSTE_DATA_FILE, ".gz"),
+            (data_files.TRANSPORT_DATA_FILES["FR-IDF"], ".xz"),
+        ]:
+            path = os.path.join(data_files.MODULE_DIR, data_file)
+            opener = data_files.COMPRESSED_FILE_OPENERS[extension]
+            with open(path, "rb") as fh, opener(path + extension, "wb") as out:
+                out.write(fh.read())
+            os.remove(path)
+        self.assertTrue(data.build_areas(["FR-IDF"], self.config, parallel=False))
+        self.assertEqual([("FR-IDF", "Paris")], self.get_names(PostalCode))
+        self.assertEqual([("FR-IDF", "Gare Montparnasse")], self.get_names(PublicTransport))
+
+
 class TestPhoneNumbers(unittest.TestCase):
     """
     Checks phone numbers normalizations.
@@ -213,6 +799,19 @@ class TestPhotos(unittest.TestCase):
             )
         )
 
+    def test_hash_reduced_decoding(self):
+        """
+        Checks that images are not kept in memory once hashed, and that
+        reduced resolution decoding gives the same hash.
+        """
+        url = TESTS_DATA_DIR + "127028739-3@seloger.jpg"
+        photo_hash = self.IMAGE_CACHE.get_hash(url)
+        self.assertNotIn(url, self.IMAGE_CACHE.map)
+        self.assertIs(photo_hash, self.IMAGE_CACHE.get_hash(url))
+
+        full_hash = imagehash.average_hash(PIL.Image.open(url))
+        self.assertLess(photo_hash - full_hash, 3)
+
     def test_matching_cropped_photos(self):
         """
         Compares two matching photos with one being cropped.
@@ -263,6 +862,547 @@ class TestImageCache(unittest.TestCase):
         self.assertIsNone(self.IMAGE_CACHE.get("https://httpbin.org/"))
 
 
+class LocalTravelTimeCache(TravelTimeCache):
+    """
+    A travel time cache computing travel times from the distance, without
+    querying any API.
+    """
+
+    def on_miss(self, key):
+        """
+        Helper to compute a travel time from the distance.
+        """
+        return {"time": int(geo.distance(key[0], key[1])), "sections": []}
+
+
+class TestTravelTimeCache(unittest.TestCase):
+    """
+    Checks travel time cache is working as expected.
+    """
+
+    KEY = ((48.8566, 2.3522), (48.8049, 2.1204), TimeToModes.PUBLIC_TRANSPORT)
+
+    def get_config(self, **kwargs):
+        """
+        Build a config for the travel time cache.
+        """
+        config = {
+            "data_directory": tempfile.mkdtemp(prefix="flatisfy-"),
+            "travel_time_cache_ttl": 3600,
+            "travel_time_cache_max_items": 10,
+            "local_travel_times": False,
+            "gtfs_feed": None,
+        }
+        config.update(kwargs)
+        return config
+
+    def test_persistence(self):
+        """
+        Check that travel times are only computed once, across runs.
+        """
+        config = self.get_config()
+        cache = LocalTravelTimeCache(config)
+        travel_time = cache.get(self.KEY)
+        self.assertEqual(travel_time, cache.get(self.KEY))
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+        cache.save()
+
+        cache = LocalTravelTimeCache(config)
+        # Close enough origins share their travel times
+        self.assertEqual(travel_time, cache.get(((48.85661, 2.35221),) + self.KEY[1:]))
+        self.assertEqual((1, 0), (cache.hits, cache.misses))
+
+        # Other modes do not
+        cache.get(self.KEY[:2] + (TimeToModes.WALK,))
+        self.assertEqual(1, cache.misses)
+
+    def test_limits(self):
+        """
+        Check that expired and least recently used travel times are dropped.
+        """
+        cache = LocalTravelTimeCache(self.get_config(travel_time_cache_max_items=1))
+        with unittest_mock.patch("time.time", return_value=1000000):
+            cache.get(self.KEY)
+        with unittest_mock.patch("time.time", return_value=1000000 + 3601):
+            self.assertIsNone(cache.get_cached(self.KEY))
+            cache.save()
+        self.assertEqual(0, len(cache.map))
+
+        cache = LocalTravelTimeCache(self.get_config(travel_time_cache_max_items=1))
+        cache.get(self.KEY)
+        cache.get(self.KEY[:2] + (TimeToModes.WALK,))
+        cache.save()
+        self.assertEqual(
+            [cache.compute_key(*self.KEY[:2], TimeToModes.WALK)], list(cache.map.keys())
+        )
+
+    def test_backends(self):
+        """
+        Check that travel times are computed again when another backend is
+        configured.
+        """
+        config = self.get_config()
+        walk_key = self.KEY[:2] + (TimeToModes.WALK,)
+        cache = LocalTravelTimeCache(config)
+        cache.get(self.KEY)
+        cache.get(walk_key)
+        cache.save()
+
+        config["local_travel_times"] = True
+        cache = LocalTravelTimeCache(config)
+        self.assertIsNotNone(cache.get_cached(self.KEY))
+        self.assertIsNone(cache.get_cached(walk_key))
+
+        config["gtfs_feed"] = tempfile.mkdtemp(prefix="flatisfy-")
+        cache = LocalTravelTimeCache(config)
+        self.assertIsNone(cache.get_cached(self.KEY))
+        cache.get(self.KEY)
+        cache.save()
+        # Travel times from the local router are only dropped once the
+        # timetable is rebuilt from another feed
+        timetable_path = gtfs.get_timetable_path(config)
+        gtfs._write_timetable(timetable_path, {"stat": [], "content_hash": "a"}, None)
+        cache = LocalTravelTimeCache(config)
+        self.assertIsNone(cache.get_cached(self.KEY))
+        cache.get(self.KEY)
+        cache.save()
+        # Touching the feed only updates its stat
+        feed = {"stat": [["stops.txt", 1, 1.0]], "content_hash": "a"}
+        gtfs._write_timetable(timetable_path, feed, None)
+        cache = LocalTravelTimeCache(config)
+        self.assertIsNotNone(cache.get_cached(self.KEY))
+        gtfs._write_timetable(timetable_path, {"stat": [], "content_hash": "b"}, None)
+        cache = LocalTravelTimeCache(config)
+        self.assertIsNone(cache.get_cached(self.KEY))
+
+
+class TestTravelTimesPruning(unittest.TestCase):
+    """
+    Checks travel times which cannot match the constraint are not looked for.
+    """
+
+    def test_pruning(self):
+        """
+        Check that flats too far from a place are rejected without any lookup.
+        """
+        config = {
+            "data_directory": None,
+            "travel_time_cache_ttl": 3600,
+            "travel_time_cache_max_items": 10,
+            "navitia_api_key": None,
+            "mapbox_api_key": None,
+            "local_travel_times": False,
+            "gtfs_feed": None,
+        }
+        place = (48.8566, 2.3522)
+        constraint = {
+            "time_to": {"work": {"gps": list(place), "time": [None, 3600], "mode": "WALK"}}
+        }
+        flats_list = [
+            # About 1km from the place
+            {"id": "close", "flatisfy": {"matched_stations": [{"gps": (48.8656, 2.3522)}]}},
+            # About 50km from the place
+            {"id": "far", "flatisfy": {"matched_stations": [{"gps": (49.3066, 2.3522)}]}},
+            # Sharing its station with the previous one
+            {"id": "far-bis", "flatisfy": {"matched_stations": [{"gps": (49.3066, 2.3522)}]}},
+        ]
+        travel_time_cache = LocalTravelTimeCache(config)
+        metadata.compute_travel_times(flats_list, constraint, config, travel_time_cache)
+
+        # Pruned lookups are counted once per station
+        self.assertEqual((1, 1), (travel_time_cache.misses, travel_time_cache.pruned))
+        self.assertLess(flats_list[0]["flatisfy"]["time_to"]["work"]["time"], 3600)
+        self.assertNotIn("estimate", flats_list[0]["flatisfy"]["time_to"]["work"])
+        for flat in flats_list[1:]:
+            self.assertGreater(flat["flatisfy"]["time_to"]["work"]["time"], 3600)
+            self.assertTrue(flat["flatisfy"]["time_to"]["work"]["estimate"])
+
+    def test_batched_times(self):
+        """
+        Check that travel times fetched at once are not looked for again one
+        route at a time.
+        """
+        config = {
+            "data_directory": None,
+            "travel_time_cache_ttl": 3600,
+            "travel_time_cache_max_items": 10,
+            "local_travel_times": False,
+            "gtfs_feed": None,
+        }
+        constraint = {"time_to": {"work": {"gps": [48.8566, 2.3522], "mode": "WALK"}}}
+        flats_list = [
+            {"id": "a", "flatisfy": {"matched_stations": [{"gps": (48.8656, 2.3522)}]}},
+            {"id": "b", "flatisfy": {"matched_stations": [{"gps": (48.8656, 2.3522)}]}},
+        ]
+        travel_time_cache = LocalTravelTimeCache(config)
+        with unittest_mock.patch.object(
+            tools, "get_travel_times_to", return_value=[600]
+        ) as get_travel_times_to, unittest_mock.patch.object(
+            travel_time_cache, "on_miss"
+        ) as on_miss:
+            metadata.compute_travel_times(flats_list, constraint, config, travel_time_cache)
+        self.assertEqual(1, get_travel_times_to.call_count)
+        self.assertEqual(0, on_miss.call_count)
+        for flat in flats_list:
+            self.assertEqual(600, flat["flatisfy"]["time_to"]["work"]["time"])
+
+
+class TestGeocodingCache(unittest.TestCase):
+    """
+    Checks geocoding cache is working as expected.
+    """
+
+    KEY = ("postal_code", "paris 14eme", ["75014"], 20000)
+
+    def test_persistence(self):
+        """
+        Check that locations are only geocoded once, across runs, until the
+        cache is invalidated.
+        """
+        config = {"data_directory": tempfile.mkdtemp(prefix="flatisfy-")}
+        cache = GeocodingCache(config)
+        result = cache.get(self.KEY, lambda: ("75014", "75114", {"lat": 48.8331, "lng": 2.3264}))
+        # Results are returned as loaded back from JSON
+        self.assertEqual(["75014", "75114", {"lat": 48.8331, "lng": 2.3264}], result)
+        # Unknown locations are cached as well
+        self.assertIsNone(cache.get(self.KEY[:1] + ("nowhere",) + self.KEY[2:], lambda: None))
+        cache.save()
+
+        cache = GeocodingCache(config)
+        self.assertEqual(result, cache.get(self.KEY, lambda: self.fail("Should be cached")))
+        self.assertIsNone(
+            cache.get(
+                self.KEY[:1] + ("nowhere",) + self.KEY[2:], lambda: self.fail("Should be cached")
+            )
+        )
+        self.assertEqual((2, 0), (cache.hits, cache.misses))
+        # Returned results are copies
+        cache.get(self.KEY, lambda: None)[2]["lat"] = 0
+        self.assertEqual(result, cache.get(self.KEY, lambda: None))
+
+        GeocodingCache.invalidate(config)
+        cache = GeocodingCache(config)
+        self.assertIsNone(cache.get(self.KEY, lambda: None))
+        self.assertEqual(1, cache.misses)
+
+    def test_unchanged(self):
+        """
+        Check that the cache is only written if items were added.
+        """
+        config = {"data_directory": tempfile.mkdtemp(prefix="flatisfy-")}
+        cache = GeocodingCache(config)
+        cache.get(self.KEY, lambda: None)
+        cache.save()
+        filepath = GeocodingCache.get_filepath(config)
+        os.utime(filepath, (0, 0))
+
+        cache = GeocodingCache(config)
+        cache.get(self.KEY, lambda: self.fail("Should be cached"))
+        cache.save()
+        self.assertEqual(0, os.path.getmtime(filepath))
+
+
+class TestBatchedTravelTimes(unittest.TestCase):
+    """
+    Checks travel times from many points are fetched at once.
+    """
+
+    PLACE = (48.8049, 2.1204)
+    ORIGINS = [(48.85 + i * 0.01, 2.35) for i in range(30)]
+
+    def test_mapbox_matrix(self):
+        """
+        Check that Mapbox matrix queries are batched.
+        """
+        config = {"mapbox_api_key": "pk.test", "local_travel_times": False, "gtfs_feed": None}
+
+        def matrix_callback(request, context):
+            sources = request.qs["sources"][0].split(";")
+            return {"code": "Ok", "durations": [[int(x)] for x in sources]}
+
+        with requests_mock.Mocker() as mock:
+            mock.get(re.compile("https://api.mapbox.com/directions-matrix/"), json=matrix_callback)
+            travel_times = tools.get_travel_times_to(
+                self.ORIGINS, self.PLACE, TimeToModes.BIKE, config
+            )
+            self.assertEqual(2, mock.call_count)
+        batch_size = tools.MAPBOX_MATRIX_MAX_COORDINATES - 1
+        self.assertEqual([x % batch_size for x in range(len(self.ORIGINS))], travel_times)
+
+    def test_local_estimates(self):
+        """
+        Check that travel times are estimated locally, without any query, and
+        are consistent with the lower bounds used for pruning.
+        """
+        config = {"mapbox_api_key": "pk.test", "local_travel_times": True, "gtfs_feed": None}
+        with requests_mock.Mocker() as mock:
+            for mode in [TimeToModes.WALK, TimeToModes.BIKE, TimeToModes.CAR]:
+                travel_times = tools.get_travel_times_to(self.ORIGINS, self.PLACE, mode, config)
+                lower_bounds = tools.get_travel_times_lower_bounds(self.ORIGINS, self.PLACE, mode)
+                self.assertTrue(all(x >= y for x, y in zip(travel_times, lower_bounds)))
+
+                travel_time = tools.get_travel_time_between(
+                    self.ORIGINS[0], self.PLACE, mode, config
+                )
+                self.assertEqual(travel_times[0], travel_time["time"])
+                self.assertEqual(
+                    [[self.ORIGINS[0][1], self.ORIGINS[0][0]], [self.PLACE[1], self.PLACE[0]]],
+                    travel_time["sections"][0]["geojson"]["coordinates"],
+                )
+            self.assertEqual(0, mock.call_count)
+
+    def test_navitia_isochrone(self):
+        """
+        Check that a single Navitia query is done for all the stations, and
+        that stations are matched with the closest stop.
+        """
+        config = {"navitia_api_key": "test", "gtfs_feed": None}
+        journeys = [
+            {
+                "from": {
+                    "embedded_type": "stop_area",
+                    "stop_area": {"coord": {"lat": str(lat), "lon": str(lng)}},
+                },
+                "durations": {"total": 1000 + i},
+            }
+            for i, (lat, lng) in enumerate(self.ORIGINS[:10])
+        ]
+        with requests_mock.Mocker() as mock:
+            mock.get(tools.NAVITIA_ENDPOINT, json={"journeys": journeys})
+            travel_times = tools.get_travel_times_to(
+                self.ORIGINS, self.PLACE, TimeToModes.PUBLIC_TRANSPORT, config
+            )
+            self.assertEqual(1, mock.call_count)
+        self.assertEqual([1000 + i for i in range(10)] + [None] * 20, travel_times)
+
+
+class TestGTFSRouter(unittest.TestCase):
+    """
+    Checks the local public transport router.
+    """
+
+    STOPS = {
+        "S1": (48.800, 2.30),
+        "S2": (48.818, 2.30),
+        "S3": (48.836, 2.30),
+        # About 100 meters from S3
+        "S3b": (48.8369, 2.30),
+        "S4": (48.854, 2.30),
+    }
+
+    def build_feed(self):
+        """
+        Build a GTFS feed with two lines: A going from S1 to S3 every 10
+        minutes, and B going from S3b to S4 every 15 minutes.
+        """
+        feed_path = tempfile.mkdtemp(prefix="flatisfy-")
+        files = {
+            "stops.txt": ["stop_id,stop_name,stop_lat,stop_lon"]
+            + [
+                "%s,%s,%s,%s" % (stop_id, stop_id, lat, lng)
+                for stop_id, (lat, lng) in self.STOPS.items()
+            ],
+            "routes.txt": ["route_id,route_short_name,route_color", "A,A,FF0000", "B,B,00FF00"],
+            "calendar.txt": [
+                "service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday",
+                "WEEK,1,1,1,1,1,0,0",
+            ],
+            "trips.txt": ["route_id,service_id,trip_id"],
+            "stop_times.txt": ["trip_id,arrival_time,departure_time,stop_id,stop_sequence"],
+        }
+        for route, stops, period in [("A", ["S1", "S2", "S3"], 10), ("B", ["S3b", "S4"], 15)]:
+            for start in range(7 * 60, 10 * 60, period):
+                trip_id = "%s%d" % (route, start)
+                files["trips.txt"].append("%s,WEEK,%s" % (route, trip_id))
+                for i, stop_id in enumerate(stops):
+                    minutes = start + 5 * i
+                    stop_time = "%02d:%02d:00" % (minutes // 60, minutes % 60)
+                    files["stop_times.txt"].append(
+                        "%s,%s,%s,%s,%d" % (trip_id, stop_time, stop_time, stop_id, i + 1)
+                    )
+        for filename, lines in files.items():
+            with open(os.path.join(feed_path, filename), "w") as fh:
+                fh.write("\n".join(lines) + "\n")
+        return feed_path
+
+    def test_timetable_build(self):
+        """
+        Check that the timetable is rebuilt when the content of the feed
+        changes only.
+        """
+        config = {
+            "data_directory": tempfile.mkdtemp(prefix="flatisfy-"),
+            "gtfs_feed": self.build_feed(),
+        }
+        self.assertFalse(gtfs.is_timetable_up_to_date(config))
+        gtfs.build_timetable(config)
+        self.assertTrue(gtfs.is_timetable_up_to_date(config))
+        self.assertEqual(len(self.STOPS), len(gtfs.get_router(config).timetable.stops_names))
+
+        # Touched files are hashed once again only
+        stop_times_path = os.path.join(config["gtfs_feed"], "stop_times.txt")
+        os.utime(stop_times_path, (0, 0))
+        self.assertTrue(gtfs.is_timetable_up_to_date(config))
+        with unittest_mock.patch.object(gtfs, "compute_feed_hash", side_effect=AssertionError):
+            self.assertTrue(gtfs.is_timetable_up_to_date(config))
+
+        with open(stop_times_path, "a") as fh:
+            fh.write("A480,08:00:00,08:00:00,S4,4\n")
+        self.assertFalse(gtfs.is_timetable_up_to_date(config))
+
+    def test_route(self):
+        """
+        Check that the fastest journey is found, with a transfer between the
+        two lines.
+        """
+        router = gtfs.Router(gtfs.Timetable(self.build_feed()))
+        journey = router.route(self.STOPS["S1"], self.STOPS["S4"], 8 * 3600)
+        # Leave S1 at 8:00, arrive at S3 at 8:10 and take B at 8:15
+        self.assertEqual(20 * 60, journey["time"])
+        self.assertEqual(
+            [None, "FF0000", None, "00FF00", None], [x["color"] for x in journey["sections"]]
+        )
+
+        # Arriving by 8:36, take B at 8:30 and A at 8:10 from S1 or 8:15 from
+        # S2, as the next A trip reaches S3 at 8:30
+        self.assertEqual(
+            [25 * 60, 20 * 60, None],
+            router.travel_times_to(
+                [self.STOPS["S1"], self.STOPS["S2"], (45.764, 4.8357)],
+                self.STOPS["S4"],
+                8 * 3600 + 36 * 60,
+            ),
+        )
+        self.assertEqual(
+            25 * 60, router.route(self.STOPS["S1"], self.STOPS["S4"], 8 * 3600 + 10 * 60)["time"]
+        )
+
+
+class TestImageDerivatives(unittest.TestCase):
+    """
+    Checks size-bucketed derivatives of images are generated.
+    """
+
+    def test_derivatives(self):
+        """
+        Check that each derivative is generated, and downscaled to its size
+        bucket.
+        """
+        storage_dir = tempfile.mkdtemp(prefix="flatisfy-")
+        image = PIL.Image.open(TESTS_DATA_DIR + "127028739@seloger.jpg")
+        images.generate_derivatives(image, "127028739@seloger.jpg", storage_dir)
+
+        for size, max_dimension in images.IMAGE_SIZES.items():
+            for extension in images.IMAGE_FORMATS:
+                filename = images.compute_derivative_filename(
+                    "127028739@seloger.jpg", size, extension
+                )
+                if not os.path.isfile(os.path.join(storage_dir, filename)):
+                    # Original image already fits in this size bucket
+                    self.assertLessEqual(max(image.size), max_dimension)
+                    continue
+                derivative = PIL.Image.open(os.path.join(storage_dir, filename))
+                self.assertLessEqual(max(derivative.size), max_dimension)
+                self.assertLessEqual(max(derivative.size), max(image.size))
+
+
+class TestImageDownloader(unittest.TestCase):
+    """
+    Checks concurrent images download.
+    """
+
+    def test_download(self):
+        """
+        Check that images are stored locally and failures are reported.
+        """
+        storage_dir = tempfile.mkdtemp(prefix="flatisfy-")
+        downloader = images.ImageDownloader(
+            storage_dir, max_workers=4, max_workers_per_host=2, max_bandwidth=10**7
+        )
+        urls = ["mock://flatisfy/%d.jpg" % i for i in range(5)] + ["mock://flatisfy/404.jpg"]
+        with requests_mock.Mocker() as mock:
+            with open(TESTS_DATA_DIR + "127028739@seloger.jpg", "rb") as fh:
+                content = fh.read()
+            for url in urls[:-1]:
+                mock.get(url, content=content)
+            mock.get(urls[-1], status_code=404)
+            filenames = downloader.run(urls)
+
+        self.assertIsNone(filenames[urls[-1]])
+        for url in urls[:-1]:
+            self.assertTrue(os.path.isfile(os.path.join(storage_dir, filenames[url])))
+        self.assertEqual(downloader.stats["downloaded"], 5)
+        self.assertEqual(downloader.stats["failed"], 1)
+        self.assertEqual(downloader.stats["bytes"], 5 * len(content))
+
+        # Images already stored should not be downloaded again
+        self.assertEqual(downloader.run(urls[:1]), {urls[0]: filenames[urls[0]]})
+        self.assertEqual(downloader.stats["cached"], 1)
+        # Statistics are per run
+        self.assertEqual((0, 0), (downloader.stats["downloaded"], downloader.stats["bytes"]))
+
+    def test_consistent_hashes(self):
+        """
+        Check that a photo gets the same hash whether it is hashed while
+        mirroring or while detecting duplicates.
+        """
+        config = {
+            "data_directory": tempfile.mkdtemp(prefix="flatisfy-"),
+            "serve_images_locally": True,
+            "image_download_workers": 1,
+            "image_download_workers_per_host": 1,
+            "image_download_max_bandwidth": None,
+        }
+        url = "mock://flatisfy/1.jpg"
+        with requests_mock.Mocker() as mock:
+            # Hashes of the fully decoded and of the draft-decoded photo differ
+            with open(TESTS_DATA_DIR + "124910113@seloger.jpg", "rb") as fh:
+                mock.get(url, content=fh.read())
+            image_service = images.ImageService(config)
+            image_service.mirror([url])
+            self.assertEqual(image_service.get_hash(url), ImageCache().get_hash(url))
+
+    def test_mirror_images(self):
+        """
+        Check that the mirroring stage stores the photos of flats with their
+        derivatives, and skips the photos already stored.
+        """
+        config = {
+            "data_directory": tempfile.mkdtemp(prefix="flatisfy-"),
+            "serve_images_locally": True,
+            "image_download_workers": 2,
+            "image_download_workers_per_host": 2,
+            "image_download_max_bandwidth": None,
+        }
+        storage_dir = os.path.join(config["data_directory"], "images")
+        with open(TESTS_DATA_DIR + "127028739@seloger.jpg", "rb") as fh:
+            content = fh.read()
+        urls = ["mock://flatisfy/%d.jpg" % i for i in range(3)]
+        flats = [{"id": "1@seloger", "photos": [{"url": urls[0]}, {"url": urls[1]}]}]
+        with requests_mock.Mocker() as mock:
+            for url in urls:
+                mock.get(url, content=content)
+            self.assertIs(flats, flatisfy.filters.mirror_images(flats, config))
+            self.assertEqual(2, mock.call_count)
+
+        for photo in flats[0]["photos"]:
+            self.assertTrue(os.path.isfile(os.path.join(storage_dir, photo["local"])))
+            # The original photo is served as the medium JPEG derivative
+            derivatives = [("thumbnail", "jpg"), ("thumbnail", "webp"), ("medium", "webp")]
+            for size, extension in derivatives:
+                derivative = images.compute_derivative_filename(photo["local"], size, extension)
+                self.assertTrue(os.path.isfile(os.path.join(storage_dir, derivative)))
+
+        # Photos already stored are not fetched again
+        flats.append({"id": "2@seloger", "photos": [{"url": urls[1]}, {"url": urls[2]}]})
+        with requests_mock.Mocker() as mock:
+            for url in urls:
+                mock.get(url, content=content)
+            flatisfy.filters.mirror_images(flats, config)
+            self.assertEqual([urls[2]], [x.url for x in mock.request_history])
+        self.assertEqual(flats[0]["photos"][1]["local"], flats[1]["photos"][0]["local"])
+
+
 class TestDuplicates(unittest.TestCase):
     """
     Checks duplicates detection.
@@ -445,8 +1585,22 @@ def run():
     try:
         for testsuite in [
             TestTexts,
+            TestFuzzyMatch,
+            TestSpatialIndex,
+            TestOpendataTable,
+            TestDatabase,
+            TestAddresses,
+            TestJSONStreaming,
+            TestOpendataBuild,
             TestPhoneNumbers,
             TestImageCache,
+            TestTravelTimeCache,
+            TestGeocodingCache,
+            TestBatchedTravelTimes,
+            TestTravelTimesPruning,
+            TestGTFSRouter,
+            TestImageDerivatives,
+            TestImageDownloader,
             TestDuplicates,
             TestPhotos,
         ]:
@@ -5,11 +5,11 @@ output, checking that a value is within a given interval etc.
 """
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import collections
 import datetime
 import itertools
 import json
 import logging
-import math
 import re
 import time
 
@@ -18,13 +18,38 @@ import mapbox
 import requests
 import unidecode
 
-from flatisfy.constants import TimeToModes
+from flatisfy import gtfs
+from flatisfy.constants import (
+    PUBLIC_TRANSPORT_DEPARTURE,
+    TIME_TO_MODES_AVERAGE_SPEEDS,
+    TIME_TO_MODES_DETOUR_FACTOR,
+    TIME_TO_MODES_MAX_SPEEDS,
+    TIME_TO_MODES_OVERHEADS,
+    TimeToModes,
+)
+from flatisfy.geo import SpatialIndex, distances
+
+# distance moved to flatisfy.geo, still exported here for existing callers
+from flatisfy.geo import distance  # pylint: disable=locally-disabled,unused-import
 
 
 LOGGER = logging.getLogger(__name__)
 
 # Constants
 NAVITIA_ENDPOINT = "https://api.navitia.io/v1/coverage/fr-idf/journeys"
+# Maximum duration of the journeys looked for in batched public transport
+# travel times (isochrones), in seconds
+NAVITIA_ISOCHRONE_MAX_DURATION = 2 * 3600
+# Maximum distance in meters between a station and a stop returned by Navitia
+# to consider them as the same
+NAVITIA_STOP_MATCH_DISTANCE = 150
+MAPBOX_MODES = {
+    TimeToModes.WALK: "mapbox/walking",
+    TimeToModes.BIKE: "mapbox/cycling",
+    TimeToModes.CAR: "mapbox/driving",
+}
+# Maximum number of coordinates in a single Mapbox matrix query
+MAPBOX_MATRIX_MAX_COORDINATES = 25
 
 
 def next_weekday(d, weekday):
@@ -93,34 +118,6 @@ def convert_arabic_to_roman_in_text(text):
     return re.sub(r"(\d+)", lambda matchobj: convert_arabic_to_roman(matchobj.group(0)), text)
 
 
-def hash_dict(func):
-    """
-    Decorator to use on functions accepting dict parameters, to transform them
-    into immutable dicts and be able to use lru_cache.
-
-    From https://stackoverflow.com/a/44776960.
-    """
-
-    class HDict(dict):
-        """
-        Transform mutable dictionnary into immutable. Useful to be compatible
-        with lru_cache
-        """
-
-        def __hash__(self):
-            return hash(json.dumps(self))
-
-    def wrapped(*args, **kwargs):
-        """
-        The wrapped function
-        """
-        args = tuple([HDict(arg) if isinstance(arg, dict) else arg for arg in args])
-        kwargs = {k: HDict(v) if isinstance(v, dict) else v for k, v in kwargs.items()}
-        return func(*args, **kwargs)
-
-    return wrapped
-
-
 class DateAwareJSONEncoder(json.JSONEncoder):
     """
     Extend the default JSON encoder to serialize datetimes to iso strings.
@@ -259,44 +256,196 @@ def normalize_string(string, lowercase=True, convert_arabic_numerals=True):
     return string
 
 
-def uniqify(some_list):
+class MultiPatternMatcher(object):
+    """
+    An Aho-Corasick automaton to find all the occurrences of a set of patterns
+    in a text, in a time linear in the length of the text (and the number of
+    matches), whatever the number of patterns.
     """
-    Filter out duplicates from a given list.
 
-    :Example:
+    def __init__(self, patterns):
+        """
+        :param patterns: An iterable of (non empty) strings to look for.
+        """
+        # Trie of the patterns, each node being a dict of transitions
+        self.transitions = [{}]
+        # Pattern ending at each node, if any
+        self.patterns = [None]
+        for pattern in patterns:
+            if not pattern:
+                continue
+            node = 0
+            for char in pattern:
+                next_node = self.transitions[node].get(char)
+                if next_node is None:
+                    next_node = len(self.transitions)
+                    self.transitions[node][char] = next_node
+                    self.transitions.append({})
+                    self.patterns.append(None)
+                node = next_node
+            self.patterns[node] = pattern
+
+        # Build the failure links (longest proper suffix of the node which is
+        # also in the trie) and the output links (longest proper suffix of the
+        # node which is a pattern) with a breadth-first traversal.
+        self.failures = [0] * len(self.transitions)
+        self.outputs = [0] * len(self.transitions)
+        queue = collections.deque(self.transitions[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.transitions[node].items():
+                failure = self.failures[node]
+                while failure and char not in self.transitions[failure]:
+                    failure = self.failures[failure]
+                failure = self.transitions[failure].get(char, 0)
+                if failure == child:
+                    failure = 0
+                self.failures[child] = failure
+                self.outputs[child] = (
+                    failure if self.patterns[failure] is not None else self.outputs[failure]
+                )
+                queue.append(child)
 
-        >>> uniqify([1, 2, 2, 3])
-        [1, 2, 3]
-    """
-    return list(set(some_list))
+    def search(self, text):
+        """
+        Find all the patterns occurring in a text.
+
+        :param text: The text to search in.
+        :return: The set of patterns occurring in ``text``.
 
+        :Example:
 
-def distance(gps1, gps2):
+            >>> sorted(MultiPatternMatcher(["he", "she", "hers"]).search("ushers"))
+            ['he', 'hers', 'she']
+        """
+        found = set()
+        node = 0
+        for char in text:
+            while node and char not in self.transitions[node]:
+                node = self.failures[node]
+            node = self.transitions[node].get(char, 0)
+            match = node if self.patterns[node] is not None else self.outputs[node]
+            while match:
+                found.add(self.patterns[match])
+                match = self.outputs[match]
+        return found
+
+
+def normalize_for_matching(string):
     """
-    Compute the distance between two tuples of latitude and longitude.
+    Normalize the given string for fuzzy matching of names.
 
-    :param gps1: First tuple of (latitude, longitude).
-    :param gps2: Second tuple of (latitude, longitude).
-    :return: The distance in meters.
+    :param string: The string to normalize.
+    :return: The normalized string.
 
     :Example:
 
-        >>> int(distance([48.86786647303717, 2.19368117495212], \
-                         [48.95314107920405, 2.3368043817358464]))
-        14117
+        >>> normalize_for_matching("Saint-Jacques")
+        'st jacques'
+    """
+    return normalize_string(string).replace("saint", "st")
+
+
+class FuzzyMatcher(object):
     """
-    lat1 = math.radians(gps1[0])
-    long1 = math.radians(gps1[1])
+    A prebuilt matcher to look for the best elements of a fixed list of
+    choices matching a query. Choices are normalized once and compiled into a
+    ``MultiPatternMatcher``, so that a query costs about the length of the
+    query, not the number of choices.
+
+    .. seealso :: flatisfy.filters.metadata.fuzzy_match
+    """
+
+    def __init__(self, choices, key=None, normalized_key=None):
+        """
+        :param choices: The list of choices to match with.
+        :param key: A function returning the name to match for each choice.
+            Defaults to the choice itself, for a list of strings.
+        :param normalized_key: A function returning the already normalized
+            (with ``normalize_for_matching``) name of each choice. Defaults
+            to normalizing the name.
+        """
+        self.choices = list(choices)
+        # Map normalized names to the matching names and choices, in their
+        # initial order
+        self.normalized_choices = collections.defaultdict(list)
+        # Map names to the matching choices
+        self.choices_by_name = collections.defaultdict(list)
+        for choice in self.choices:
+            name = key(choice) if key else choice
+            normalized_name = (
+                normalized_key(choice) if normalized_key else normalize_for_matching(name)
+            )
+            self.normalized_choices[normalized_name].append((name, choice))
+            self.choices_by_name[name].append(choice)
+        self.automaton = MultiPatternMatcher(self.normalized_choices.keys())
+
+    def match(self, query, limit=3, threshold=75, choices_filter=None):
+        """
+        Search for the best names in choices matching the query.
+
+        :param query: The string to match.
+        :param limit: The maximum number of items to return. Set to ``None``
+            to return all values above threshold.
+        :param threshold: The score threshold to use.
+        :param choices_filter: An optional function to restrict the choices
+            to consider.
+        :return: Tuples of matching names and associated confidence.
+        """
+        # Get the matches (normalized strings)
+        matches = []
+        for normalized_name in self.automaton.search(normalize_for_matching(query)):
+            # Convert back matches to the first original name
+            name = next(
+                (
+                    name
+                    for name, choice in self.normalized_choices[normalized_name]
+                    if not choices_filter or choices_filter(choice)
+                ),
+                None,
+            )
+            if name is not None:
+                matches.append((name, len(normalized_name)))
 
-    lat2 = math.radians(gps2[0])
-    long2 = math.radians(gps2[1])
+        # Keep only ``limit`` matches.
+        matches.sort(key=lambda x: x[1], reverse=True)
+        if limit:
+            matches = matches[:limit]
 
-    # pylint: disable=locally-disabled,invalid-name
-    a = math.sin((lat2 - lat1) / 2.0) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((long2 - long1) / 2.0) ** 2
-    c = 2.0 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    earth_radius = 6371000
+        # Update confidence
+        if matches:
+            max_confidence = max(match[1] for match in matches)
+            matches = [(x[0], int(x[1] / max_confidence * 100)) for x in matches]
 
-    return earth_radius * c
+        # Filter out matches below threshold
+        return [x for x in matches if x[1] >= threshold]
+
+    def get_choices(self, name, choices_filter=None):
+        """
+        Get the choices with a given name.
+
+        :param name: A name, as returned by ``match``.
+        :param choices_filter: An optional function to restrict the choices
+            to consider.
+        :return: A list of choices.
+        """
+        return [
+            choice
+            for choice in self.choices_by_name.get(name, [])
+            if not choices_filter or choices_filter(choice)
+        ]
+
+
+def uniqify(some_list):
+    """
+    Filter out duplicates from a given list.
+
+    :Example:
+
+        >>> uniqify([1, 2, 2, 3])
+        [1, 2, 3]
+    """
+    return list(set(some_list))
 
 
 def sort_list_of_dicts_by(flats_list, key):
@@ -347,6 +496,51 @@ def merge_dicts(*args):
     return merge_dicts(merged_flat, *args[2:])
 
 
+def get_public_transport_departure():
+    """
+    Get the departure date and time to use to search for public transport
+    routes, see ``PUBLIC_TRANSPORT_DEPARTURE``.
+
+    :return: A datetime object.
+    """
+    return next_weekday(datetime.datetime.now(), PUBLIC_TRANSPORT_DEPARTURE["weekday"]).replace(
+        hour=PUBLIC_TRANSPORT_DEPARTURE["hour"],
+        minute=PUBLIC_TRANSPORT_DEPARTURE["minute"],
+        second=0,
+        microsecond=0,
+    )
+
+
+def get_public_transport_departure_time():
+    """
+    Get the time of day to use to search for public transport routes, see
+    ``PUBLIC_TRANSPORT_DEPARTURE``.
+
+    :return: The number of seconds since midnight.
+    """
+    return PUBLIC_TRANSPORT_DEPARTURE["hour"] * 3600 + PUBLIC_TRANSPORT_DEPARTURE["minute"] * 60
+
+
+def get_travel_time_backend(mode, config):
+    """
+    Get the backend computing the travel times for a mode of transportation,
+    as chosen by ``get_travel_time_between`` and ``get_travel_times_to``.
+
+    :param mode: A TimeToMode enum value for the mode of transportation to use.
+    :param config: A config dict.
+    :return: The name of the backend, along with the hash of the GTFS feed
+        of the timetable for the local router.
+    """
+    if mode == TimeToModes.PUBLIC_TRANSPORT and config["gtfs_feed"]:
+        feed_hash = gtfs.get_timetable_feed_hash(config)
+        return "gtfs:%s" % feed_hash if feed_hash else "gtfs"
+    if mode == TimeToModes.PUBLIC_TRANSPORT:
+        return "navitia"
+    if config["local_travel_times"]:
+        return "local"
+    return "mapbox"
+
+
 def get_travel_time_between(latlng_from, latlng_to, mode, config):
     """
     Query the Navitia API to get the travel time between two points identified
@@ -361,25 +555,27 @@ def get_travel_time_between(latlng_from, latlng_to, mode, config):
 
     .. note ::
 
-        Uses the Navitia API. Requires a ``navitia_api_key`` field to be
-        filled-in in the ``config``.
+        Uses the Navitia API, or the local router if a ``gtfs_feed`` is
+        configured, for ``PUBLIC_TRANSPORT`` mode. Requires a
+        ``navitia_api_key`` field to be filled-in in the ``config`` otherwise.
+        Other modes use the Mapbox API, or are estimated locally (see
+        ``estimate_travel_times``) if ``local_travel_times`` is set.
     """
     sections = []
     travel_time = None
 
-    if mode == TimeToModes.PUBLIC_TRANSPORT:
+    if mode == TimeToModes.PUBLIC_TRANSPORT and config["gtfs_feed"]:
+        # Use the local router
+        router = gtfs.get_router(config)
+        if router:
+            return router.route(latlng_from, latlng_to, get_public_transport_departure_time())
+    elif mode == TimeToModes.PUBLIC_TRANSPORT:
         # Check that Navitia API key is available
         if config["navitia_api_key"]:
-            # Search route for next Monday at 8am to avoid looking for a route
-            # in the middle of the night if the fetch is done by night.
-            date_from = next_weekday(datetime.datetime.now(), 0).replace(
-                hour=8,
-                minute=0,
-            )
             payload = {
                 "from": "%s;%s" % (latlng_from[1], latlng_from[0]),
                 "to": "%s;%s" % (latlng_to[1], latlng_to[0]),
-                "datetime": date_from.isoformat(),
+                "datetime": get_public_transport_departure().isoformat(),
                 "count": 1,
             }
             try:
@@ -424,12 +620,19 @@ def get_travel_time_between(latlng_from, latlng_to, mode, config):
                 "No API key available for travel time lookup. Please provide "
                 "a Navitia API key. Skipping travel time lookup."
             )
-    elif mode in [TimeToModes.WALK, TimeToModes.BIKE, TimeToModes.CAR]:
-        MAPBOX_MODES = {
-            TimeToModes.WALK: "mapbox/walking",
-            TimeToModes.BIKE: "mapbox/cycling",
-            TimeToModes.CAR: "mapbox/driving",
-        }
+    elif mode in MAPBOX_MODES and config["local_travel_times"]:
+        # Estimate it locally, along a straight line
+        travel_time = estimate_travel_times([latlng_from], latlng_to, mode)[0]
+        sections = [
+            {
+                "geojson": {
+                    "type": "LineString",
+                    "coordinates": [[latlng_from[1], latlng_from[0]], [latlng_to[1], latlng_to[0]]],
+                },
+                "color": "000",
+            }
+        ]
+    elif mode in MAPBOX_MODES:
         # Check that Mapbox API key is available
         if config["mapbox_api_key"]:
             try:
@@ -475,6 +678,175 @@ def get_travel_time_between(latlng_from, latlng_to, mode, config):
     return None
 
 
+def get_travel_times_lower_bounds(latlngs_from, latlng_to, mode):
+    """
+    Get lower bounds of the travel times from many points to a single
+    destination, from the distance as the crow flies and the maximum speed of
+    the mode of transportation (see ``TIME_TO_MODES_MAX_SPEEDS``). No API is
+    queried.
+
+    :param latlngs_from: A list of tuples of (latitude, longitude) for the
+        starting points.
+    :param latlng_to: A tuple of (latitude, longitude) for the destination.
+    :param mode: A TimeToMode enum value for the mode of transportation to use.
+    :return: A list of the lower bounds in seconds, in the order of
+        ``latlngs_from``.
+
+    :Example:
+
+        >>> get_travel_times_lower_bounds([[48.86786647303717, 2.19368117495212]], \
+                                          [48.95314107920405, 2.3368043817358464], \
+                                          TimeToModes.WALK)
+        [5647]
+    """
+    if not latlngs_from:
+        return []
+    return [int(x) for x in distances(latlng_to, latlngs_from) / TIME_TO_MODES_MAX_SPEEDS[mode]]
+
+
+def estimate_travel_times(latlngs_from, latlng_to, mode):
+    """
+    Estimate the travel times from many points to a single destination, for
+    any mode of transportation but public transport, from the distance as the
+    crow flies and a calibrated model of the mode (see
+    ``TIME_TO_MODES_AVERAGE_SPEEDS``). No API is queried.
+
+    :param latlngs_from: A list of tuples of (latitude, longitude) for the
+        starting points.
+    :param latlng_to: A tuple of (latitude, longitude) for the destination.
+    :param mode: A TimeToMode enum value for the mode of transportation to use.
+    :return: A list of the estimated travel times in seconds, in the order of
+        ``latlngs_from``.
+
+    :Example:
+
+        >>> estimate_travel_times([[48.86786647303717, 2.19368117495212]], \
+                                  [48.95314107920405, 2.3368043817358464], \
+                                  TimeToModes.WALK)
+        [13109]
+    """
+    if not latlngs_from:
+        return []
+    travel_times = (
+        distances(latlng_to, latlngs_from)
+        * TIME_TO_MODES_DETOUR_FACTOR
+        / TIME_TO_MODES_AVERAGE_SPEEDS[mode]
+        + TIME_TO_MODES_OVERHEADS[mode]
+    )
+    return [int(x) for x in travel_times]
+
+
+def get_travel_times_to(latlngs_from, latlng_to, mode, config):
+    """
+    Get the travel times from many points to a single destination, at once.
+    Only travel times are returned, without the sections of the journeys, so
+    this is meant to find the best starting points before getting their
+    route with ``get_travel_time_between``.
+
+    :param latlngs_from: A list of tuples of (latitude, longitude) for the
+        starting points.
+    :param latlng_to: A tuple of (latitude, longitude) for the destination.
+    :param mode: A TimeToMode enum value for the mode of transportation to use.
+    :param config: A config dict.
+    :return: A list of the travel times in seconds, in the order of
+        ``latlngs_from``. Travel times which could not be fetched are
+        ``None``.
+
+    .. note ::
+
+        Uses the local router if a ``gtfs_feed`` is configured, or a single
+        Navitia isochrone query for ``PUBLIC_TRANSPORT`` mode,
+        with journeys arriving at destination at the time routes are looked
+        for (instead of leaving from the starting points at that time), and
+        up to ``NAVITIA_ISOCHRONE_MAX_DURATION``. Uses
+        Mapbox matrix queries for the other modes, unless
+        ``local_travel_times`` is set. Requires the associated API
+        keys to be filled-in in the ``config``.
+    """
+    travel_times = [None] * len(latlngs_from)
+    if not latlngs_from:
+        return travel_times
+
+    if mode == TimeToModes.PUBLIC_TRANSPORT and config["gtfs_feed"]:
+        router = gtfs.get_router(config)
+        if router:
+            # Journeys arriving at the time routes are looked for, as for the
+            # Navitia isochrones
+            travel_times = router.travel_times_to(
+                latlngs_from, latlng_to, get_public_transport_departure_time()
+            )
+    elif mode == TimeToModes.PUBLIC_TRANSPORT:
+        if not config["navitia_api_key"]:
+            return travel_times
+        payload = {
+            "to": "%s;%s" % (latlng_to[1], latlng_to[0]),
+            "datetime": get_public_transport_departure().isoformat(),
+            "datetime_represents": "arrival",
+            "max_duration": NAVITIA_ISOCHRONE_MAX_DURATION,
+        }
+        try:
+            req = requests.get(
+                NAVITIA_ENDPOINT,
+                params=payload,
+                auth=(config["navitia_api_key"], ""),
+            )
+            req.raise_for_status()
+
+            # Index the stops the journeys start from
+            stops = []
+            for journey in req.json()["journeys"]:
+                place = journey["from"]
+                coord = place[place["embedded_type"]]["coord"]
+                stops.append(
+                    ((float(coord["lat"]), float(coord["lon"])), journey["durations"]["total"])
+                )
+            if not stops:
+                return travel_times
+            stops_index = SpatialIndex(stops, key=lambda x: x[0])
+            for i, latlng_from in enumerate(latlngs_from):
+                for (_, travel_time), stop_distance in stops_index.query_nearest(latlng_from):
+                    if stop_distance <= NAVITIA_STOP_MATCH_DISTANCE:
+                        travel_times[i] = travel_time
+        except (
+            requests.exceptions.RequestException,
+            ValueError,
+            IndexError,
+            KeyError,
+        ) as exc:
+            LOGGER.warning(
+                "An exception occurred during travel times lookup on Navitia: %s.",
+                str(exc),
+            )
+    elif mode in MAPBOX_MODES and config["local_travel_times"]:
+        travel_times = estimate_travel_times(latlngs_from, latlng_to, mode)
+    elif mode in MAPBOX_MODES:
+        if not config["mapbox_api_key"]:
+            return travel_times
+        service = mapbox.DirectionsMatrix(access_token=config["mapbox_api_key"])
+        # Query by batches of starting points, along with the destination
+        batch_size = MAPBOX_MATRIX_MAX_COORDINATES - 1
+        for offset in range(0, len(latlngs_from), batch_size):
+            latlngs_batch = latlngs_from[offset : offset + batch_size]
+            coordinates = [(x[1], x[0]) for x in latlngs_batch] + [(latlng_to[1], latlng_to[0])]
+            try:
+                response = service.matrix(
+                    coordinates,
+                    profile=MAPBOX_MODES[mode],
+                    sources=list(range(len(latlngs_batch))),
+                    destinations=[len(latlngs_batch)],
+                )
+                response.raise_for_status()
+                for i, durations in enumerate(response.json()["durations"]):
+                    travel_times[offset + i] = durations[0]
+            except (requests.exceptions.RequestException, ValueError, IndexError, KeyError) as exc:
+                LOGGER.warning(
+                    "An exception occurred during travel times lookup on Mapbox: %s.",
+                    str(exc),
+                )
+
+    return travel_times
+
+
 def timeit(func):
     """
     A decorator that logs how much time was spent in the function.
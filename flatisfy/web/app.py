@@ -12,6 +12,7 @@ import bottle
 import canister
 
 from flatisfy import database
+from flatisfy.filters import images
 from flatisfy.tools import DateAwareJSONEncoder
 from flatisfy.web.routes import api as api_routes
 from flatisfy.web.configplugin import ConfigPlugin
@@ -42,6 +43,30 @@ def _serve_static_file(filename):
     )
 
 
+def _serve_local_image(size, filename, config):
+    """
+    Helper function to serve a locally stored image, in the requested size
+    bucket. WebP derivatives are served to the browsers accepting them,
+    and we fall back on the original image if no derivative is available.
+    """
+    root = os.path.join(config["data_directory"], "images")
+    if size not in images.IMAGE_SIZES:
+        return bottle.static_file(filename, root=root)
+
+    extensions = list(images.IMAGE_FORMATS.keys())
+    if "image/webp" not in bottle.request.headers.get("Accept", ""):
+        extensions.remove("webp")
+    for extension in extensions:
+        derivative = images.compute_derivative_filename(filename, size, extension)
+        if os.path.isfile(os.path.join(root, derivative)):
+            response = bottle.static_file(derivative, root=root)
+            # The str() call is required as we import unicode_literal and
+            # WSGI headers list should have plain str type.
+            response.set_header(str("Vary"), str("Accept"))
+            return response
+    return bottle.static_file(filename, root=root)
+
+
 def get_app(config):
     """
     Get a Bottle app instance with all the routes set-up.
@@ -118,6 +143,11 @@ def get_app(config):
         "GET",
         lambda filename: _serve_static_file("/.well-known/{}".format(filename)),
     )
+    app.route(
+        "/data/img/<size:re:thumbnail|medium|full>/<filename:path>",
+        "GET",
+        lambda size, filename: _serve_local_image(size, filename, config),
+    )
     app.route(
         "/data/img/<filename:path>",
         "GET",
@@ -103,18 +103,19 @@ def _serialize_flat(flat, config):
     """
     flat = flat.json_api_repr()
 
-    postal_codes = {}
-    for constraint_name, constraint in config["constraints"].items():
-        postal_codes[constraint_name] = flatisfy.data.load_data(PostalCode, constraint, config)
-
     try:
         assert flat["flatisfy_position"]
+        constraint = config["constraints"][flat["flatisfy_constraint"]]
 
         lat = flat["flatisfy_position"]["lat"]
         lng = flat["flatisfy_position"]["lng"]
-        postal_code_data = next(
-            x for x in postal_codes.get(flat["flatisfy_constraint"], []) if x.lat == lat and x.lng == lng
+        postal_codes = flatisfy.data.load_data(PostalCode, constraint, config)
+        # Positions found at the street level are not the ones of the cities
+        rows = postal_codes.lookup("position", (lat, lng)) or postal_codes.lookup(
+            "postal_code", flat["flatisfy_postal_code"]
         )
+        assert rows
+        postal_code_data = postal_codes[rows[0]]
         logging.warn(f"{postal_code_data.name}, {lat}, {lng}")
         flat["flatisfy_postal_code"] = {
             "postal_code": postal_code_data.postal_code,
@@ -122,7 +123,7 @@ def _serialize_flat(flat, config):
             "name": postal_code_data.name,
             "gps": (postal_code_data.lat, postal_code_data.lng),
         }
-    except (AssertionError, StopIteration):
+    except (AssertionError, KeyError):
         flat["flatisfy_postal_code"] = {}
 
     return flat
@@ -0,0 +1,35 @@
+"""Add addresses table
+
+Revision ID: 3c6f2a9e7b41
+Revises: 5b4e0d1c2a7f
+Create Date: 2026-10-19 10:02:13.418306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "3c6f2a9e7b41"
+down_revision = "5b4e0d1c2a7f"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "addresses",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("postal_code", sa.String()),
+        sa.Column("street", sa.String()),
+        sa.Column("normalized_street", sa.String()),
+        sa.Column("number", sa.String()),
+        sa.Column("lat", sa.Float()),
+        sa.Column("lng", sa.Float()),
+    )
+    op.create_index("ix_addresses_postal_code_street", "addresses", ["postal_code", "normalized_street"])
+
+
+def downgrade():
+    op.drop_index("ix_addresses_postal_code_street", table_name="addresses")
+    op.drop_table("addresses")
@@ -0,0 +1,26 @@
+"""Add opendata normalized name columns
+
+Revision ID: 5b4e0d1c2a7f
+Revises: 9e58c66f1ac1
+Create Date: 2026-10-19 09:12:44.512907
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "5b4e0d1c2a7f"
+down_revision = "9e58c66f1ac1"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("postal_codes", sa.Column("normalized_name", sa.String()))
+    op.add_column("public_transports", sa.Column("normalized_name", sa.String()))
+
+
+def downgrade():
+    op.drop_column("postal_codes", "normalized_name")
+    op.drop_column("public_transports", "normalized_name")
@@ -0,0 +1,24 @@
+"""Add opendata builds stat column
+
+Revision ID: 7d3b9f2c6e18
+Revises: e4a1d7b3c925
+Create Date: 2026-10-19 16:42:07.318254
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "7d3b9f2c6e18"
+down_revision = "e4a1d7b3c925"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("opendata_builds", sa.Column("data_file_stat", sa.String()))
+
+
+def downgrade():
+    op.drop_column("opendata_builds", "data_file_stat")
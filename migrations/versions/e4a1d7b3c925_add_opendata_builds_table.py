@@ -0,0 +1,32 @@
+"""Add opendata builds table
+
+Revision ID: e4a1d7b3c925
+Revises: 3c6f2a9e7b41
+Create Date: 2026-10-19 11:24:51.093722
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "e4a1d7b3c925"
+down_revision = "3c6f2a9e7b41"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "opendata_builds",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("table", sa.String()),
+        sa.Column("area", sa.String()),
+        sa.Column("data_file", sa.String()),
+        sa.Column("content_hash", sa.String()),
+        sa.UniqueConstraint("table", "area"),
+    )
+
+
+def downgrade():
+    op.drop_table("opendata_builds")
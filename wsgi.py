@@ -4,11 +4,13 @@ Expose a WSGI-compatible application to serve with a webserver.
 """
 from __future__ import absolute_import, print_function, unicode_literals
 
+import atexit
 import logging
 import os
 import sys
 
 import flatisfy.config
+from flatisfy import database
 from flatisfy.web import app as web_app
 
 
@@ -26,3 +28,6 @@ if CONFIG is None:
 
 
 application = app = web_app.get_app(CONFIG)
+# Release the database connections and the search indexes when the
+# webserver stops
+atexit.register(database.close_db)